@@ -0,0 +1,88 @@
+// Light four-vector helpers that work directly on pt/eta/phi/mass columns.
+//
+// hardware::TLvector() + hardware::InvariantMass({a, b}) builds two four-vector objects and a
+// vector to hold them in every event, only to get one number out. The functions here compute
+// the same quantities from plain numbers, on the stack, with no allocation (all in namespace kinematics::):
+//     InvMass(pt1, eta1, phi1, m1, pt2, eta2, phi2, m2)   invariant mass of the pair
+//     DeltaPhi(phi1, phi2)                                 signed, in [-pi, pi]
+//     DeltaR(eta1, phi1, eta2, phi2)
+// and PtEtaPhiM/PxPyPzE, a minimal four-vector pair for anything more involved (sums of more
+// than two objects, the pt of a system, ...).
+//
+// There are two batched forms:
+//     InvMasses(pt, eta, phi, m, i1, i2)  masses of the pairs (i1[k], i2[k]) of one collection
+//                                          in one event, e.g. all candidate pairs
+//     InvMassBatch(n, pt1, ..., out)       masses of n pairs from contiguous arrays, e.g. a
+//                                          chunk of events exported to numpy;
+//                                          a plain loop the compiler can vectorize
+#ifndef KINEMATICS_H
+#define KINEMATICS_H
+#include <cmath>
+#include <cstddef>
+#include "ROOT/RVec.hxx"
+
+// in a namespace, like TIMBER's hardware::, so nothing clashes with ROOT::VecOps::DeltaPhi and friends
+namespace kinematics {
+
+struct PxPyPzE {
+    double px, py, pz, e;
+    double M2() const { return e*e - px*px - py*py - pz*pz; }
+    // like TLorentzVector::M(): negative for (numerically) space-like vectors
+    double M() const { double m2 = M2(); return m2 < 0. ? -std::sqrt(-m2) : std::sqrt(m2); }
+    double Pt() const { return std::sqrt(px*px + py*py); }
+    PxPyPzE operator+(const PxPyPzE& o) const { return {px + o.px, py + o.py, pz + o.pz, e + o.e}; }
+};
+
+struct PtEtaPhiM {
+    double pt, eta, phi, m;
+    double Px() const { return pt * std::cos(phi); }
+    double Py() const { return pt * std::sin(phi); }
+    double Pz() const { return pt * std::sinh(eta); }
+    double E() const { double p = pt * std::cosh(eta); return std::sqrt(p*p + m*m); }
+    PxPyPzE Cartesian() const { return {Px(), Py(), Pz(), E()}; }
+    PxPyPzE operator+(const PtEtaPhiM& o) const { return Cartesian() + o.Cartesian(); }
+};
+
+inline double DeltaPhi(double phi1, double phi2) {
+    double d = phi1 - phi2;
+    while (d > M_PI) d -= 2*M_PI;
+    while (d <= -M_PI) d += 2*M_PI;
+    return d;
+}
+
+inline double DeltaR(double eta1, double phi1, double eta2, double phi2) {
+    double deta = eta1 - eta2, dphi = DeltaPhi(phi1, phi2);
+    return std::sqrt(deta*deta + dphi*dphi);
+}
+
+inline double InvMass(double pt1, double eta1, double phi1, double m1, double pt2, double eta2, double phi2, double m2) {
+    return (PtEtaPhiM{pt1, eta1, phi1, m1} + PtEtaPhiM{pt2, eta2, phi2, m2}).M();
+}
+
+// Masses of the pairs (i1[k], i2[k]) of one collection. Negative indices give -1.
+inline ROOT::VecOps::RVec<float> InvMasses(const ROOT::VecOps::RVec<float>& pt, const ROOT::VecOps::RVec<float>& eta,
+                                           const ROOT::VecOps::RVec<float>& phi, const ROOT::VecOps::RVec<float>& m,
+                                           const ROOT::VecOps::RVec<int>& i1, const ROOT::VecOps::RVec<int>& i2) {
+    ROOT::VecOps::RVec<float> out(i1.size());
+    for (std::size_t k = 0; k < i1.size(); k++) {
+        int a = i1[k], b = i2[k];
+        out[k] = (a < 0 || b < 0) ? -1.f : InvMass(pt[a], eta[a], phi[a], m[a], pt[b], eta[b], phi[b], m[b]);
+    }
+    return out;
+}
+
+// out[k] = InvMass of (pt1[k], eta1[k], phi1[k], m1[k]) and (pt2[k], ...) for k < n.
+inline void InvMassBatch(std::size_t n, const float* pt1, const float* eta1, const float* phi1, const float* m1,
+                         const float* pt2, const float* eta2, const float* phi2, const float* m2, float* out) {
+    for (std::size_t k = 0; k < n; k++) {
+        // m^2 = m1^2 + m2^2 + 2 (E1 E2 - p1.p2), with p1.p2 = pt1 pt2 (cos(dphi) + sinh(eta1) sinh(eta2))
+        double p1 = pt1[k] * std::cosh(eta1[k]), p2 = pt2[k] * std::cosh(eta2[k]);
+        double e1 = std::sqrt(p1*p1 + double(m1[k])*m1[k]), e2 = std::sqrt(p2*p2 + double(m2[k])*m2[k]);
+        double dot = double(pt1[k]) * pt2[k] * (std::cos(phi1[k] - phi2[k]) + std::sinh(eta1[k]) * std::sinh(eta2[k]));
+        double mass2 = double(m1[k])*m1[k] + double(m2[k])*m2[k] + 2.*(e1*e2 - dot);
+        out[k] = mass2 < 0. ? -std::sqrt(-mass2) : std::sqrt(mass2);
+    }
+}
+
+}
+#endif
@@ -1,7 +1,11 @@
 // Root RVectors are the default type of vector used in RDataFrames
 #include "ROOT/RVec.hxx"
+// std::array is a vector whose size is fixed when compiling, so it never needs the heap
+#include <array>
 // Get some of the functions provided by TIMBER in the hardware namespace
 #include "TIMBER/Framework/include/common.h"
+// Light, allocation-free invariant mass/DeltaR/DeltaPhi on pt/eta/phi/mass columns (kinematics:: namespace)
+#include "Kinematics.h"
 
 /* namespaces allow us to provide a scope to functions, variables, etc
  * Instead of having to type out ROOT::VecOps::RVec every time we want an RVector,
@@ -9,9 +13,15 @@
  * come into conflict with other functions outside of the namespace with the same name */
 using namespace ROOT::VecOps;
 
+/* A note on performance: these functions run once per event, so small costs add up.
+ *  - Inputs are taken as `const RVec<float>&`, a reference to the column the RDataFrame already holds.
+ *    Taking `RVec<float>` (by value) instead makes a copy of every input vector in every event.
+ *  - The pickers return their two indices as a std::array<int,2> instead of an RVec<int>. It lives
+ *    on the stack and needs no memory allocation, and it is indexed the same way: DijetIdxs[0].
+ * bench_modules.C measures the time per event of every function, against by-value versions. */
 
 /* Here we define our first function. 
- * We first declare what the function returns - in this case a vector of integers.
+ * We first declare what the function returns - in this case a pair of integers (a std::array of size 2).
  * We then declare the function name and its arguments. 
  * This function just looks at the angle phi between the two jets and makes sure that 
  * they are at least 90 degrees apart 
@@ -23,7 +33,7 @@ using namespace ROOT::VecOps;
  * 	{phi0, phi1, phi2, phi3}
  * corresponding to the measured phi of each of the four jets.
  * */
-RVec<int> PickDijets(RVec<float> pt, RVec<float> eta, RVec<float> phi, RVec<float> mass) {
+std::array<int,2> PickDijets(const RVec<float>& pt, const RVec<float>& eta, const RVec<float>& phi, const RVec<float>& mass) {
     // initialize two integers representing indices to test values
     int jet0Idx = -1;
     int jet1Idx = -1;
@@ -46,7 +56,7 @@ RVec<int> PickDijets(RVec<float> pt, RVec<float> eta, RVec<float> phi, RVec<floa
         }
       }
     }
-    // The loop has now fully ended. We return the vector of integers representing the indices of
+    // The loop has now fully ended. We return the pair of integers representing the indices of
     // the two jets that are at least 90 degrees apart.
     // If none of the jets in the event are 90 degrees apart, return {-1, -1}
     // Otherwise, we found two jets matching our criteria, return their indices in the original vector.
@@ -59,7 +69,11 @@ RVec<int> PickDijets(RVec<float> pt, RVec<float> eta, RVec<float> phi, RVec<floa
     return {jet0Idx, jet1Idx};
 };
 
-RVec<int> PickOppChargeMuons(RVec<float> muon_charge) {
+// Muon_charge is an Int_t branch in NanoAOD, so it is taken as RVec<int> (an RVec<float> would be a converted copy)
+// A positive muon that comes before any negative one is skipped. It used to be compared with muon_charge[-1],
+// a read out of bounds: when that happened to equal its negative charge, the loop stopped with {-1, i} and the
+// event was lost, even if a pair came later. Those events now return that later pair.
+std::array<int,2> PickOppChargeMuons(const RVec<int>& muon_charge) {
     // initialize two integers representing indices to test values
   int muon0Idx = -1;
   int muon1Idx = -1;
@@ -67,7 +81,7 @@ RVec<int> PickOppChargeMuons(RVec<float> muon_charge) {
     if (muon1Idx == -1) {
       if (muon_charge[iMuon] == -1) {
         muon0Idx = iMuon;
-      } else {
+      } else if (muon0Idx != -1) {  // only once a negative muon has been found, muon_charge[-1] does not exist
         if (muon_charge[muon0Idx] == -muon_charge[iMuon]) {
           muon1Idx = iMuon;
           break;
@@ -78,15 +92,58 @@ RVec<int> PickOppChargeMuons(RVec<float> muon_charge) {
   return {muon0Idx, muon1Idx};
 };
 
+// All opposite-charge pairs of a collection (e.g. muons), with their invariant masses.
+// PickOppChargeMuons() above stops at the first pair it finds. To look at a resonance like the Z we
+// want every candidate pair instead, and one "best" pair, the one closest to a mass hypothesis.
+// The pairs are stored as three arrays of the same length: the indices of the two objects
+// (first < second) and the invariant mass, all filled in one pass over the pairs. The arrays are
+// reserved once per event with the exact number of opposite-charge pairs, so nothing is allocated per pair.
+struct OppChargePairs_t {
+    RVec<int> first, second;   // indices into the collection
+    RVec<float> mass;          // invariant mass of each pair
+    int best = -1;             // index (into first/second/mass) of the pair closest to the hypothesis, -1 if there is none
+};
+
+OppChargePairs_t OppChargePairs(const RVec<float>& pt, const RVec<float>& eta, const RVec<float>& phi, const RVec<float>& mass,
+                                const RVec<int>& charge, float massHypothesis) {
+  OppChargePairs_t pairs;
+  int n = charge.size();
+  int nPositive = 0;
+  for (int i=0; i<n; i++) {
+    if (charge[i] > 0) nPositive++;
+  }
+  int nPairs = nPositive * (n - nPositive);  // every positive with every negative
+  pairs.first.reserve(nPairs);
+  pairs.second.reserve(nPairs);
+  pairs.mass.reserve(nPairs);
+  float bestDistance = 0.;
+  for (int i=0; i<n; i++) {
+    for (int j=i+1; j<n; j++) {
+      if (charge[i] * charge[j] >= 0) continue;
+      float m = kinematics::InvMass(pt[i], eta[i], phi[i], mass[i], pt[j], eta[j], phi[j], mass[j]);
+      if (pairs.best == -1 || std::abs(m - massHypothesis) < bestDistance) {
+        pairs.best = pairs.mass.size();
+        bestDistance = std::abs(m - massHypothesis);
+      }
+      pairs.first.push_back(i);
+      pairs.second.push_back(j);
+      pairs.mass.push_back(m);
+    }
+  }
+  return pairs;
+};
+
 // This is the function for picking which jets are top ID'd. We will take in the indices (idxs) of the jets we defined to be 
 // separated by at least 90 degrees above, then determine which (if not both) belong to the top jet based on  whether it's in the 
 // top mass window [105, 210] GeV and has the requisite TvsQCD score (nominally > 0.94)
-RVec<int> PickTop(RVec<float> mass, RVec<float> tagScore, RVec<int> idxs, std::pair<float,float> massCut, float scoreCut) {
-    if (idxs.size() > 2) {
-	std::cout << "PickTop -- WARNING: You have input more than two indices. Only two accepted. Assuming first two indices.";
-    }
-    // create a vector to hold the values of the indices of our top jet(s)
-    RVec<int> out(2);	    // specify that it contains 2 indices
+// The idxs are the output of PickDijets(). They are a std::array<int,2>, so there are always exactly two
+// (an RVec<int> with more entries used to print a warning and use the first two; it no longer compiles).
+// Before the std::array version, the second line below assigned isTop0 as well, so isTop0 held the
+// result of the second jet and isTop1 was never set: the returned order and which events return
+// {-1, -1} are different now.
+std::array<int,2> PickTop(const RVec<float>& mass, const RVec<float>& tagScore, const std::array<int,2>& idxs, std::pair<float,float> massCut, float scoreCut) {
+    // create an array to hold the values of the indices of our top jet(s)
+    std::array<int,2> out;	    // it contains 2 indices
     float WP = scoreCut;    // store the Working Point we use for the top ID threshold
 
     // get the values of the indices assigned to our compatible (90deg separation) jets
@@ -100,7 +157,7 @@ RVec<int> PickTop(RVec<float> mass, RVec<float> tagScore, RVec<int> idxs, std::p
 
     // main logic for determining which index belongs to the top jet
     isTop0 = (mass[idx0] > m_min) && (mass[idx0] < m_max) && (tagScore[idx0] > WP);
-    isTop0 = (mass[idx1] > m_min) && (mass[idx1] < m_max) && (tagScore[idx1] > WP);
+    isTop1 = (mass[idx1] > m_min) && (mass[idx1] < m_max) && (tagScore[idx1] > WP);
 
     // now apply logic for ordering the resulting index output vector
     if (isTop0 && isTop1) {	// then both jets pass our top ID
@@ -126,12 +183,12 @@ RVec<int> PickTop(RVec<float> mass, RVec<float> tagScore, RVec<int> idxs, std::p
         out[0] = -1;
         out[1] = -1;
     }
-    // we are done, return the vector of the indices of jets meeting top tag
+    // we are done, return the indices of jets meeting top tag
     return out;
 };
 
 // Calculate scalar sum of jet pT
-float sumJetPt(RVec<float> jet_pt) {
+float sumJetPt(const RVec<float>& jet_pt) {
   float sum = 0.;
   for (int ijet=0; ijet<jet_pt.size(); ijet++) {
     sum += jet_pt[ijet];
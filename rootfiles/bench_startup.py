@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+# Startup benchmark for compiling Modules.cc: plain CompileCpp() versus CompileCppCached()
+# with an empty (cold) and a filled (warm) cache. Every measurement is a fresh python
+# process, timed from before "import ROOT" until the first call into the module returns.
+#
+# Usage: python3 bench_startup.py [MODULE] [REPEATS]
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+job = '''
+import sys
+sys.path.insert(0, {here!r})
+import ROOT
+from TIMBER.Tools.Common import CompileCpp
+from modcache import CompileCppCached
+{compile}({module!r})
+ROOT.sumJetPt(ROOT.VecOps.RVec('float')())
+'''
+
+
+def Run(compile, module, cacheDir):
+    env = dict(os.environ, TIMBER_CACHE=cacheDir)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', job.format(here=here, compile=compile, module=module)], env=env, check=True)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    module = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else os.path.join(here, 'Modules.cc'))
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    results = {'CompileCpp (JIT)': [], 'cached, cold': [], 'cached, warm': []}
+    for i in range(repeats):
+        with tempfile.TemporaryDirectory() as cacheDir:
+            results['CompileCpp (JIT)'].append(Run('CompileCpp', module, cacheDir))
+            results['cached, cold'].append(Run('CompileCppCached', module, cacheDir))
+            results['cached, warm'].append(Run('CompileCppCached', module, cacheDir))
+
+    print(f"{'mode':<20} {'min [s]':>8} {'mean [s]':>9}")
+    for mode, times in results.items():
+        print(f'{mode:<20} {min(times):>8.2f} {sum(times)/len(times):>9.2f}')
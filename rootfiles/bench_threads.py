@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# Thread scaling benchmark: runs the muonInvMass.py selection with 1, 2, 4, ... N threads and
+# reports the event loop throughput. Each thread count runs in its own process, since the
+# ROOT thread pool can only be set up once per process.
+#
+# Usage: python3 bench_threads.py INPUT.root [MAX_THREADS]
+
+import os
+import sys
+import json
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+job = '''
+import sys, time, json
+sys.path.insert(0, {here!r})
+import ROOT
+from threads import analyzer
+from modcache import CompileCppCached
+ana = analyzer({input!r}, nThreads={nThreads})
+CompileCppCached({modules!r})
+nEvents = ana.DataFrame.Count()
+ana.Cut('di_muon', 'nMuon >= 2')
+ana.Cut('eta_cut', 'abs(Muon_eta[0]) < 2.1 && abs(Muon_eta[1]) < 2.1')
+ana.Cut('pt_cut', 'Muon_pt[0] >= 15 && Muon_pt[1] > 15')
+ana.Define('OppChargeMuonsIdxs', 'PickOppChargeMuons(Muon_charge)')
+ana.Cut('oppositeMuonExist', 'OppChargeMuonsIdxs[0] > -1 && OppChargeMuonsIdxs[1] > -1')
+ana.ObjectFromCollection('MuonPlus','Muon','OppChargeMuonsIdxs[0]')
+ana.ObjectFromCollection('MuonNeg','Muon','OppChargeMuonsIdxs[1]')
+ana.Define('invMass','kinematics::InvMass(MuonPlus_pt, MuonPlus_eta, MuonPlus_phi, MuonPlus_mass, MuonNeg_pt, MuonNeg_eta, MuonNeg_phi, MuonNeg_mass)')
+h = ana.DataFrame.Histo1D(('h','',150,0.,150.),'invMass')
+start = time.perf_counter()
+h.GetValue()
+print(json.dumps({{'events': nEvents.GetValue(), 'seconds': time.perf_counter() - start, 'integral': h.Integral()}}))
+'''
+
+
+def Run(input, nThreads):
+    code = job.format(here=here, input=input, nThreads=nThreads, modules=os.path.join(here, 'Modules.cc'))
+    out = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python3 bench_threads.py INPUT.root [MAX_THREADS]')
+        exit()
+    input = os.path.abspath(sys.argv[1])
+    maxThreads = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    threadCounts = []
+    n = 1
+    while n < maxThreads:
+        threadCounts.append(n)
+        n *= 2
+    threadCounts.append(maxThreads)
+
+    print(f"{'threads':>7} {'events':>10} {'time [s]':>9} {'events/s':>12} {'speedup':>8}")
+    reference = None
+    for n in threadCounts:
+        r = Run(input, n)
+        if reference is None:
+            reference = r
+        elif r['integral'] != reference['integral']:
+            print(f'WARNING: histogram integral with {n} threads differs from the 1 thread result')
+        print(f"{n:>7} {r['events']:>10} {r['seconds']:>9.2f} {r['events']/r['seconds']:>12.0f} {reference['seconds']/r['seconds']:>8.2f}")
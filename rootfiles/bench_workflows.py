@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# End-to-end benchmark of the timber.py, muonInvMass.py and genJet.py workflows on synthetic
+# inputs of several sizes (see synth.py), so that changes can be compared without the real
+# samples. Every workflow/size runs in a fresh process and reports:
+#   - events/s of the event loop (for genJet, of the whole GenJet() call including the output)
+#   - peak resident memory of the process
+#   - a checksum of the filled histograms, which must not change between code versions that
+#     are supposed to give the same result
+# The synthetic inputs are generated once and kept in $TIMBER_CACHE/synth.
+#
+# Usage: python3 bench_workflows.py [--sizes 10000 100000 1000000] [-j THREADS] [--repeat N]
+#                                   [--workflows timber muonInvMass genJet] [--output results.json]
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from caching import CacheDir, WriteJSON
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+prologue = '''
+import sys, time, json
+sys.path.insert(0, {here!r})
+import ROOT
+ROOT.gROOT.SetBatch(True)
+from threads import analyzer
+'''
+
+jobs = {
+    'timber': '''
+import timber
+ana = analyzer({input!r}, nThreads={nThreads})
+timber.KinematicCuts(ana)
+timber.TopPhiCandidates(ana)
+hists = timber.BookHistos(ana)
+start = time.perf_counter()
+hists['h1'].GetValue()
+seconds = time.perf_counter() - start
+''',
+    'muonInvMass': '''
+import muonInvMass
+ana = analyzer({input!r}, nThreads={nThreads})
+muonInvMass.MuonSelection(ana)
+hists = muonInvMass.BookHistos(ana)
+start = time.perf_counter()
+hists['h1'].GetValue()
+seconds = time.perf_counter() - start
+''',
+    'genJet': '''
+import genJet
+start = time.perf_counter()
+out = genJet.GenJet({input!r}, 'bench', outDir={outDir!r}, nThreads={nThreads})
+seconds = time.perf_counter() - start
+f = ROOT.TFile.Open(out)
+hists = {{k.GetName(): f.Get(k.GetName()) for k in f.GetListOfKeys() if k.GetClassName().startswith('TH')}}
+''',
+}
+
+epilogue = '''
+checksum = sum(h.GetValue().Integral() if hasattr(h, 'GetValue') else h.Integral() for h in hists.values())
+print(json.dumps({'seconds': seconds, 'checksum': checksum}))
+'''
+
+
+def SyntheticInput(nEvents, seed=1):
+    '''Path of a synthetic input with nEvents events, generated if it does not exist yet.'''
+    path = os.path.join(CacheDir('synth'), f'synth_{nEvents}_seed{seed}.root')
+    if not os.path.exists(path):
+        # in a separate process, so the generator's thread settings do not leak into the benchmarks
+        subprocess.run([sys.executable, os.path.join(here, 'synth.py'), path, '-n', str(nEvents), '--seed', str(seed)], check=True)
+    return path
+
+
+def Run(workflow, input, nThreads):
+    '''Run workflow on input in a fresh process. Returns the loop time, histogram checksum and peak RSS in MB.'''
+    with tempfile.TemporaryDirectory() as outDir:
+        code = (prologue + jobs[workflow] + epilogue).format(here=here, input=input, nThreads=nThreads, outDir=outDir)
+        with tempfile.TemporaryFile(mode='w+') as out:
+            p = subprocess.Popen([sys.executable, '-c', code], stdout=out)
+            # wait4 gives the resource usage of this child alone
+            _, status, usage = os.wait4(p.pid, 0)
+            if status != 0:
+                raise Exception(f'Run -- {workflow} on {input} failed')
+            out.seek(0)
+            result = json.loads(out.read().strip().splitlines()[-1])
+    result['peak_rss_mb'] = usage.ru_maxrss / 1024.    # kB on Linux
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the example workflows on synthetic inputs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='numbers of events')
+    parser.add_argument('--workflows', nargs='+', default=list(jobs), choices=list(jobs))
+    parser.add_argument('-j', '--threads', type=int, default=1, help='threads per workflow')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per point, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic inputs')
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workflow':<12} {'events':>10} {'time [s]':>9} {'events/s':>12} {'peak RSS [MB]':>14} {'checksum':>14}")
+    for nEvents in args.sizes:
+        input = SyntheticInput(nEvents, args.seed)
+        for workflow in args.workflows:
+            runs = [Run(workflow, input, args.threads) for i in range(args.repeat)]
+            best = min(runs, key=lambda r: r['seconds'])
+            if len(set(r['checksum'] for r in runs)) > 1:
+                print(f'WARNING: {workflow} gave different histograms in repeated runs')
+            r = dict(best, workflow=workflow, events=nEvents, threads=args.threads,
+                     events_per_s=nEvents / best['seconds'], peak_rss_mb=max(r['peak_rss_mb'] for r in runs))
+            results.append(r)
+            print(f"{workflow:<12} {nEvents:>10} {r['seconds']:>9.2f} {r['events_per_s']:>12.0f} {r['peak_rss_mb']:>14.1f} {r['checksum']:>14.6g}")
+    if args.output:
+        WriteJSON(args.output, results)
@@ -0,0 +1,83 @@
+# Shared helpers for the on-disk caches used by the scripts in this directory.
+#
+# Everything lives under one cache directory ($TIMBER_CACHE, or ~/.cache/timber-docker
+# by default) so it is easy to find and to wipe. The caches are shared between many
+# jobs running at the same time, so anything written there goes through a temporary
+# file or directory that is renamed into place at the end, and slow steps (like
+# compiling) are serialized with a lock file.
+import os
+import json
+import hashlib
+import fcntl
+from contextlib import contextmanager
+
+
+def CacheDir(*sub):
+    '''Path to (and create if needed) a subdirectory of the cache directory.'''
+    path = os.path.join(os.environ.get('TIMBER_CACHE', os.path.expanduser('~/.cache/timber-docker')), *sub)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def FileLock(path):
+    '''Exclusive lock on path (created if needed), held for the body of the with-statement.'''
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def HashStrings(*parts):
+    '''sha256 hex digest of the parts, in order.'''
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(str(p).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def FileChecksum(path):
+    '''sha256 of a file's content.
+
+    Hashing a multi-GB ROOT file on every run would cost as much as reading it, so the
+    checksum is remembered per (path, size, mtime) and only recomputed when one of those
+    changes. Remote files (root://...) cannot be hashed locally and are keyed on their name.
+    '''
+    if '://' in path:
+        return HashStrings('remote', path)
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    memo = os.path.join(CacheDir('checksums'), HashStrings(path) + '.json')
+    stamp = [st.st_size, st.st_mtime_ns]
+    if os.path.exists(memo):
+        with open(memo) as f:
+            entry = json.load(f)
+        if entry['stamp'] == stamp:
+            return entry['sha256']
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    WriteJSON(memo, {'path': path, 'stamp': stamp, 'sha256': h.hexdigest()})
+    return h.hexdigest()
+
+
+def WriteJSON(path, obj):
+    '''Write obj to path atomically, so concurrent readers never see a half-written file.'''
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+def InputFiles(fileName):
+    '''The ROOT files behind an analyzer input: a .root file, a .txt list of them, or a python list of either.'''
+    if isinstance(fileName, (list, tuple)):
+        return [f for name in fileName for f in InputFiles(name)]
+    if fileName.endswith('.txt'):
+        with open(fileName) as f:
+            return [l.strip() for l in f if l.strip() and not l.strip().startswith('#')]
+    return [fileName]
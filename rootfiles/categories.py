@@ -0,0 +1,109 @@
+# Fill histograms for every value of an integer category (e.g. nGenJet) in one event loop.
+#
+# The straightforward way to get one histogram per jet multiplicity is a loop of
+# SetActiveNode() + Cut('nGenJet == n') + Histo1D(). That needs the range of n up front
+# (Max()/Min() -> two extra event loops) and, with a Count().GetValue() per category, one
+# more loop for every n. Instead we book a single 2D histogram per variable with the
+# category on the x-axis. After the (single) event loop each x-bin is projected out into
+# the same 1D histogram a Cut + Histo1D would have produced. The set of categories is
+# found afterwards from the non-empty bins, and everything at or above maxCategory goes
+# into one overflow category.
+#
+# Usage:
+#     split = CategorySplit(ana, 'nGenJet', maxCategory=30)
+#     split.Histo1D('Jet_eta', '{cat}GenJet_eta', '{cat} GenJet #eta;GenJet #eta', 100, -6., 6., 'GenJet_eta')
+#     ...trigger the event loop...
+#     for (cat, key), h in split.Results().items(): ...
+from collections import OrderedDict
+
+
+class CategorySplit(object):
+    '''Per-category histograms of one node, filled in the same event loop as everything else.
+
+    Args:
+        ana: TIMBER analyzer.
+        category (str): Integer column to split on.
+        maxCategory (int): Categories >= maxCategory are merged into one overflow category
+            labelled 'ge<maxCategory>'.
+        node: Node to book on. Defaults to the analyzer's active node.
+        cache: Optional histcache.HistCache to take the histograms from when they are unchanged, or
+            a variations.Variations to fill every histogram for every variation (the categories
+            are those of the nominal).
+    '''
+    def __init__(self, ana, category, maxCategory, node=None, cache=None):
+        if node is None:
+            node = ana.GetActiveNode()
+        self.category = category
+        self.maxCategory = maxCategory
+        self._node = node
+        self._cache = cache
+        self._catColumn = f'{category}_cat'
+        self._defines = []
+        self._df = node.DataFrame
+        self._define(self._catColumn, f'std::min<int>({category}, {maxCategory})')
+        self._counts = self._book('Histo1D', ((f'{category}_cat_counts', '', *self._axis()), self._catColumn))
+        self._booked = OrderedDict()
+
+    def _define(self, name, expression):
+        self._df = self._df.Define(name, expression)
+        self._defines.append(f'{name}={expression}')
+
+    def _book(self, action, args):
+        if self._cache is None:
+            return getattr(self._df, action)(*args)
+        # the Defines made here are not TIMBER nodes, so they go into the cache key explicitly
+        return self._cache.Book(action, args, node=self._node, df=self._df, extra=self._defines)
+
+    def _axis(self):
+        return (self.maxCategory+1, -0.5, self.maxCategory+0.5)
+
+    def _categoryFor(self, column):
+        # Histo2D needs x and y to have the same shape, so vector columns get a vector
+        # of the (per-event) category with one entry per object
+        if 'RVec' not in str(self._df.GetColumnType(column)):
+            return self._catColumn
+        name = f'{column}_{self._catColumn}'
+        if name not in [str(c) for c in self._df.GetDefinedColumnNames()]:
+            self._define(name, f'ROOT::VecOps::RVec<int>({column}.size(), {self._catColumn})')
+        return name
+
+    def Histo1D(self, key, name, title, nbins, lo, hi, column, weight=None):
+        '''Book column for every category. '{cat}' in name and title is replaced by the
+        category label (str.replace, so ROOT latex braces like p_{T} are safe).'''
+        catColumn = self._categoryFor(column)
+        model = (f'{key}_by_{self.category}', '', *self._axis(), nbins, lo, hi)
+        if weight is None:
+            h2 = self._book('Histo2D', (model, catColumn, column))
+        else:
+            h2 = self._book('Histo2D', (model, catColumn, column, weight))
+        self._booked[key] = (name, title, h2)
+
+    def Label(self, cat):
+        return f'ge{cat}' if cat == self.maxCategory else str(cat)
+
+    def Categories(self):
+        '''Categories from the smallest to the largest non-empty one. Triggers the event loop.'''
+        counts = self._counts.GetValue()
+        filled = [b-1 for b in range(1, counts.GetNbinsX()+1) if counts.GetBinContent(b) > 0]
+        if not filled:
+            return []
+        return list(range(min(filled), max(filled)+1))
+
+    def Counts(self):
+        '''OrderedDict of category label -> number of events.'''
+        counts = self._counts.GetValue()
+        return OrderedDict((self.Label(cat), int(counts.GetBinContent(cat+1))) for cat in self.Categories())
+
+    def Results(self, variation=None):
+        '''OrderedDict of (category label, key) -> TH1D, ordered by category then booking order.
+        With a variations.Variations as cache, variation selects the variation (default: the nominal).'''
+        out = OrderedDict()
+        for cat in self.Categories():
+            label = self.Label(cat)
+            for key, (name, title, h2) in self._booked.items():
+                result = h2.Variation(variation) if variation is not None else h2
+                h = result.GetValue().ProjectionY(name.replace('{cat}', label), cat+1, cat+1)
+                h.SetTitle(title.replace('{cat}', label))
+                h.SetDirectory(0)
+                out[(label, key)] = h
+        return out
@@ -0,0 +1,142 @@
+# Single-pass cutflow on top of the TIMBER analyzer.
+#
+# Calling ana.DataFrame.Count().GetValue() after every Cut() runs one full event loop
+# per call, since GetValue() forces the RDataFrame to process the whole input right away.
+# RDataFrame actions are lazy though: if we *book* a Count() (and a Sum() of the event
+# weight) on every node first and only ask for the values afterwards, ROOT fills all of
+# them together in a single event loop - the same loop that fills your histograms, as
+# long as those are booked before the first GetValue()/Draw() as well.
+#
+# Usage:
+#     cf = Cutflow(ana)       # after the last Cut(), before anything is drawn
+#     ...book and draw histograms...
+#     cf.Print()
+#     cf.Save('cutflow.txt')  # .txt, .json or .root
+import json
+import math
+import ROOT
+from nodetools import NodeChain, IsCut
+
+
+class Cutflow(object):
+    '''Raw counts and weighted sums for every cut between the base node and node.
+
+    Args:
+        ana: TIMBER analyzer whose Cut chain should be reported.
+        weight (str): Column to sum for the weighted yields. Ignored (no weighted
+            column in the table) if the column does not exist, e.g. for data.
+        node: Last node of the chain. Defaults to the analyzer's active node.
+        cache: Optional histcache.HistCache to take the yields from when they are unchanged.
+    '''
+    def __init__(self, ana, weight='genWeight', node=None, cache=None):
+        if node is None:
+            node = ana.GetActiveNode()
+        columns = [str(c) for c in node.DataFrame.GetColumnNames()]
+        self.weight = weight if weight in columns else None
+        self._booked = []
+        for n in NodeChain(node):
+            if n.parent is not None and not IsCut(n):
+                continue
+            name = 'all' if n.parent is None else str(n.name)
+            if cache is None:
+                count = n.DataFrame.Count()
+                sumw = n.DataFrame.Sum(self.weight) if self.weight else None
+            else:
+                count = cache.Count(node=n)
+                sumw = cache.Sum(self.weight, node=n) if self.weight else None
+            self._booked.append((name, count, sumw))
+        self._rows = None
+
+    def Rows(self):
+        '''List of dicts with keys name, count and sumw (None if unweighted).
+        The first call triggers the event loop if it has not already run.'''
+        if self._rows is None:
+            self._rows = []
+            for name, count, sumw in self._booked:
+                self._rows.append({
+                    'name': name,
+                    'count': int(count.GetValue()),
+                    'sumw': float(sumw.GetValue()) if sumw is not None else None,
+                })
+        return self._rows
+
+    def Table(self):
+        '''The cutflow as a plain dict {'weight': ..., 'rows': [...]}, e.g. to merge with MergeTables().'''
+        return {'weight': self.weight, 'rows': self.Rows()}
+
+    def Print(self):
+        PrintTable(self.Table())
+
+    def Hist(self, name='cutflow', weighted=False):
+        '''TH1D with one labelled bin per cut, like TIMBER's CutflowHist.'''
+        return TableHist(self.Table(), name, weighted)
+
+    def Save(self, filename):
+        '''Write the table to filename. The format follows the extension (.json, .root or text).'''
+        SaveTable(self.Table(), filename)
+
+
+def PrintTable(table):
+    '''Print a cutflow table (see Cutflow.Table()).'''
+    rows, weight = table['rows'], table['weight']
+    width = max([len(r['name']) for r in rows] + [4])
+    header = f"{'cut':<{width}} {'events':>12} {'eff':>8}"
+    if weight:
+        header += f" {'sum(' + weight + ')':>18}"
+    print(header)
+    print('-' * len(header))
+    first = rows[0]['count']
+    for r in rows:
+        eff = r['count'] / first if first else 0.
+        line = f"{r['name']:<{width}} {r['count']:>12d} {eff:>8.4f}"
+        if weight:
+            line += f" {r['sumw']:>18.6g}"
+        print(line)
+
+
+def SaveTable(table, filename):
+    '''Write a cutflow table (see Cutflow.Table()) to filename. The format follows the extension (.json, .root or text).'''
+    if filename.endswith('.json'):
+        with open(filename, 'w') as f:
+            json.dump(table, f, indent=2)
+    elif filename.endswith('.root'):
+        f = ROOT.TFile.Open(filename, 'RECREATE')
+        TableHist(table, 'cutflow').Write()
+        if table['weight']:
+            TableHist(table, 'cutflow_weighted', weighted=True).Write()
+        f.Close()
+    else:
+        with open(filename, 'w') as f:
+            for r in table['rows']:
+                f.write(f"{r['name']} {r['count']}" + (f" {r['sumw']!r}" if table['weight'] else '') + '\n')
+
+
+def TableHist(table, name='cutflow', weighted=False):
+    '''TH1D with one labelled bin per row of a cutflow table, filled with counts or weighted sums.'''
+    rows = table['rows']
+    h = ROOT.TH1D(name, name, len(rows), 0, len(rows))
+    h.SetDirectory(0)
+    for i, r in enumerate(rows):
+        h.GetXaxis().SetBinLabel(i+1, r['name'])
+        h.SetBinContent(i+1, r['sumw'] if (weighted and table['weight']) else r['count'])
+    return h
+
+
+def MergeTables(tables):
+    '''Add up cutflow tables of the same Cut chain run over different parts of the input.
+    The weighted sums are added with math.fsum, so the result does not depend on the order of tables.'''
+    merged = {'weight': tables[0]['weight'], 'rows': [dict(r) for r in tables[0]['rows']]}
+    for table in tables[1:]:
+        if [r['name'] for r in table['rows']] != [r['name'] for r in merged['rows']]:
+            raise ValueError('MergeTables -- cutflows of different Cut chains cannot be merged')
+    for i, r in enumerate(merged['rows']):
+        r['count'] = sum(t['rows'][i]['count'] for t in tables)
+        if r['sumw'] is not None:
+            r['sumw'] = math.fsum(t['rows'][i]['sumw'] for t in tables)
+    return merged
+
+
+def ChainTables(first, second):
+    '''Cutflow of a chain that was run in two steps, e.g. a skim (first) and the analysis on the skim (second).
+    The 'all' row of second is the last row of first and is dropped.'''
+    return {'weight': first['weight'], 'rows': [dict(r) for r in first['rows']] + [dict(r) for r in second['rows'][1:]]}
@@ -0,0 +1,240 @@
+# Cost-based ordering of independent cuts.
+#
+# A chain of Cut()s is evaluated left to right, and every event stops at the first cut it fails.
+# The cuts of an analysis are written down in the order that makes sense physically, which is not
+# necessarily the cheapest: e.g. muonInvMass.py checks abs(Muon_eta[...]) before the boolean
+# Muon_highPurity flags, which reject more events for less work. For cuts that do not depend on
+# each other, any order selects the same events, and the expected work per event
+#     cost(1) + pass(1) cost(2) + pass(1) pass(2) cost(3) + ...
+# is smallest when the cuts are sorted by cost / (1 - pass), cheap and selective ones first.
+#
+# ApplyCuts() applies a group of such cuts in the declared order, or with optimize=True measures
+# every cut on a sample of events and applies them in the cheapest order. The measurement is a
+# single event loop over the first nSample events of the active node. All cuts are compiled once,
+# into one expression that evaluates every one of them on every sample event, each between two
+# clock readings; an empty slot measured the same way gives the overhead of the clock, which is
+# subtracted. Since the timers are compiled code in the loop, JIT compilation is not part of the
+# cost. The cost is that of evaluating the expression: reading the columns is done by RDataFrame
+# before the expression runs and is not included. The result is kept in $TIMBER_CACHE/cutorder,
+# keyed on the inputs and the Cut/Define chain, so the sample is only measured once.
+#
+# Only put cuts in the group that are safe in any order: a cut that protects another (nMuon >= 2
+# before Muon_eta[1]) has to stay in front of the group.
+#
+# The cutflow of a reordered group (cutflow.py) has its rows in the executed order, with the counts
+# of the executed chain. Those cannot be turned into declared-order counts: an event that fails the
+# first executed cut is never tested against the others. ApplyCuts(..., declaredCounts=True) books
+# the counts and sums of weights of the group in the declared order, on a branch of the graph next to
+# the executed chain, filled in the same event loop, and CutOrder.DeclaredOrder() puts those in place
+# of the rows of the group. That branch evaluates the group once more in the declared order, which
+# costs more than the reordering saves, so it is off by default: ask for it only when the
+# declared-order cutflow is worth a slower loop (--declared-cutflow in timber.py and muonInvMass.py).
+# The counts are only filled if the event loop runs on the graph they were booked on - not when the
+# group went into a skim that is read back from the cache (see CutOrder.Ready()).
+#
+# Usage:
+#     ana.Cut('di_muon', 'nMuon >= 2')
+#     quality = CutGroup('quality')
+#     quality.Add('eta_cut', 'abs(Muon_eta[0]) < 2.1 && abs(Muon_eta[1]) < 2.1')
+#     quality.Add('highPurity_cut', 'Muon_highPurity[0] && Muon_highPurity[1]')
+#     order = ApplyCuts(ana, quality, optimize=True, declaredCounts=True)
+#     ...
+#     PrintTable(order.DeclaredOrder(cutflow.Table()))
+import os
+import json
+import itertools
+from collections import OrderedDict
+import ROOT
+from caching import CacheDir, FileChecksum, HashStrings, InputFiles, WriteJSON
+from skimcache import ChainKey
+
+_timers = '''
+#include <chrono>
+#include <map>
+#include <mutex>
+#include <vector>
+namespace timber_cutorder {
+    using clock = std::chrono::steady_clock;
+    // per thread: seconds and passed events of every slot, and the number of events
+    struct Counters { std::vector<double> time; std::vector<double> pass; double events = 0.; };
+    std::mutex lock;
+    std::map<int, std::vector<Counters*>> all;
+    inline Counters& Mine(int id, int n) {
+        thread_local std::map<int, Counters*> mine;
+        auto it = mine.find(id);
+        if (it != mine.end()) return *it->second;
+        Counters* c = new Counters();
+        c->time.resize(n); c->pass.resize(n);
+        { std::lock_guard<std::mutex> guard(lock); all[id].push_back(c); }
+        mine[id] = c;
+        return *c;
+    }
+    inline void Add(Counters& c, int i, clock::time_point& t, bool pass) {
+        clock::time_point now = clock::now();
+        c.time[i] += std::chrono::duration<double>(now - t).count();
+        c.pass[i] += pass;
+        t = now;
+    }
+    // {seconds, passed events, events} of slot i of measurement id, summed over threads
+    std::vector<double> Collect(int id, int i) {
+        std::vector<double> out(3, 0.);
+        std::lock_guard<std::mutex> guard(lock);
+        for (auto c : all[id]) { out[0] += c->time[i]; out[1] += c->pass[i]; out[2] += c->events; }
+        return out;
+    }
+}
+'''
+# measurements are global to the process
+_ids = itertools.count()
+
+
+class CutOrder(object):
+    '''Declared and executed order of a group of cuts (see ApplyCuts()).
+
+    Attributes:
+        declared (list): Cut names in the declared order.
+        order (list): Cut names in the order they were applied.
+        stats (dict): For a measured group, {name: {'cost': seconds per event, 'pass': fraction}}, else None.
+        counts (list): (name, Count, Sum of the weight or None) booked after each cut in the declared order, or None.
+        weight (str): The weight column summed in counts.
+    '''
+    def __init__(self, declared, order, stats=None, counts=None, weight=None):
+        self.declared = list(declared)
+        self.order = list(order)
+        self.stats = stats
+        self.counts = counts
+        self.weight = weight
+
+    def Ready(self):
+        '''True if the declared-order counts were booked and filled. They are not when the event loop did not
+        run on the graph they were booked on (e.g. the group was applied before a cached skim, see skimcache.py).'''
+        return self.counts is not None and all(count.IsReady() for _, count, _ in self.counts)
+
+    def ExpectedCost(self, order=None):
+        '''Expected time per event of the group applied in order (default: the executed order), from the measured stats.'''
+        if self.stats is None:
+            raise Exception('CutOrder.ExpectedCost -- the cuts were not measured')
+        cost, passed = 0., 1.
+        for name in (self.order if order is None else order):
+            cost += passed * self.stats[name]['cost']
+            passed *= self.stats[name]['pass']
+        return cost
+
+    def DeclaredOrder(self, table):
+        '''Copy of a cutflow table (see cutflow.Cutflow.Table()) with the rows of the group replaced by the
+        declared-order counts: each row has the events passing every cut of the group up to that one in the
+        declared order. Every row of the group gets an 'executed' key with its position in the executed order.'''
+        if not self.Ready():
+            raise Exception('CutOrder.DeclaredOrder -- the declared-order counts were not booked (ApplyCuts(..., declaredCounts=True)) '
+                            'or not filled by the event loop')
+        rows = [dict(r) for r in table['rows']]
+        positions = [i for i, r in enumerate(rows) if r['name'] in self.order]
+        if len(positions) != len(self.order):
+            raise Exception('CutOrder.DeclaredOrder -- the table does not have a row for every cut of the group')
+        weighted = table['weight'] is not None and table['weight'] == self.weight
+        for i, (name, count, sumw) in zip(positions, self.counts):
+            rows[i] = {'name': name, 'count': int(count.GetValue()),
+                       'sumw': float(sumw.GetValue()) if weighted and sumw is not None else None,
+                       'executed': self.order.index(name)}
+        return dict(table, rows=rows)
+
+    def Print(self):
+        print(f"{'cut':<24} {'declared':>8} {'executed':>8} {'cost [ns/event]':>16} {'pass':>8}")
+        for name in self.declared:
+            line = f'{name:<24} {self.declared.index(name):>8d} {self.order.index(name):>8d}'
+            if self.stats is not None:
+                line += f" {self.stats[name]['cost']*1e9:>16.1f} {self.stats[name]['pass']:>8.4f}"
+            print(line)
+        if self.stats is not None:
+            print(f'expected cost per event: {self.ExpectedCost(self.declared)*1e9:.1f} ns declared, '
+                  f'{self.ExpectedCost()*1e9:.1f} ns executed')
+
+
+def ApplyCuts(ana, cuts, optimize=False, nSample=20000, declaredCounts=False, weight='genWeight'):
+    '''Apply a group of cuts that can be evaluated in any order, optionally cheapest first.
+
+    Args:
+        ana: TIMBER analyzer. The cuts go after its active node.
+        cuts: TIMBER CutGroup, or a dict/list of (name, expression) in the declared order.
+        optimize (bool): Measure the cuts (MeasureCuts()) and apply them sorted by cost / (1 - pass).
+            Without it the cuts are applied in the declared order.
+        nSample (int): Events to measure on.
+        declaredCounts (bool): Book the counts of the group in the declared order for CutOrder.DeclaredOrder(),
+            on a branch that evaluates the group a second time. Only useful with optimize; without it the
+            cutflow already has them.
+        weight (str): Column summed next to the declared-order counts, if it exists.
+
+    Returns:
+        CutOrder with the declared and executed order.
+    '''
+    cuts = OrderedDict(cuts.items.items() if hasattr(cuts, 'items') and not callable(cuts.items) else cuts)
+    order, stats, counts = list(cuts), None, None
+    if optimize:
+        stats = MeasureCuts(ana, cuts, nSample)
+        order = OptimalOrder(stats, order)
+    df = ana.GetActiveNode().DataFrame
+    if weight not in [str(c) for c in df.GetColumnNames()]:
+        weight = None
+    if declaredCounts:
+        # a branch next to the executed chain, filled in the same event loop
+        counts = []
+        for name, expression in cuts.items():
+            df = df.Filter(expression)
+            counts.append((name, df.Count(), df.Sum(weight) if weight else None))
+    for name in order:
+        ana.Cut(name, cuts[name])
+    return CutOrder(cuts, order, stats, counts, weight)
+
+
+def OptimalOrder(stats, declared):
+    '''Names of declared sorted by cost / (1 - pass); cuts that reject nothing go last, ties keep the declared order.'''
+    def key(name):
+        s = stats[name]
+        return s['cost'] / (1. - s['pass']) if s['pass'] < 1. else float('inf')
+    return sorted(declared, key=key)
+
+
+def MeasureCuts(ana, cuts, nSample=20000, node=None):
+    '''Cost per event and pass fraction of each cut on its own, on the first nSample events of node, in one event loop.
+
+    Args:
+        ana: TIMBER analyzer.
+        cuts (dict): {name: expression}.
+        nSample (int): Events to measure on.
+        node: Node to measure on. Defaults to the analyzer's active node.
+
+    Returns:
+        {name: {'cost': seconds per event, 'pass': fraction}}, also saved in $TIMBER_CACHE/cutorder.
+    '''
+    if node is None:
+        node = ana.GetActiveNode()
+    key = HashStrings(*[f'{f}:{FileChecksum(f)}' for f in InputFiles(ana.fileName)], ChainKey(node),
+                      *[f'{name}:{expression}' for name, expression in cuts.items()], nSample)
+    path = os.path.join(CacheDir('cutorder'), key + '.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+
+    # Range() is not available with IMT; there the filter on the entry number rejects the other
+    # events before any of their columns are read
+    if ROOT.IsImplicitMTEnabled():
+        sample = node.DataFrame.Filter(f'rdfentry_ < {nSample}')
+    else:
+        sample = node.DataFrame.Range(nSample)
+    if not hasattr(ROOT, 'timber_cutorder'):
+        ROOT.gInterpreter.Declare(_timers)
+    # slot 0 is empty and measures the clock itself; every cut is evaluated on every event, without short-circuit
+    k = next(_ids)
+    expressions = ['true'] + list(cuts.values())
+    body = ' '.join(f'timber_cutorder::Add(_c, {i}, _t, ({e}));' for i, e in enumerate(expressions))
+    measure = (f'[&]{{ auto& _c = timber_cutorder::Mine({k}, {len(expressions)}); _c.events++; '
+               f'auto _t = timber_cutorder::clock::now(); {body} return true; }}()')
+    sample.Filter(measure).Count().GetValue()
+    clock, _, nEvents = ROOT.timber_cutorder.Collect(k, 0)
+    stats = OrderedDict()
+    for i, name in enumerate(cuts, 1):
+        seconds, passed, _ = ROOT.timber_cutorder.Collect(k, i)
+        stats[name] = {'cost': max(seconds - clock, 0.) / nEvents if nEvents else 0.,
+                       'pass': passed / nEvents if nEvents else 1.}
+    WriteJSON(path, stats)
+    return stats
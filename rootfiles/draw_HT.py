@@ -2,63 +2,54 @@
 
 import ROOT
 import os
+import sys
+from samples import QCDSamples
+from rescale import ScaleFactor
 
-ROOT.gROOT.SetBatch(True)
-ROOT.gStyle.SetPadRightMargin(.15)
-ROOT.gStyle.SetPadTopMargin(0.1)
-ROOT.gStyle.SetPadBottomMargin(0.14)
-ROOT.gStyle.SetPadLeftMargin(0.15)
+# colors and gStyle settings shared with plots.py
+from style import colors, ApplyStyle
 
-# colors
-color_comp1=634    # kRed+2
-color_comp2=862    # kAzure+2
-color_comp3=797    # kOrange-3
-color_comp4=882    # kViolet+2
-color_comp5=419    # kGreen+3
-color_comp6=603    # kBlue+3
-color_comp7=802    # kOrange+2
-color_comp8=616    # kMagenta
-color_comp9=600    # kBlue
-color_comp10=434   # kCyan+2
-color_comp11=800   # kOrange
-color_comp12=417   # kGreen+1
-color_comp13=632   # kRed
+ApplyStyle()
 
-colors = {}
-colors['color_comp1'] = color_comp1
-colors['color_comp2'] = color_comp2
-colors['color_comp3'] = color_comp3
-colors['color_comp4'] = color_comp4
-colors['color_comp5'] = color_comp5
-colors['color_comp6'] = color_comp6
-colors['color_comp7'] = color_comp7
-colors['color_comp8'] = color_comp8
-colors['color_comp9'] = color_comp9
-colors['color_comp10'] = color_comp10
-colors['color_comp11'] = color_comp11
-colors['color_comp12'] = color_comp12
-colors['color_comp13'] = color_comp13
 
-QCDSamples = [
-    "GenJet_QCD_HT50to100.root",
-    "GenJet_QCD_HT100to200.root",
-    "GenJet_QCD_HT200to300.root",
-    "GenJet_QCD_HT300to500.root",
-    "GenJet_QCD_HT500to700.root",
-    "GenJet_QCD_HT700to1000.root",
-    "GenJet_QCD_HT1000to1500.root",
-    "GenJet_QCD_HT1500to2000.root",
-    "GenJet_QCD_HT2000toInf.root"
-]
-
-if __name__ == '__main__':
+def DrawHT(fileNames, output, lazy=False, store=None):
+    '''Overlay GenJet_HT of every file in fileNames and save the canvas to output.
+    With lazy=True the files are unscaled genJet.py outputs and each histogram is
+    scaled to the luminosity when it is read (see rescale.ScaleFactor).
+    With a histstore.HistStore, fileNames are names of samples in the store and nothing
+    but the store is opened.'''
+    if store is not None:
+        hists = []
+        for sample in fileNames:
+            if not store.Has(sample, "GenJet_HT"): continue
+            hist = store.Get(sample, "GenJet_HT")
+            if lazy:
+                scale = ScaleFactor(sample, store=store)
+                if scale is None: continue
+                hist = hist.Scale(scale)
+            hists.append((sample.split(".root")[0], hist.ToROOT(sample.split(".root")[0])))
+        _Draw(hists, output)
+        return
     fileInArray = []
-    
-    for sample in QCDSamples:
-        sample = "plots_fullSample_rescale/" + sample
-        if not os.path.exists(sample): continue
+    for sample in fileNames:
         fileInArray.append(ROOT.TFile.Open(sample,"READ"))
     
+    hists = []
+    for fileIn in fileInArray:
+        basename = os.path.basename(fileIn.GetName())
+        label = basename.split(".root")[0]
+        
+        hist = fileIn.Get("GenJet_HT")
+        if lazy:
+            scale = ScaleFactor(fileIn.GetName())
+            if scale is None: continue
+            hist.Scale(scale)
+        hists.append((label, hist))
+    _Draw(hists, output)
+
+
+def _Draw(hists, output):
+    '''Overlay the (label, TH1) pairs of hists and save the canvas to output.'''
     ROOT.gStyle.SetOptStat(0)
     can = ROOT.TCanvas("can", "", 800, 600)
     can.SetLogy()
@@ -66,13 +57,7 @@ if __name__ == '__main__':
     leg = ROOT.TLegend(0.5, 0.6, 0.85, 0.9)
     
     i = 0
-    for fileIn in fileInArray:
-        # str(TFile) = 'Name: plots/GenJet_QCD_HT50to100.root Title: '
-        nameFromTFile = str(fileIn)[str(fileIn).find("Name")+6:str(fileIn).find("Title")-1]
-        basename = nameFromTFile.split("/")[-1]
-        label = basename.split(".root")[0]
-        
-        hist = fileIn.Get("GenJet_HT")
+    for label, hist in hists:
         hist.GetYaxis().SetTitle("Scale to 100 fb^{-1}")
         hist.Draw("hist same")
         hist.SetLineColor(colors['color_comp{}'.format(i+1)])
@@ -84,4 +69,25 @@ if __name__ == '__main__':
         
         i += 1
     
-    can.Print("plots/QCD_HT_fullSample_rescale100ifb.png")
\ No newline at end of file
+    can.Print(output)
+
+
+if __name__ == '__main__':
+    # --lazy: draw the unscaled genJet.py outputs from plots/, scaling them while reading
+    lazy = '--lazy' in sys.argv
+    # --store PATH: read the histograms from a histogram store (histstore.py, e.g. filled by genJet.py --store
+    # and scaled by rescale.py --store) instead of one ROOT file per sample
+    if '--store' in sys.argv:
+        from histstore import HistStore
+        store = HistStore(sys.argv[sys.argv.index('--store') + 1])
+        DrawHT(QCDSamples, "plots/QCD_HT_fullSample_rescale100ifb.png", lazy=lazy, store=store)
+        sys.exit(0)
+    inDir = "plots/" if lazy else "plots_fullSample_rescale/"
+    fileNames = []
+    
+    for sample in QCDSamples:
+        sample = inDir + sample
+        if not os.path.exists(sample): continue
+        fileNames.append(sample)
+    
+    DrawHT(fileNames, "plots/QCD_HT_fullSample_rescale100ifb.png", lazy=lazy)
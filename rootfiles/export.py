@@ -0,0 +1,212 @@
+# Streaming export of selected events to NumPy, Arrow, Parquet or Feather.
+#
+# ana.DataFrame.AsNumpy(columns) gives every selected event at once, so the memory it needs
+# grows with the dataset. Export() instead snapshots the columns of the selected events into a
+# temporary ROOT file (in $TIMBER_CACHE/export by default) and reads that back in chunks of a
+# fixed number of events, so at most one chunk is in memory at a time. The chunks are read
+# columnar: with uproot.iterate() in one pass over the file if uproot is installed, otherwise with
+# Range(begin, end).AsNumpy() on an RDataFrame of the file, where every chunk is a short event
+# loop that skips the entries before it (without reading them) and compiles its Take()s:
+#   - Chunks(chunkSize, 'numpy') yields {column: numpy array}. Vector columns are object arrays with
+#     one entry per event: a numpy array with uproot, else an RVec, which numpy.asarray() views
+#     without a copy (as long as the chunk is kept).
+#   - Chunks(chunkSize, 'arrow') yields pyarrow.RecordBatch, with vector columns as list arrays.
+#   - Write('out.parquet') / Write('out.feather') writes all chunks to one Parquet or Feather (Arrow IPC) file.
+# pyarrow is only needed for Arrow, Parquet and Feather.
+#
+# With lazy=True the snapshot is only booked, and is filled in the next event loop of the analyzer,
+# together with the histograms booked on it; reading the chunks afterwards does not run the analysis
+# again. That loop only is the same as the histograms' if one runs: when a histcache.HistCache finds
+# every histogram cached, no loop runs for them and the snapshot runs its own. Without lazy the
+# snapshot runs its own event loop right away.
+#
+# With IMT (see threads.py) the events are written in the order the threads finish them, not in the
+# order of the input. Without uproot the chunks are read single-threaded, since Range() is not
+# available with IMT.
+#
+# The snapshot is what lets the chunks be read after the one event loop, without running the
+# analysis again per chunk, so it needs scratch disk for the exported columns of every selected
+# event (compressed). It is deleted by Close(), or at the latest when the Export is garbage
+# collected or the interpreter exits, also when the event loop or a conversion failed.
+#
+# Usage:
+#     export = Export(ana, ['Top_pt', 'Phi_pt', 'mtphi'], lazy=True)
+#     h = ana.DataFrame.Histo1D(...)
+#     h.Draw()                          # fills h and the export
+#     for chunk in export.Chunks(100000):
+#         model.partial_fit(...)
+#     export.Write('events.parquet')
+#     export.Close()                    # or use it in a with-statement
+import os
+import weakref
+import tempfile
+from contextlib import contextmanager
+import numpy
+import ROOT
+from caching import CacheDir
+from skimcache import ExpandColumns
+
+
+class Export(object):
+    '''Columns of the selected events, snapshotted to a temporary file and read back in chunks.
+
+    Args:
+        ana: TIMBER analyzer.
+        columns (list): Columns to export; shell-style wildcards are allowed. Missing names are ignored.
+        node: Node whose events are exported. Defaults to the analyzer's active node.
+        lazy (bool): Only book the snapshot, to fill it in the next event loop of the analyzer.
+        directory (str): Where to keep the temporary file. Defaults to $TIMBER_CACHE/export.
+        treeName (str): Name of the tree in the temporary file.
+    '''
+    def __init__(self, ana, columns, node=None, lazy=False, directory=None, treeName='Events'):
+        # a pruning analyzer defines the ObjectFromCollection() columns when they are first used (see pruning.py)
+        if node is None and hasattr(ana, 'Require'):
+            ana.Require(*columns)
+        if node is None:
+            node = ana.GetActiveNode()
+        self.columns = ExpandColumns(node, columns)
+        if not self.columns:
+            raise Exception(f'Export -- none of {columns} exist')
+        self.treeName = treeName
+        fd, self.path = tempfile.mkstemp(suffix='.root', prefix='export_', dir=directory or CacheDir('export'))
+        os.close(fd)
+        # removes the file when this object goes away or at exit, whatever went wrong before Close()
+        self._remove = weakref.finalize(self, _Remove, self.path)
+        options = ROOT.RDF.RSnapshotOptions()
+        options.fLazy = True
+        try:
+            self._snapshot = node.DataFrame.Snapshot(treeName, self.path, ROOT.std.vector('string')(self.columns), options)
+            if not lazy:
+                self._snapshot.GetValue()
+        except Exception:
+            self.Close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def Entries(self):
+        '''Number of exported events. Runs the event loop if it has not run yet.'''
+        self._snapshot.GetValue()
+        f = ROOT.TFile.Open(self.path)
+        tree = f.Get(self.treeName)
+        n = tree.GetEntries() if tree else 0
+        f.Close()
+        return n
+
+    def Chunks(self, chunkSize=100000, format='numpy'):
+        '''Yield the exported events in chunks of chunkSize events (the last one can be shorter).
+
+        Args:
+            chunkSize (int): Events per chunk.
+            format (str): 'numpy' for dicts of numpy arrays, 'arrow' for pyarrow.RecordBatch.
+        '''
+        if format not in ('numpy', 'arrow'):
+            raise ValueError(f"Export.Chunks -- format must be 'numpy' or 'arrow', not {format!r}")
+        n = self.Entries()
+        if n == 0:
+            return
+        for arrays in _ReadChunks(self.path, self.treeName, self.columns, chunkSize, n):
+            yield _ArrowBatch(arrays, self.columns) if format == 'arrow' else _NumpyChunk(arrays, self.columns)
+
+    def Write(self, path, chunkSize=100000):
+        '''Write all events to path: Parquet for .parquet, Feather (Arrow IPC) for .feather/.arrow/.ipc.
+        The file is written chunk by chunk, through a temporary file that is renamed into place at the end.'''
+        pa = _Arrow()
+        tmp = f'{path}.{os.getpid()}.tmp'
+        writer = None
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            openWriter = lambda schema: pq.ParquetWriter(tmp, schema)
+        elif path.endswith(('.feather', '.arrow', '.ipc')):
+            openWriter = lambda schema: pa.ipc.new_file(tmp, schema)
+        else:
+            raise ValueError(f'Export.Write -- unknown format of {path}, use .parquet or .feather')
+        try:
+            for batch in self.Chunks(chunkSize, 'arrow'):
+                if writer is None:
+                    writer = openWriter(batch.schema)
+                writer.write_table(pa.Table.from_batches([batch]))
+            if writer is None:
+                # no events selected: an empty file with the column names
+                writer = openWriter(pa.schema([(c, pa.null()) for c in self.columns]))
+            writer.close()
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return path
+
+    def Close(self):
+        '''Delete the temporary file.'''
+        self._remove()
+
+
+def _Remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _ReadChunks(path, treeName, columns, chunkSize, n):
+    '''Yield {column: numpy array} for consecutive windows of chunkSize of the n entries of the tree.'''
+    try:
+        import uproot
+    except ImportError:
+        uproot = None
+    if uproot is not None:
+        for arrays in uproot.iterate(f'{path}:{treeName}', columns, step_size=chunkSize, library='np'):
+            yield arrays
+        return
+    with _SingleThreaded():
+        df = ROOT.RDataFrame(treeName, path)
+    for begin in range(0, n, chunkSize):
+        # IMT is back on while the caller has the chunk
+        with _SingleThreaded():
+            arrays = df.Range(begin, min(begin + chunkSize, n)).AsNumpy(columns)
+        yield arrays
+
+
+@contextmanager
+def _SingleThreaded():
+    '''Turn IMT off for the body of the with-statement, and back on with the same number of threads after.'''
+    nThreads = ROOT.GetImplicitMTPoolSize() if ROOT.IsImplicitMTEnabled() else 0
+    if nThreads:
+        ROOT.DisableImplicitMT()
+    try:
+        yield
+    finally:
+        if nThreads:
+            ROOT.EnableImplicitMT(nThreads)
+
+
+def _NumpyChunk(arrays, columns):
+    # no copies: AsNumpy()'s object arrays keep alive the RVecs their elements point into
+    return {c: arrays[c] for c in columns}
+
+
+def _ArrowBatch(arrays, columns):
+    pa = _Arrow()
+    fields = []
+    for c in columns:
+        a = arrays[c]
+        if a.dtype == object:
+            parts = [numpy.asarray(v) for v in a]
+            offsets = numpy.zeros(len(parts) + 1, dtype=numpy.int32)
+            offsets[1:] = numpy.cumsum([len(p) for p in parts])
+            values = numpy.concatenate(parts) if parts else numpy.zeros(0)
+            fields.append(pa.ListArray.from_arrays(pa.array(offsets), pa.array(values)))
+        else:
+            fields.append(pa.array(a))
+    return pa.RecordBatch.from_arrays(fields, names=columns)
+
+
+def _Arrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError:
+        raise Exception('Export -- Arrow, Parquet and Feather output need pyarrow (pip install pyarrow)')
+    return pyarrow
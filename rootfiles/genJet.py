@@ -1,65 +1,200 @@
 #!/usr/bin/python3
 
-# Start by importing the main TIMBER class, the analyzer
-from TIMBER.Analyzer import analyzer
-# next, import some of TIMBER's useful tools
+# Start by importing some of TIMBER's useful tools
 from TIMBER.Tools.Common import *
+# next, the main TIMBER class, the analyzer. threads.analyzer is TIMBER's analyzer
+# plus an nThreads argument to run the event loop on several cores (see threads.py)
+from threads import analyzer, ParseThreads
 # and pyROOT
 import ROOT
+# CompileCpp() with an on-disk cache of the compiled library, see modcache.py
+from modcache import CompileCppCached
+import os
 import sys
+import functools
+from categories import CategorySplit
+# results of identical earlier runs, see histcache.py
+from histcache import HistCache
+# checksums of the code for the key of incremental.Update(), see GenJetIncremental()
+from caching import FileChecksum, HashStrings
+# every histogram under weight variations in the same event loop, see variations.py
+from variations import Variations, NanoAODWeights
+
+# multiplicities at or above this are merged into a single overflow category
+MAX_NJET = 30
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Modules.cc')
+# the files whose content changes the output of GenJet()
+CODE = [os.path.join(os.path.dirname(os.path.abspath(__file__)), f) for f in ('genJet.py', 'categories.py', 'variations.py')] + [MODULES]
+OUTDIR = '/home/physicist/rootfiles/plots'
 
-if __name__ == '__main__':
-    
-    if len(sys.argv) >= 3:
-        print(f"argumrnts:{sys.argv[1]}---{sys.argv[2]}")
-        fileDir = sys.argv[1]
-        prc = sys.argv[2]
-        print(f"Process type: {prc}")
-    else:
-        print("Usage: python3 genJet.py PATH_TO_NTUPLE PROCESS_NAME")
-        exit()
 
-    ana = analyzer(fileDir)
-    max_nJets = int(ana.DataFrame.Max('nGenJet').GetValue())
-    min_nJets = int(ana.DataFrame.Min('nGenJet').GetValue())
-    print("Maximum and minimum nGenJet are ", min_nJets, max_nJets)
+def GenJet(fileDir, prc, outDir=OUTDIR, nThreads=None, useCache=False, store=None, variations=None):
+    '''Fill the GenJet histograms of process prc from fileDir (.root or .txt list) into outDir/GenJet_<prc>.root.
+    With useCache, histograms unchanged since an earlier run are read from the HistCache.
+    With store (the path of a histstore.HistStore), they are also put in the store as sample GenJet_<prc>.root.
+    With variations ({name: event weight expression}, or 'nano' for the NanoAOD scale and parton-shower
+    weights), every histogram is also filled with each weight in the same event loop and written to a
+    directory of that name, with the sum of the weights as its genEventSumw.
+    Returns the path of the output file.'''
+    ana = analyzer(fileDir, nThreads=nThreads)
     
     # compile modules
-    CompileCpp('Modules.cc')
+    CompileCppCached(MODULES)
     
     # define new variables
     ana.Define('GenJet_HT','sumJetPt(GenJet_pt)')
     
+    # HistCache books like the RDataFrame, but skips the event loop if all results are already cached
+    cache = HistCache(ana, code=[MODULES]) if useCache else None
+    booker = cache if useCache else ana.DataFrame
+    if variations == 'nano':
+        variations = NanoAODWeights(ana.DataFrame.GetColumnNames(), nominal=None)
+    if variations and 'nominal' in variations:
+        raise ValueError("GenJet -- 'nominal' is the unweighted histograms at the top of the file, choose another variation name")
+    if variations:
+        # the nominal stays unweighted, as without variations
+        booker = Variations(ana, [('nominal', None)] + list(variations.items()), cache=cache)
+        sumWeights = booker.SumWeights()
+    
     hist_dict = {
         'nJet' : None,
         'GenJet_HT' : None,
     }
     
     # histo pre nJet cut
-    hist_dict['nJet'] = ana.DataFrame.Histo1D(('nGenJet','Number of GenJet;nGenJet',30,0.,30),'nGenJet')
-    hist_dict['GenJet_HT'] = ana.DataFrame.Histo1D(('GenJet_HT','Scalar sum of GenJet p_{T};GenJet_HT [GeV]',250,0.,5000.),'GenJet_HT')
-    
-    preJetCutNode = ana.GetActiveNode()
+    hist_dict['nJet'] = booker.Histo1D(('nGenJet','Number of GenJet;nGenJet',30,0.,30),'nGenJet')
+    hist_dict['GenJet_HT'] = booker.Histo1D(('GenJet_HT','Scalar sum of GenJet p_{T};GenJet_HT [GeV]',250,0.,5000.),'GenJet_HT')
     
-    for nJet in range(min_nJets, max_nJets+1):
-        print(f'---------- Filtering for nGenJet == {nJet} ----------')
-        ana.SetActiveNode(preJetCutNode)
-        print('Counts: ', ana.DataFrame.Count().GetValue())
-        # keep all events with at exactly n gen jets
-        ana.Cut(f'{nJet}GenJet_cut', f'nGenJet == {nJet}')
-        print('Counts after cut: ', ana.DataFrame.Count().GetValue())
+    # Per-multiplicity histograms. Rather than one Cut('nGenJet == n') per multiplicity (and a Max/Min pass to
+    # find the range), every histogram is split by nGenJet inside a single event loop - see categories.py.
+    # Events with MAX_NJET or more jets end up in the 'ge{MAX_NJET}' category.
+    split = CategorySplit(ana, 'nGenJet', MAX_NJET, cache=booker if variations else cache)
+    split.Histo1D('Jet_eta',  '{cat}GenJet_eta' ,'{cat} GenJet #eta;GenJet #eta',100,-6.,6.,'GenJet_eta')
+    split.Histo1D('Jet_phi',  '{cat}GenJet_phi' ,'{cat} GenJet #phi;GenJet #phi',100,-4.,4.,'GenJet_phi')
+    split.Histo1D('Jet_pt',   '{cat}GenJet_pt'  ,'{cat} GenJet p_{T};GenJet p_{T} [GeV]',250,0.,5000.,'GenJet_pt')
+    split.Histo1D('Jet_mass', '{cat}GenJet_mass','{cat} GenJet mass;GenJet mass [GeV]',100,0.,400.,'GenJet_mass')
     
-        hist_dict[f'{nJet}Jet_eta']  = ana.DataFrame.Histo1D((f'{nJet}GenJet_eta' ,f'{nJet} GenJet #eta;GenJet #eta',100,-6.,6.),'GenJet_eta')
-        hist_dict[f'{nJet}Jet_phi']  = ana.DataFrame.Histo1D((f'{nJet}GenJet_phi' ,f'{nJet} GenJet #phi;GenJet #phi',100,-4.,4.),'GenJet_phi')
-        hist_dict[f'{nJet}Jet_pt']   = ana.DataFrame.Histo1D((f'{nJet}GenJet_pt'  ,'%d GenJet p_{T};GenJet p_{T} [GeV]' % nJet,250,0.,5000.),'GenJet_pt')
-        hist_dict[f'{nJet}Jet_mass'] = ana.DataFrame.Histo1D((f'{nJet}GenJet_mass',f'{nJet} GenJet mass;GenJet mass [GeV]',100,0.,400.),'GenJet_mass')
+    # Normalization for rescale.py, filled in the same event loop: the number of events and,
+    # for MC, the sum of generator weights
+    nEvents = booker.Count()
+    if 'genWeight' in ana.DataFrame.GetColumnNames():
+        sumw = booker.Sum('genWeight')
+    else:
+        sumw = nEvents
     
+    # this is the only event loop of the job
+    print('Counts: ', nEvents.GetValue())
+    counts = split.Counts()
+    print("Minimum and maximum nGenJet are ", next(iter(counts), None), next(reversed(counts), None))
+    for label, count in counts.items():
+        print(f'Counts for nGenJet == {label}: ', count)
+    for (label, key), h in split.Results().items():
+        hist_dict[f'{label}{key}'] = h
     
-    outfile_name = f'/home/physicist/rootfiles/plots/GenJet_{prc}'
+    outfile_name = os.path.join(outDir, f'GenJet_{prc}')
     outfile = ROOT.TFile(f"{outfile_name}.root", "RECREATE")
     for key, h in hist_dict.items():
         h.Write()
+    ROOT.TParameter('double')('genEventCount', float(nEvents.GetValue())).Write()
+    ROOT.TParameter('double')('genEventSumw', float(sumw.GetValue())).Write()
+    outputs = {}
+    if variations:
+        # one directory per variation, see variations.py
+        outputs = booker.Outputs([hist_dict['nJet'], hist_dict['GenJet_HT']], [split], sumWeights)
+        for variation, objects in outputs.items():
+            d = outfile.mkdir(variation)
+            for name, obj in objects.items():
+                d.WriteTObject(obj, name)
     outfile.Close()
+    if store is not None:
+        from histstore import HistStore
+        hists = {}
+        for h in hist_dict.values():
+            # the split results are plain histograms, the others booked results
+            h = h.GetValue() if hasattr(h, 'GetValue') else h
+            hists[h.GetName()] = h
+        params = {'genEventCount': float(nEvents.GetValue()), 'genEventSumw': float(sumw.GetValue())}
+        # variation directories as 'variation/name', the way histstore.ImportROOT() names them
+        for variation, objects in outputs.items():
+            for name, obj in objects.items():
+                if name == 'genEventSumw':
+                    params[f'{variation}/{name}'] = obj.GetVal()
+                else:
+                    hists[f'{variation}/{name}'] = obj
+        HistStore(store).Put(f'GenJet_{prc}.root', hists, params)
+    if cache is not None:
+        print(cache.Report())
+    return f'{outfile_name}.root'
+
+
+def _GenJetPart(fileName, outDir, nThreads=None, variations=None):
+    # one input file of GenJetIncremental(), see incremental.Update()
+    return GenJet(fileName, 'part', outDir=outDir, nThreads=nThreads, variations=variations), None
+
+
+def GenJetIncremental(fileList, prc, outDir=OUTDIR, nThreads=None, store=None, variations=None, workers=1):
+    '''GenJet() on a .txt list of files, processing only the files that were not in outDir/GenJet_<prc>.root
+    yet and adding their histograms to it (see incremental.py). Files are processed by workers processes,
+    each with nThreads threads. Returns the path of the output file.'''
+    from incremental import Update
+    output = os.path.join(outDir, f'GenJet_{prc}.root')
+    key = HashStrings(*[f'{f}:{FileChecksum(f)}' for f in CODE], repr(variations))
+    added = Update(fileList, output, functools.partial(_GenJetPart, nThreads=nThreads, variations=variations),
+                   key=key, workers=workers)
+    print(f'{len(added)} files added to {output}')
+    if store is not None:
+        from histstore import HistStore, ImportROOT
+        ImportROOT(HistStore(store), output)
+    return output
+
+
+if __name__ == '__main__':
+    # number of threads from -j N / --threads N (or $TIMBER_NTHREADS, default 1)
+    nThreads = ParseThreads(sys.argv)
+    # --cache: reuse histograms from an identical earlier run (see histcache.py)
+    useCache = '--cache' in sys.argv
+    if useCache:
+        sys.argv.remove('--cache')
+    # --store PATH: also put the histograms in a histogram store shared by all samples (see histstore.py)
+    store = None
+    if '--store' in sys.argv:
+        i = sys.argv.index('--store')
+        store = sys.argv[i+1]
+        del sys.argv[i:i+2]
+    # --variation NAME=WEIGHT (repeatable), or --variations nano: weight variations (see variations.py)
+    variations = {}
+    while '--variation' in sys.argv:
+        i = sys.argv.index('--variation')
+        name, weight = sys.argv[i+1].split('=', 1)
+        variations[name] = weight
+        del sys.argv[i:i+2]
+    if '--variations' in sys.argv:
+        i = sys.argv.index('--variations')
+        variations = sys.argv[i+1]
+        del sys.argv[i:i+2]
+    # --incremental [-n WORKERS]: only process the files of a .txt list that are not in the output yet
+    incremental = '--incremental' in sys.argv
+    if incremental:
+        sys.argv.remove('--incremental')
+    workers = 1
+    if '-n' in sys.argv:
+        i = sys.argv.index('-n')
+        workers = int(sys.argv[i+1])
+        del sys.argv[i:i+2]
+    
+    if len(sys.argv) >= 3:
+        print(f"argumrnts:{sys.argv[1]}---{sys.argv[2]}")
+        fileDir = sys.argv[1]
+        prc = sys.argv[2]
+        print(f"Process type: {prc}")
+    else:
+        print("Usage: python3 genJet.py PATH_TO_NTUPLE PROCESS_NAME [-j NTHREADS] [--cache] [--store PATH] [--variation NAME=WEIGHT ...] [--variations nano] [--incremental [-n WORKERS]]")
+        exit()
+
+    if incremental:
+        GenJetIncremental(fileDir, prc, nThreads=nThreads, store=store, variations=variations or None, workers=workers)
+    else:
+        GenJet(fileDir, prc, nThreads=nThreads, useCache=useCache, store=store, variations=variations or None)
 
 '''
     # Make histograms
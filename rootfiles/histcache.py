@@ -0,0 +1,179 @@
+# Cache of filled histograms (and counts/sums), keyed on everything that determines their content.
+#
+# Rerunning timber.py or genJet.py only to change the style of a plot runs the whole event
+# loop again to fill exactly the same histograms. HistCache books histograms like the
+# RDataFrame does (Histo1D, Histo2D, Count, Sum), but first looks for the result of an
+# identical booking from an earlier run. Hits are read back from the cache and book nothing
+# on the RDataFrame, so when every booked result is a hit the event loop never runs. Misses
+# are booked as usual and stored when their value is first requested.
+#
+# The key is made of the checksums of the input files, the name and action of every node
+# from the base node to the node the result is booked on (so any changed Cut or Define
+# string is a miss), the source files given as code (e.g. Modules.cc, plus the headers it
+# includes), and the action with all its arguments: histogram model (name, title, binning),
+# columns and weight.
+#
+# Entries live in $TIMBER_CACHE/hists, one small ROOT file each. When the directory grows
+# beyond $TIMBER_HIST_CACHE_MB (default 1024) the least recently used entries are deleted.
+# Set TIMBER_HIST_CACHE=0 to book everything directly on the RDataFrame.
+#
+# Usage:
+#     cache = HistCache(ana, code=['Modules.cc'])
+#     h = cache.Histo1D(('h', 'title;x', 100, 0., 1.), 'x')   # same arguments as DataFrame.Histo1D
+#     n = cache.Count()
+#     h.Draw()      # results behave like the RResultPtr; GetValue() gives the object
+import os
+import tempfile
+import ROOT
+from caching import CacheDir, FileLock, FileChecksum, HashStrings, InputFiles
+from skimcache import ChainKey
+
+
+class HistCache(object):
+    '''Books RDataFrame results on the nodes of ana, reusing results of identical bookings from earlier runs.
+
+    Args:
+        ana: TIMBER analyzer.
+        code (list): Source files the booked columns depend on (e.g. Modules.cc). Their content,
+            and that of the headers they include, is part of the key.
+        maxBytes (int): Size of the cache directory above which old entries are evicted.
+            Defaults to $TIMBER_HIST_CACHE_MB megabytes (1024).
+    '''
+    def __init__(self, ana, code=(), maxBytes=None):
+        self.enabled = os.environ.get('TIMBER_HIST_CACHE', '1') != '0'
+        self._ana = ana
+        if maxBytes is None:
+            maxBytes = int(float(os.environ.get('TIMBER_HIST_CACHE_MB', 1024)) * 1024**2)
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            from modcache import Includes
+            sources = [os.path.realpath(c) for c in code]
+            sources += [h for c in sources for h in Includes(c) if h not in sources]
+            self._common = [f'{f}:{FileChecksum(f)}' for f in InputFiles(ana.fileName) + sources]
+            self._dir = CacheDir('hists')
+
+    def Histo1D(self, model, column, weight=None, node=None):
+        return self.Book('Histo1D', (model, column) + ((weight,) if weight else ()), node)
+
+    def Histo2D(self, model, x, y, weight=None, node=None):
+        return self.Book('Histo2D', (model, x, y) + ((weight,) if weight else ()), node)
+
+    def Count(self, node=None):
+        return self.Book('Count', (), node)
+
+    def Sum(self, column, node=None):
+        return self.Book('Sum', (column,), node)
+
+    def Book(self, action, args, node=None, df=None, extra=()):
+        '''Book df.<action>(*args), or read its result from the cache.
+
+        Args:
+            action (str): RDataFrame action (Histo1D, Histo2D, Count, Sum, ...).
+            args (tuple): Arguments to the action.
+            node: TIMBER node to book on. Defaults to the analyzer's active node.
+            df: RDataFrame to book on instead of node.DataFrame, for columns defined directly on
+                the RDataFrame (e.g. by categories.CategorySplit). Must derive from node.DataFrame.
+            extra (tuple): Strings describing whatever df adds to node (e.g. its Define expressions).
+
+        Returns:
+            A CachedResult, or the RResultPtr itself if the cache is disabled.
+        '''
+        if node is None:
+            # a pruning analyzer defines the ObjectFromCollection() columns when they are first used (see pruning.py)
+            if hasattr(self._ana, 'Require'):
+                self._ana.Require(*args)
+            node = self._ana.GetActiveNode()
+        if df is None:
+            df = node.DataFrame
+        if not self.enabled:
+            return getattr(df, action)(*args)
+        key = HashStrings(*self._common, ChainKey(node), *extra, action, repr(args))
+        path = os.path.join(self._dir, key + '.root')
+        if os.path.exists(path):
+            value = _Load(path, action)
+            if value is not None:
+                self.hits += 1
+                os.utime(path)    # mark as recently used
+                return CachedResult(self, path, action, value=value)
+        self.misses += 1
+        return CachedResult(self, path, action, booked=getattr(df, action)(*args))
+
+    def Report(self):
+        return f'HistCache -- {self.hits} hits, {self.misses} misses ({self._dir if self.enabled else "disabled"})'
+
+    def _Store(self, path, action, value):
+        fd, tmp = tempfile.mkstemp(suffix='.root', dir=self._dir)
+        os.close(fd)
+        f = ROOT.TFile.Open(tmp, 'RECREATE')
+        if isinstance(value, ROOT.TObject):
+            f.WriteTObject(value, 'result')
+        else:
+            ROOT.TParameter('double')('result', float(value)).Write()
+        f.Close()
+        os.replace(tmp, path)
+        self._Evict()
+
+    def _Evict(self):
+        with FileLock(os.path.join(self._dir, '.lock')):
+            entries = []
+            for name in os.listdir(self._dir):
+                if not name.endswith('.root'): continue
+                try:
+                    st = os.stat(os.path.join(self._dir, name))
+                except FileNotFoundError:
+                    continue    # evicted by another job
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(e[1] for e in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.maxBytes: break
+                try:
+                    os.remove(os.path.join(self._dir, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+class CachedResult(object):
+    '''Result of a HistCache booking. Behaves like the RResultPtr: GetValue() returns the
+    histogram (or number) and any other attribute is forwarded to it, e.g. h.Draw().'''
+    def __init__(self, cache, path, action, booked=None, value=None):
+        self._cache = cache
+        self._path = path
+        self._action = action
+        self._booked = booked
+        self._value = value
+
+    def IsHit(self):
+        return self._booked is None
+
+    def GetValue(self):
+        '''The result. For a miss, the first call triggers the event loop and stores the result.'''
+        if self._value is None:
+            self._value = self._booked.GetValue()
+            self._cache._Store(self._path, self._action, self._value)
+        return self._value
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.GetValue(), name)
+
+
+def _Load(path, action):
+    f = ROOT.TFile.Open(path)
+    if not f or f.IsZombie():
+        return None    # evicted or damaged, recompute
+    obj = f.Get('result')
+    value = None
+    if obj:
+        if obj.InheritsFrom('TH1'):
+            obj.SetDirectory(0)
+            value = obj
+        elif action == 'Count':
+            value = int(obj.GetVal())
+        else:
+            value = obj.GetVal()
+    f.Close()
+    return value
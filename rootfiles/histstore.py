@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+# Histograms of a whole campaign in one memory-mapped file.
+#
+# draw_HT.py and rescale.py open one ROOT file per sample just to read a few TH1s, and every
+# TFile.Open() reads the file's header, key list and streamer info. A HistStore keeps the bin
+# edges, contents and sum of squared weights (sumw2) of all histograms of all samples as
+# contiguous float64 arrays in one binary file, CAMPAIGN.bin, with a JSON index, CAMPAIGN.json,
+# of where each (sample, histogram) is. The normalization parameters genJet.py writes
+# (genEventCount, genEventSumw) are kept in the index too.
+#
+# The binary file is memory-mapped: opening the store reads only the index, and Get() returns
+# arrays that are views into the mapping, so a histogram's bins are read from disk when they
+# are first used. Matrix() gives one histogram of many samples as a (samples x bins) array,
+# so scaling all of them (Stack(), Sum()) is one numpy operation. ToROOT()/FromROOT() convert
+# to and from TH1D/TH2D when a plot or a fit needs a real ROOT histogram.
+#
+# Put() appends to the binary file and rewrites the index atomically under a lock, so several
+# genJet.py jobs can fill the same store at the same time. Replacing a sample leaves its old
+# arrays unused in the file; Compact() rewrites the file without them.
+#
+# Layout of the arrays is ROOT's: contents and sumw2 have one entry per bin including under- and
+# overflow (GetNcells()), in ROOT's global bin order (x fastest).
+#
+# Usage:
+#     python3 histstore.py campaign plots/GenJet_*.root    # import genJet.py outputs
+#     python3 histstore.py campaign --export plots_from_store   # and back to ROOT files
+# or in Python:
+#     store = HistStore('campaign')
+#     ht = store.Sum('GenJet_HT', scales=[...]).ToROOT()
+import os
+import json
+import hashlib
+import argparse
+import numpy
+from caching import FileLock, WriteJSON
+
+_dtype = numpy.dtype('<f8')
+
+
+class Hist(object):
+    '''A histogram as numpy arrays: edges (one array per axis), contents and sumw2 (ROOT's cell layout).'''
+    def __init__(self, name, title, edges, contents, sumw2, entries=0., axisTitles=()):
+        self.name = name
+        self.title = title
+        self.edges = [numpy.asarray(e) for e in edges]
+        self.contents = contents
+        self.sumw2 = sumw2
+        self.entries = entries
+        self.axisTitles = list(axisTitles)
+
+    @property
+    def shape(self):
+        '''Number of cells per axis, including under- and overflow.'''
+        return tuple(len(e) + 1 for e in self.edges)
+
+    def Values(self):
+        '''Contents as an array indexed [x] (1D) or [y, x] (2D), including under- and overflow.'''
+        return numpy.asarray(self.contents).reshape(self.shape[::-1])
+
+    def Integral(self):
+        '''Sum of the contents without under- and overflow, like TH1::Integral().'''
+        inner = tuple(slice(1, -1) for e in self.edges)
+        return float(self.Values()[inner].sum())
+
+    def Scale(self, factor):
+        '''New histogram with contents * factor and sumw2 * factor^2.'''
+        return Hist(self.name, self.title, self.edges, self.contents * factor, self.sumw2 * factor**2,
+                    self.entries, self.axisTitles)
+
+    def __add__(self, other):
+        if len(self.edges) != len(other.edges) or not all(numpy.array_equal(a, b) for a, b in zip(self.edges, other.edges)):
+            raise ValueError(f'Hist -- cannot add {self.name} and {other.name}, their binnings differ')
+        return Hist(self.name, self.title, self.edges, self.contents + other.contents, self.sumw2 + other.sumw2,
+                    self.entries + other.entries, self.axisTitles)
+
+    def ToROOT(self, name=None):
+        '''TH1D or TH2D with the same binning, contents, errors and entries (not attached to any file).'''
+        import ROOT
+        name = name or self.name
+        axes = [(len(e) - 1, numpy.array(e, dtype='f8')) for e in self.edges]
+        if len(axes) == 1:
+            h = ROOT.TH1D(name, self.title, axes[0][0], axes[0][1])
+        elif len(axes) == 2:
+            h = ROOT.TH2D(name, self.title, axes[0][0], axes[0][1], axes[1][0], axes[1][1])
+        else:
+            raise ValueError(f'Hist.ToROOT -- {len(axes)}D histograms are not supported')
+        h.SetDirectory(0)
+        h.Sumw2()
+        for axis, title in zip((h.GetXaxis(), h.GetYaxis()), self.axisTitles):
+            axis.SetTitle(title)
+        contents, sumw2 = numpy.asarray(self.contents), numpy.asarray(self.sumw2)
+        for i in range(h.GetNcells()):
+            h.SetBinContent(i, contents[i])
+            h.SetBinError(i, numpy.sqrt(sumw2[i]))
+        h.SetEntries(self.entries)
+        return h
+
+
+def FromROOT(h):
+    '''Hist with the binning, contents, sumw2 and entries of a TH1 or TH2 (copies).'''
+    axes = [h.GetXaxis(), h.GetYaxis()][:h.GetDimension()]
+    if h.GetDimension() > 2:
+        raise ValueError(f'FromROOT -- {h.GetDimension()}D histograms are not supported')
+    edges = [numpy.array([a.GetBinLowEdge(i) for i in range(1, a.GetNbins() + 2)]) for a in axes]
+    n = h.GetNcells()
+    contents = numpy.array([h.GetBinContent(i) for i in range(n)])
+    # GetBinError() is sqrt(content) for histograms without sumw2, i.e. unweighted ones
+    sumw2 = numpy.array([h.GetBinError(i) for i in range(n)])**2
+    return Hist(h.GetName(), h.GetTitle(), edges, contents, sumw2, h.GetEntries(), [str(a.GetTitle()) for a in axes])
+
+
+class HistStore(object):
+    '''Histograms of many samples in path.bin (the arrays, memory-mapped) and path.json (the index).
+
+    Args:
+        path (str): Path of the store without extension.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._bin = path + '.bin'
+        self._json = path + '.json'
+        self._Reload()
+
+    def _Reload(self):
+        self._index = {'samples': {}}
+        if os.path.exists(self._json):
+            with open(self._json) as f:
+                self._index = json.load(f)
+        self._map = None
+
+    def _Map(self):
+        if self._map is None:
+            self._map = numpy.memmap(self._bin, dtype=_dtype, mode='r')
+        return self._map
+
+    def Samples(self):
+        return list(self._index['samples'])
+
+    def Names(self, sample):
+        '''Names of the histograms of sample. Histograms in subdirectories are named dir/name.'''
+        return list(self._index['samples'][sample]['hists'])
+
+    def Params(self, sample):
+        '''Numbers stored with sample, e.g. {'genEventCount': ..., 'genEventSumw': ...}.'''
+        return dict(self._index['samples'][sample]['params'])
+
+    def Has(self, sample, name=None):
+        return sample in self._index['samples'] and (name is None or name in self._index['samples'][sample]['hists'])
+
+    def Get(self, sample, name):
+        '''Hist whose edges, contents and sumw2 are read-only views into the memory-mapped file.'''
+        entry = self._index['samples'][sample]['hists'][name]
+        data = self._Map()
+        view = lambda offset, n: data[offset:offset + n]
+        edges = [view(a['offset'], a['n'] + 1) for a in entry['axes']]
+        return Hist(name.split('/')[-1], entry['title'], edges, view(entry['contents'], entry['ncells']),
+                    view(entry['sumw2'], entry['ncells']), entry['entries'], [a['title'] for a in entry['axes']])
+
+    def Checksum(self, sample, name):
+        '''sha256 of histogram name of sample: its title, axis titles, entries and arrays. Where the arrays
+        are in the file does not enter, so it is unchanged by Put()s of other samples and by Compact().'''
+        h = self.Get(sample, name)
+        sha = hashlib.sha256(json.dumps([h.title, list(h.axisTitles), h.entries, [len(e) for e in h.edges]]).encode())
+        for array in list(h.edges) + [h.contents, h.sumw2]:
+            sha.update(numpy.ascontiguousarray(array).tobytes())
+        return sha.hexdigest()
+
+    def Matrix(self, name, samples=None):
+        '''Histogram name of samples (default: all that have it) as arrays: (edges, contents, sumw2), where
+        contents and sumw2 have one row per sample. All samples must have the same binning.'''
+        samples = [s for s in self.Samples() if self.Has(s, name)] if samples is None else samples
+        if not samples:
+            raise ValueError(f'HistStore.Matrix -- no samples with {name}')
+        hists = [self.Get(s, name) for s in samples]
+        for h in hists[1:]:
+            if h.shape != hists[0].shape or not all(numpy.array_equal(a, b) for a, b in zip(h.edges, hists[0].edges)):
+                raise ValueError(f'HistStore.Matrix -- {name} has different binnings in {samples}')
+        return (hists[0].edges, numpy.stack([h.contents for h in hists]), numpy.stack([h.sumw2 for h in hists]))
+
+    def Stack(self, name, samples=None, scales=None):
+        '''Cumulative sums of histogram name over samples, each scaled by its entry of scales:
+        the k-th Hist is the sum of the first k+1 samples, as in a THStack.'''
+        samples = [s for s in self.Samples() if self.Has(s, name)] if samples is None else samples
+        if not samples:
+            raise ValueError(f'HistStore.Stack -- no samples with {name}')
+        edges, contents, sumw2 = self.Matrix(name, samples)
+        if scales is not None:
+            scales = numpy.asarray(scales, dtype=_dtype)[:, None]
+            contents, sumw2 = contents * scales, sumw2 * scales**2
+        contents, sumw2 = numpy.cumsum(contents, axis=0), numpy.cumsum(sumw2, axis=0)
+        first = self.Get(samples[0], name)
+        entries = numpy.cumsum([self._index['samples'][s]['hists'][name]['entries'] for s in samples])
+        return [Hist(first.name, first.title, edges, c, w, e, first.axisTitles) for c, w, e in zip(contents, sumw2, entries)]
+
+    def Sum(self, name, samples=None, scales=None):
+        '''Sum of histogram name over samples, each scaled by its entry of scales.'''
+        return self.Stack(name, samples, scales)[-1]
+
+    def Put(self, sample, hists, params=None):
+        '''Store hists ({name: TH1 or Hist}) and params ({name: number}) as sample, replacing what it had.'''
+        hists = {name: h if isinstance(h, Hist) else FromROOT(h) for name, h in hists.items()}
+        with FileLock(self.path + '.lock'):
+            # another job may have added samples since this store was opened
+            self._Reload()
+            entries = {}
+            with open(self._bin, 'ab') as f:
+                offset = f.tell() // _dtype.itemsize
+                def write(array):
+                    nonlocal offset
+                    array = numpy.ascontiguousarray(array, dtype=_dtype)
+                    array.tofile(f)
+                    offset += array.size
+                    return offset - array.size
+                for name, h in hists.items():
+                    axes = [{'offset': write(e), 'n': len(e) - 1, 'title': t}
+                            for e, t in zip(h.edges, list(h.axisTitles) + [''] * len(h.edges))]
+                    entries[name] = {'title': h.title, 'axes': axes, 'ncells': int(numpy.size(h.contents)),
+                                     'contents': write(h.contents), 'sumw2': write(h.sumw2), 'entries': float(h.entries)}
+            self._index['samples'][sample] = {'hists': entries, 'params': dict(params or {})}
+            WriteJSON(self._json, self._index)
+            self._map = None
+
+    def Remove(self, sample):
+        with FileLock(self.path + '.lock'):
+            self._Reload()
+            self._index['samples'].pop(sample, None)
+            WriteJSON(self._json, self._index)
+
+    def Compact(self):
+        '''Rewrite the binary file with only the arrays the index points to.'''
+        with FileLock(self.path + '.lock'):
+            self._Reload()
+            content = {s: ({n: self.Get(s, n) for n in self.Names(s)}, self.Params(s)) for s in self.Samples()}
+            content = {s: ({n: Hist(h.name, h.title, [numpy.array(e) for e in h.edges], numpy.array(h.contents),
+                                    numpy.array(h.sumw2), h.entries, h.axisTitles) for n, h in hists.items()}, params)
+                       for s, (hists, params) in content.items()}
+            self._map = None
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            for ext in ('.bin', '.json'):
+                if os.path.exists(tmp + ext):
+                    os.remove(tmp + ext)
+            compacted = HistStore(tmp)
+            for s, (hists, params) in content.items():
+                compacted.Put(s, hists, params)
+            os.remove(tmp + '.lock')
+            if not content:
+                open(tmp + '.bin', 'wb').close()
+            os.replace(tmp + '.bin', self._bin)
+            os.replace(tmp + '.json', self._json)
+            self._Reload()
+
+
+def ImportROOT(store, fileName, sample=None):
+    '''Put every TH1 of a ROOT file (also in subdirectories, as dir/name) and every TParameter into store,
+    as sample (default: the file's basename).'''
+    import ROOT
+    sample = sample or os.path.basename(fileName)
+    hists, params = {}, {}
+    def walk(directory, prefix):
+        seen = set()
+        for key in directory.GetListOfKeys():
+            if key.GetName() in seen: continue    # only the latest cycle
+            seen.add(key.GetName())
+            obj = key.ReadObj()
+            if obj.InheritsFrom('TDirectory'):
+                walk(obj, prefix + key.GetName() + '/')
+            elif obj.InheritsFrom('TH1') and obj.GetDimension() <= 2:
+                hists[prefix + key.GetName()] = FromROOT(obj)
+            elif obj.InheritsFrom('TParameter<double>') or obj.InheritsFrom('TParameter<float>'):
+                params[prefix + key.GetName()] = float(obj.GetVal())
+    f = ROOT.TFile.Open(fileName, 'READ')
+    walk(f, '')
+    f.Close()
+    store.Put(sample, hists, params)
+    return sample
+
+
+def ExportROOT(store, sample, fileName):
+    '''Write sample of store to a ROOT file like the one it was imported from.'''
+    import ROOT
+    tmp = f'{fileName}.{os.getpid()}.tmp'
+    f = ROOT.TFile.Open(tmp, 'RECREATE')
+    for name in store.Names(sample):
+        directory = f
+        for d in name.split('/')[:-1]:
+            directory = directory.GetDirectory(d) or directory.mkdir(d)
+        directory.WriteTObject(store.Get(sample, name).ToROOT(), name.split('/')[-1])
+    for name, value in store.Params(sample).items():
+        f.WriteTObject(ROOT.TParameter('double')(name, value), name)
+    f.Close()
+    os.replace(tmp, fileName)
+    return fileName
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import ROOT files into a histogram store, or export it back.')
+    parser.add_argument('store', help='path of the store, without extension')
+    parser.add_argument('files', nargs='*', help='ROOT files to import, one sample each (named after the file)')
+    parser.add_argument('--export', metavar='DIR', help='write every sample of the store to DIR/<sample>')
+    parser.add_argument('--compact', action='store_true', help='drop replaced arrays from the binary file')
+    args = parser.parse_args()
+
+    store = HistStore(args.store)
+    for fileName in args.files:
+        print(f'{fileName} -> {args.store}: {ImportROOT(store, fileName)}')
+    if args.compact:
+        store.Compact()
+    if args.export:
+        os.makedirs(args.export, exist_ok=True)
+        for sample in store.Samples():
+            print(ExportROOT(store, sample, os.path.join(args.export, sample)))
+    if not (args.files or args.export or args.compact):
+        for sample in store.Samples():
+            print(f'{sample}: {len(store.Names(sample))} histograms, {store.Params(sample)}')
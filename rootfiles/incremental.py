@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# Incremental processing of a growing .txt list of input files, with checkpoints.
+#
+# The analyzer takes a .txt list of ROOT files, but rerunning on it reprocesses every file,
+# even when only a few new ones were appended. Update() keeps a manifest of the files (path and
+# checksum) that went into an output file, and only runs the job on the ones that are not in it
+# yet. Their results are added to the existing output like hadd does: histograms (also in
+# subdirectories) are summed, TParameters like genEventCount/genEventSumw too, and the cutflow
+# tables with cutflow.MergeTables().
+#
+# Every file is processed on its own, in a process pool, into a partial output under
+# $TIMBER_CACHE/incremental. A partial output only appears there once it is complete, so a job
+# that is killed keeps every file it had finished: the next Update() picks them up and only
+# processes the rest. The manifest is stored in the output file itself, and the merged file
+# replaces the old one in one rename, so the output and its manifest always agree.
+#
+# Results cannot be taken out of a sum, so when a file in the manifest was modified or removed
+# from the list, or the key (the code and arguments of the job) changed, the output is rebuilt
+# from all files. The partial outputs are kept per output and key; once the output is up to date
+# with a key, those of the other keys are removed.
+#
+# Each merge adds the new files in the order of the list, but onto a sum that already holds the
+# files of earlier Update()s. Floating-point sums depend on the order of the additions, so the
+# weighted sums of an output grown in several steps can differ in the last bits from those of one
+# rebuilt from all files at once: they depend on the order the files arrived in.
+#
+# The job is func(fileName, outDir) -> (ROOT file written in outDir, cutflow table or None). It is
+# sent to worker processes, so it has to be a module-level function (or a functools.partial of one).
+#
+# Usage:
+#     Update('QCD_HT50to100.txt', 'plots/GenJet_QCD_HT50to100.root', job, key=HashStrings(...))
+#     python3 incremental.py plots/GenJet_QCD_HT50to100.root          # the files in the manifest
+#     python3 genJet.py QCD_HT50to100.txt QCD_HT50to100 --incremental
+import os
+import sys
+import json
+import shutil
+import argparse
+import multiprocessing
+from collections import OrderedDict
+import ROOT
+from caching import CacheDir, FileChecksum, FileLock, HashStrings, InputFiles, WriteJSON
+from cutflow import MergeTables
+
+# name of the TNamed holding the manifest (as JSON) in the output file
+MANIFEST = 'incrementalManifest'
+
+
+def Manifest(output):
+    '''The manifest of output, {'key': ..., 'files': [{'path': ..., 'sha256': ...}], 'cutflow': table or None},
+    or None if output does not exist or was not written by Update().'''
+    if not os.path.exists(output):
+        return None
+    f = ROOT.TFile.Open(output, 'READ')
+    obj = f.Get(MANIFEST) if f else None
+    manifest = json.loads(obj.GetTitle()) if obj else None
+    if f:
+        f.Close()
+    return manifest
+
+
+def _OutputDir(output):
+    return CacheDir('incremental', HashStrings(os.path.realpath(output)))
+
+
+def _PartDir(output, key):
+    return CacheDir('incremental', HashStrings(os.path.realpath(output)), HashStrings(key))
+
+
+def _RemoveStale(output, partDir):
+    '''Remove the partial outputs of output made with other keys than that of partDir.'''
+    outDir = _OutputDir(output)
+    for name in os.listdir(outDir):
+        path = os.path.join(outDir, name)
+        if os.path.isdir(path) and path != partDir:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _Parts(partDir):
+    '''(path, sha256) -> metadata of the finished partial outputs in partDir.'''
+    parts = {}
+    for name in os.listdir(partDir):
+        meta = os.path.join(partDir, name, 'part.json')
+        if os.path.exists(meta):
+            with open(meta) as f:
+                part = json.load(f)
+            part['output'] = os.path.join(partDir, name, part['output'])
+            parts[(part['path'], part['sha256'])] = part
+    return parts
+
+
+def _RunPart(job):
+    func, path, sha, partDir = job
+    final = os.path.join(partDir, HashStrings(path, sha))
+    # the job writes into a temporary directory that is renamed once it is complete
+    tmp = f'{final}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    output, table = func(path, tmp)
+    WriteJSON(os.path.join(tmp, 'part.json'), {'path': path, 'sha256': sha, 'output': os.path.basename(output), 'cutflow': table})
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+    return path
+
+
+def _Merge(inputs, output):
+    '''hadd inputs into output (overwritten).'''
+    merger = ROOT.TFileMerger(False)
+    merger.SetPrintLevel(0)
+    merger.OutputFile(output, 'RECREATE')
+    for path in inputs:
+        merger.AddFile(path)
+    if not merger.Merge():
+        raise Exception(f'Update -- merging {len(inputs)} files into {output} failed')
+
+
+def Update(fileList, output, func, key='', workers=1, rebuild=False):
+    '''Bring output up to date with the files of fileList (.txt list, .root file or python list), running
+    func (see above) on the files that are not in its manifest yet and adding their results to it.
+    key identifies the code and arguments of func: with a different key, output is rebuilt.
+    Returns the list of files that were added.'''
+    files = OrderedDict((path, FileChecksum(path)) for path in InputFiles(fileList))
+    partDir = _PartDir(output, key)
+    # one Update() per output at a time, whatever its key
+    with FileLock(os.path.join(_OutputDir(output), 'lock')):
+        manifest = None if rebuild else Manifest(output)
+        if manifest is not None and manifest['key'] != key:
+            print(f'{output} was made by different code or arguments, rebuilding it')
+            manifest = None
+        if manifest is not None and any(files.get(e['path']) != e['sha256'] for e in manifest['files']):
+            print(f'files of {output} were modified or removed from {fileList}, rebuilding it')
+            manifest = None
+        done = [(e['path'], e['sha256']) for e in manifest['files']] if manifest else []
+        new = [(path, sha) for path, sha in files.items() if (path, sha) not in done]
+        if not new:
+            _RemoveStale(output, partDir)
+            return []
+
+        parts = _Parts(partDir)
+        todo = [(path, sha) for path, sha in new if (path, sha) not in parts]
+        print(f'{len(done)} files in {output}, {len(new)} new, {len(new) - len(todo)} of them already processed')
+        if todo:
+            jobs = [(func, path, sha, partDir) for path, sha in todo]
+            # fresh interpreters rather than forks of this one, which already has ROOT loaded
+            with multiprocessing.get_context('spawn').Pool(max(1, min(workers, len(jobs)))) as pool:
+                for i, path in enumerate(pool.imap_unordered(_RunPart, jobs)):
+                    print(f'[{i+1}/{len(jobs)}] {path}')
+            parts = _Parts(partDir)
+
+        # in the order of the list, after the files already in output (see above on the order of the sums)
+        added = [parts[entry] for entry in new]
+        tables = ([manifest['cutflow']] if manifest and manifest['cutflow'] else []) + \
+                 [p['cutflow'] for p in added if p['cutflow']]
+        manifest = {
+            'key': key,
+            'files': [{'path': path, 'sha256': sha} for path, sha in done + new],
+            'cutflow': MergeTables(tables) if tables else None,
+        }
+        tmp = f'{output}.{os.getpid()}.tmp'
+        _Merge(([output] if done else []) + [p['output'] for p in added], tmp)
+        f = ROOT.TFile.Open(tmp, 'UPDATE')
+        f.Delete(MANIFEST + ';*')
+        f.WriteTObject(ROOT.TNamed(MANIFEST, json.dumps(manifest)), MANIFEST)
+        f.Close()
+        os.replace(tmp, output)
+        if manifest['cutflow']:
+            WriteJSON(os.path.splitext(output)[0] + '_cutflow.json', manifest['cutflow'])
+        # only now that the output has them, together with those of files no longer in the list
+        for p in parts.values():
+            shutil.rmtree(os.path.dirname(p['output']), ignore_errors=True)
+        _RemoveStale(output, partDir)
+        return [path for path, sha in new]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List the input files that went into an output of Update().')
+    parser.add_argument('output', help='ROOT file written by Update()')
+    parser.add_argument('--list', default=None, help='.txt list of input files: also report the files not processed yet')
+    args = parser.parse_args()
+
+    manifest = Manifest(args.output)
+    if manifest is None:
+        print(f'{args.output} has no manifest')
+        sys.exit(1)
+    for e in manifest['files']:
+        print(f"{e['sha256'][:12]}  {e['path']}")
+    print(f"{len(manifest['files'])} files")
+    if args.list:
+        known = {(e['path'], e['sha256']) for e in manifest['files']}
+        pending = [path for path in InputFiles(args.list) if (path, FileChecksum(path)) not in known]
+        print(f'{len(pending)} files of {args.list} not processed yet')
+        for path in pending:
+            print(f'  {path}')
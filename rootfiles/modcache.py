@@ -0,0 +1,101 @@
+# Persistent cache of compiled user modules (e.g. Modules.cc).
+#
+# TIMBER's CompileCpp('Modules.cc') hands the file to the ROOT interpreter, which parses and
+# JIT-compiles it - and TIMBER's common.h with it - from scratch in every process. For short
+# jobs that is a large part of the run time. CompileCppCached() instead builds the file once
+# with ACLiC (ROOT's "root -l Modules.cc+") into a shared library plus its dictionary
+# (whose .pcm holds the pre-parsed declarations) and only loads that library afterwards.
+#
+# The library is stored under a key made from the content of the source file, every header
+# it includes with #include "..." (recursively, so edits to common.h trigger a rebuild too),
+# the ROOT version and the include path. Builds happen in a private temporary directory that
+# is renamed into place when complete, under a lock, so many jobs can start at once.
+#
+# Set TIMBER_MODULE_CACHE=0 to fall back to plain CompileCpp().
+import os
+import re
+import glob
+import shutil
+import tempfile
+import ROOT
+from caching import CacheDir, FileLock, FileChecksum, HashStrings, WriteJSON
+
+_include = re.compile(r'^\s*#\s*include\s*"([^"]+)"', re.M)
+
+
+def _IncludeDirs():
+    dirs = [d[2:] for d in str(ROOT.gSystem.GetIncludePath()).split() if d.startswith('-I')]
+    if 'TIMBERPATH' in os.environ:
+        dirs.append(os.environ['TIMBERPATH'])
+    return [d.strip('"') for d in dirs]
+
+
+def Includes(filename, found=None):
+    '''All local headers pulled in by filename through #include "...", recursively.'''
+    if found is None:
+        found = []
+    with open(filename) as f:
+        text = f.read()
+    for inc in _include.findall(text):
+        for d in [os.path.dirname(filename)] + _IncludeDirs():
+            path = os.path.realpath(os.path.join(d, inc))
+            if os.path.isfile(path):
+                if path not in found:
+                    found.append(path)
+                    Includes(path, found)
+                break
+    return found
+
+
+def ModuleKey(filename):
+    '''Cache key for the compiled version of filename.'''
+    src = os.path.realpath(filename)
+    parts = [ROOT.gROOT.GetVersion(), ROOT.gSystem.GetIncludePath(), ROOT.gSystem.GetFlagsOpt(), os.path.basename(src)]
+    parts += [f'{p}:{FileChecksum(p)}' for p in [src] + sorted(Includes(src))]
+    return HashStrings(*parts)
+
+
+def CompileCppCached(filename):
+    '''Drop-in replacement for CompileCpp(filename) for .cc/.cpp/.C files.
+
+    Returns the path of the loaded library.
+    '''
+    if os.environ.get('TIMBER_MODULE_CACHE', '1') == '0':
+        from TIMBER.Tools.Common import CompileCpp
+        CompileCpp(filename)
+        return None
+
+    src = os.path.realpath(filename)
+    key = ModuleKey(src)
+    modules = CacheDir('modules')
+    libdir = os.path.join(modules, key)
+    if not os.path.isdir(libdir):
+        with FileLock(os.path.join(modules, key + '.lock')):
+            # somebody else may have finished the build while we waited for the lock
+            if not os.path.isdir(libdir):
+                _Build(src, key, modules, libdir)
+
+    with open(os.path.join(libdir, 'library')) as f:
+        lib = os.path.join(libdir, f.read().strip())
+    if ROOT.gSystem.Load(lib) < 0:
+        raise Exception(f'CompileCppCached -- could not load {lib} (compiled from {src})')
+    return lib
+
+
+def _Build(src, key, modules, libdir):
+    tmp = tempfile.mkdtemp(prefix=key + '.', dir=modules)
+    try:
+        # 'k' keeps the library, 'O' optimizes, 'c' compiles without loading it into this process.
+        # With a build directory ACLiC mirrors the source's absolute path below it.
+        if not ROOT.gSystem.CompileMacro(src, 'kOc', '', tmp):
+            raise Exception(f'CompileCppCached -- compilation of {src} failed')
+        libs = glob.glob(os.path.join(tmp, '**', '*.' + ROOT.gSystem.GetSoExt()), recursive=True)
+        if len(libs) != 1:
+            raise Exception(f'CompileCppCached -- expected one library from {src}, found {libs}')
+        with open(os.path.join(tmp, 'library'), 'w') as f:
+            f.write(os.path.relpath(libs[0], tmp))
+        WriteJSON(os.path.join(tmp, 'sources.json'), {'source': src, 'includes': Includes(src)})
+        os.rename(tmp, libdir)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
@@ -1,41 +1,70 @@
-# Start by importing the main TIMBER class, the analyzer
-from TIMBER.Analyzer import analyzer
-# next, import some of TIMBER's useful tools
+# Start by importing some of TIMBER's useful tools
 from TIMBER.Tools.Common import *
+# next, the main TIMBER class, the analyzer. pruning.analyzer is TIMBER's analyzer
+# plus an nThreads argument to run the event loop on several cores (see threads.py),
+# a profile argument to time every Cut and Define (see profiling.py)
+# and a prune argument to define only the ObjectFromCollection() columns that are used (see pruning.py)
+from threads import ParseThreads
+from pruning import analyzer
 # and pyROOT
 import ROOT
+import os
+import sys
+# CompileCpp() with an on-disk cache of the compiled library, see modcache.py
+from modcache import CompileCppCached
+# single-pass cutflow, see cutflow.py
+from cutflow import Cutflow, ChainTables, PrintTable, SaveTable
+# cache of preselected events, see skimcache.py
+from skimcache import SkimCache
+# cuts applied cheapest first, see cutorder.py
+from cutorder import ApplyCuts
+from TIMBER.Analyzer import CutGroup
+from collections import OrderedDict
 
-if __name__ == '__main__':
-    # instantiate the analyzer module. This class takes in either a ROOT file or a .txt list of ROOT files, all with the same trees (ideally)
-    ana = analyzer('/home/physicist/rootfiles/nanoaod.root')
-  
-    print('Counts: ', ana.DataFrame.Count().GetValue())
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Modules.cc')
+# columns kept in the skim: everything MuonCandidates() and the cutflow need
+SKIM_COLUMNS = ['nMuon', 'Muon_*', 'genWeight']
+# mass hypothesis for the best dimuon pair
+Z_MASS = 91.1876
+
+
+# The selection and the histograms are wrapped in functions so that other drivers (e.g. shard.py, which runs
+# this analysis on chunks of a large file in parallel) can reuse exactly the same analysis.
+def MuonSelection(ana, optimize=False):
+    '''Apply the dimuon selection to ana and define invMass. Returns the cutorder.CutOrder of the quality cuts.'''
+    order = MuonPreselection(ana, optimize)
+    MuonCandidates(ana)
+    return order
+
+
+def MuonPreselection(ana, optimize=False, declaredCounts=False):
+    '''Quality cuts on the two leading muons. With optimize=True they are applied cheapest first, with
+    declaredCounts also counted in the written order (see cutorder.py). Returns the cutorder.CutOrder of the quality cuts.'''
     # Basic cuts on the events
-    # keep all events with at least 2 muon
+    # keep all events with at least 2 muon. The cuts below read Muon_*[1], so this one always comes first
     ana.Cut('di_muon', 'nMuon >= 2')
+    # The rest select the same events in any order
+    quality = CutGroup('muonQuality')
     # drop muons in high pseudorapidity region (poor reconstruction)
-    print('Counts: ', ana.DataFrame.Count().GetValue())
-    ana.Cut('eta_cut', 'abs(Muon_eta[0]) < 2.1 && abs(Muon_eta[1]) < 2.1')
-    print('Counts: ', ana.DataFrame.Count().GetValue())
+    quality.Add('eta_cut', 'abs(Muon_eta[0]) < 2.1 && abs(Muon_eta[1]) < 2.1')
     # drop muons with pT lower than 15 GeV
-    ana.Cut('pt_cut', 'Muon_pt[0] >= 15 && Muon_pt[1] > 15')
-    print('Counts: ', ana.DataFrame.Count().GetValue())
+    quality.Add('pt_cut', 'Muon_pt[0] >= 15 && Muon_pt[1] > 15')
     # require quality cuts on the leaeding and sub-leading muons
-    ana.Cut('highPurity_cut', 'Muon_highPurity[0] == true && Muon_highPurity[1] == true')
-    print('Counts: ', ana.DataFrame.Count().GetValue())
-    ana.Cut('Muon_isGlobal_cut', 'Muon_isGlobal[0] == true && Muon_isGlobal[1] == true')
-    print('Counts: ', ana.DataFrame.Count().GetValue())
-    ana.Cut('Muon_miniIsoId_cut', 'Muon_miniIsoId[0] >=3 && Muon_miniIsoId[1] >=3')
-    print('Counts: ', ana.DataFrame.Count().GetValue())
+    quality.Add('highPurity_cut', 'Muon_highPurity[0] == true && Muon_highPurity[1] == true')
+    quality.Add('Muon_isGlobal_cut', 'Muon_isGlobal[0] == true && Muon_isGlobal[1] == true')
+    quality.Add('Muon_miniIsoId_cut', 'Muon_miniIsoId[0] >=3 && Muon_miniIsoId[1] >=3')
     
     # Lot of good stuff in
     # https://github.com/ammitra/TopHBoostedAllHad/blob/master/THClass.py
-    
+    return ApplyCuts(ana, quality, optimize, declaredCounts=declaredCounts)
 
+
+def MuonCandidates(ana):
+    '''Pick the opposite charge muon pair and define its invariant mass, invMass.'''
     # Now that we've made some basic kinematic cuts, let's be a bit more specific. 
     # We'll call some custom C++ code to pick out the positively / negatively charged muons.
-    # We can compile it using TIMBER via CompileCpp, imported from TIMBER.Tools.Common above
-    CompileCpp('/home/physicist/rootfiles/Modules.cc')
+    # We can compile it via CompileCppCached, a version of TIMBER's CompileCpp that keeps the compiled library between runs (modcache.py)
+    CompileCppCached(MODULES)
     #See the Modules.cc code for more detail. Tthis custom function gets to run on EVERY row (event),
     # and the input to the function is that row's (event's) muon's charge in that event.
     ana.Define('OppChargeMuonsIdxs', 'PickOppChargeMuons(Muon_charge)')
@@ -45,17 +74,73 @@ if __name__ == '__main__':
     # Naively, let's assume that the top is the 0th index and the phi the 1st. The vectors are ordered by pt, so this is a
     # possible, albeit inefficient, proxy for the top and phi identification
     # The ObjectFromCollection function takes a vector of vectors (FatJet_*) and makes a single vector based on the indices we defined prior (DijetIdxs)
+    # With prune=True (see pruning.py) only the MuonPlus_*/MuonNeg_* columns used by invMass are actually defined
     ana.ObjectFromCollection('MuonPlus','Muon','OppChargeMuonsIdxs[0]')
     ana.ObjectFromCollection('MuonNeg','Muon','OppChargeMuonsIdxs[1]')
 #    ana.SubCollection('MuonPlus','Muon','OppChargeMuonsIdxs')
 #    ana.SubCollection('MuonNeg','Muon','OppChargeMuonsIdxs')
     
 #    ana.SubCollection('MuonNeg','Muon','OppChargeMuonsIdxs[1]')
-    # At this point, we'll have a column corresponding to the pos and the neg charged muons. We can create TLorentz vectors from their pT, eta, phi and sotdrop masses
-    ana.Define('MuonPlus_vect','hardware::TLvector(MuonPlus_pt, MuonPlus_eta, MuonPlus_phi, MuonPlus_mass)')
-    ana.Define('MuonNeg_vect','hardware::TLvector(MuonNeg_pt, MuonNeg_eta, MuonNeg_phi, MuonNeg_mass)')
-    # Finally, we can reconstruct the resonance by getting the invariant mass of the top and phi vectors we just defined
-    ana.Define('invMass','hardware::InvariantMass({MuonPlus_vect, MuonNeg_vect})')
+    # At this point, we'll have a column corresponding to the pos and the neg charged muons.
+    # Finally, we can reconstruct the resonance by getting the invariant mass of the two muons from their pT, eta, phi and masses.
+    # kinematics::InvMass (Kinematics.h, included by Modules.cc) gives the same as hardware::InvariantMass() of two
+    # hardware::TLvector()s, without building the four-vector objects in every event
+    ana.Define('invMass','kinematics::InvMass(MuonPlus_pt, MuonPlus_eta, MuonPlus_phi, MuonPlus_mass, MuonNeg_pt, MuonNeg_eta, MuonNeg_phi, MuonNeg_mass)')
+    # Besides the first pair, take every opposite charge pair of the event (OppChargePairs() in Modules.cc).
+    # Dimuon_mass has the masses of all of them, Dimuon_bestMass the one closest to the Z mass (-1 if there is no pair)
+    ana.Define('Dimuons', f'OppChargePairs(Muon_pt, Muon_eta, Muon_phi, Muon_mass, Muon_charge, {Z_MASS})')
+    ana.Define('Dimuon_mass', 'Dimuons.mass')
+    ana.Define('Dimuon_bestMass', 'Dimuons.best >= 0 ? Dimuons.mass[Dimuons.best] : -1.f')
+
+
+def Analysis(ana):
+    '''The selection and the histograms, for drivers like shard.py. Returns the booked histograms by name.'''
+    MuonSelection(ana)
+    return BookHistos(ana)
+
+
+def BookHistos(ana):
+    '''Book the histograms of the analysis on the active node, return them by name.'''
+    # The RDataFrame::Histo2D() constructor takes in the following arguments in pyROOT:
+    # tuple: ("hist name", "hist title;x axis title;y axis title", nBinsX, xMin, xMax, nBinsY, yMin, yMax)
+    # string: Column (variable) to plot on x-axis
+    # string: Column (variable) to plot on y-axis
+    # Note that ROOT can use LaTeX formatting in its strings, but the ROOT latex command invocation is the pound symbol (#) not the backslash (\)
+    hists = OrderedDict()
+    hists['h1'] = ana.DataFrame.Histo2D(('h1','Invariant muon mass;m_{inv} [GeV];m_{inv} [GeV]',50,0.,150.,50,0.,150.),'invMass','invMass')
+    hists['h2'] = ana.DataFrame.Histo1D(('h2','Invariant muon mass;m_{inv} [GeV]',150,0.,150.),'invMass')
+    # all candidate pairs of every event (a vector column fills one entry per pair), and the best one
+    hists['h3'] = ana.DataFrame.Histo1D(('h3','Invariant mass of all opposite charge muon pairs;m_{inv} [GeV]',150,0.,150.),'Dimuon_mass')
+    hists['h4'] = ana.DataFrame.Histo1D(('h4','Invariant mass of the muon pair closest to m_{Z};m_{inv} [GeV]',150,0.,150.),'Dimuon_bestMass')
+    return hists
+
+
+if __name__ == '__main__':
+    # number of threads from -j N / --threads N (or $TIMBER_NTHREADS, default 1)
+    nThreads = ParseThreads(sys.argv)
+    useSkim = '--skim' in sys.argv
+    useProfile = '--profile' in sys.argv
+    optimizeCuts = '--optimize-cuts' in sys.argv
+    declaredCutflow = '--declared-cutflow' in sys.argv
+    # instantiate the analyzer module. This class takes in either a ROOT file or a .txt list of ROOT files, all with the same trees (ideally)
+    ana = analyzer('/home/physicist/rootfiles/nanoaod.root', nThreads=nThreads, profile=useProfile, prune=True)
+
+    # With --skim the events passing the muon preselection are cached on disk (see skimcache.py), and later runs
+    # with the same input and cuts start from the cached events instead of re-reading the full file
+    # With --optimize-cuts the quality cuts are measured on a sample of events and applied cheapest first (see cutorder.py).
+    # --declared-cutflow also counts them in the written order, for the cutflow, at the price of evaluating them twice
+    preselection = {}
+    def Preselection(ana):
+        preselection['order'] = MuonPreselection(ana, optimizeCuts, declaredCutflow)
+    if useSkim:
+        ana = SkimCache(ana, Preselection, SKIM_COLUMNS)
+        MuonCandidates(ana)
+    else:
+        Preselection(ana)
+        MuonCandidates(ana)
+    # Book the cutflow now that all the cuts are in place. Nothing is run yet - the counts for every
+    # cut are filled in the same event loop as the histograms below.
+    cutflow = Cutflow(ana)
 
     # Now, let's plot the results of our naive top/phi identification (based solely on pT of the jets)
     # Create a TCanvas on which to draw our histograms
@@ -73,13 +158,12 @@ if __name__ == '__main__':
     # Note that the first time we access the results of our TIMBER definitions/cuts, we will execute all of the actions booked on the DataFrame. Up until that point,
     # the actions have not been executed. So, once we call Histo2D() below, all of our Define() and Cut() calls will be implemented.
 
-    # The RDataFrame::Histo2D() constructor takes in the following arguments in pyROOT:
-    # tuple: ("hist name", "hist title;x axis title;y axis title", nBinsX, xMin, xMax, nBinsY, yMin, yMax)
-    # string: Column (variable) to plot on x-axis
-    # string: Column (variable) to plot on y-axis
-    # Note that ROOT can use LaTeX formatting in its strings, but the ROOT latex command invocation is the pound symbol (#) not the backslash (\)
-    h1 = ana.DataFrame.Histo2D(('h1','Invariant muon mass;m_{inv} [GeV];m_{inv} [GeV]',50,0.,150.,50,0.,150.),'invMass','invMass')
-    h2 = ana.DataFrame.Histo1D(('h2','Invariant muon mass;m_{inv} [GeV]',150,0.,150.),'invMass')
+    # See BookHistos() above for the arguments of the RDataFrame::Histo2D() constructor
+    hists = BookHistos(ana)
+    h1, h2 = hists['h1'], hists['h2']
+    # Run the event loop. With --profile it is timed per Cut/Define node (see profiling.py)
+    with ana.Profile():
+        h1.GetValue()
     h1.Draw("LEGO2")
     c.Print('/home/physicist/rootfiles/plots.pdf')
     c.Clear()
@@ -91,5 +175,34 @@ if __name__ == '__main__':
     
     c.Print('/home/physicist/rootfiles/plots.pdf')
     c.Clear()
+    # The same fit on every candidate pair. These histograms were filled in the same event loop, at no extra cost
+    for h in (hists['h3'], hists['h4']):
+        h.Draw()
+        fit_result = h.Fit("gaus","S","",60,120)
+        text = ROOT.TLatex(10,0.9*h.GetMaximum(),"Fit's mean = "+str(round(fit_result.Parameter(1),2)))
+        text.Draw("SAME")
+        c.Print('/home/physicist/rootfiles/plots.pdf')
+        c.Clear()
     # we're done with our multi-hist canvas, so close it out with ']'
     c.Print('/home/physicist/rootfiles/plots.pdf]')
+
+    table = cutflow.Table()
+    if useSkim:
+        # the preselection was applied when the skim was made, its yields are stored with it
+        table = ChainTables(ana.skimCutflow, table)
+    if optimizeCuts:
+        # the measured order; with --declared-cutflow the cutflow rows in the order they are written above
+        preselection['order'].Print()
+        if declaredCutflow and preselection['order'].Ready():
+            table = preselection['order'].DeclaredOrder(table)
+        elif declaredCutflow:
+            print('the cut group went into a cached skim, its cutflow rows are in the executed order')
+    PrintTable(table)
+    # bytes read from the input against the size of the events tree, and the MuonPlus_*/MuonNeg_* columns defined
+    ana.PrintIO()
+    # the text file as before, and the same table as JSON
+    SaveTable(table, '/home/physicist/rootfiles/cutflow_muonInvMass.txt')
+    SaveTable(table, '/home/physicist/rootfiles/cutflow_muonInvMass.json')
+    if useProfile:
+        # per-node times, events in/out and the JIT and I/O times: profile_muonInvMass.json, plus profile_muonInvMass.folded for flamegraph.pl
+        ana.SaveProfile('/home/physicist/rootfiles/profile_muonInvMass')
@@ -0,0 +1,29 @@
+# Small helpers for walking the chain of TIMBER nodes that an analyzer builds up.
+# Every Cut() and Define() call on the analyzer creates a new Node whose parent is the
+# previous active node, so following the parents back from any node gives the full
+# history of actions that were applied to get there.
+
+
+def NodeChain(node):
+    '''Return the list of nodes from the base node down to (and including) node.'''
+    chain = []
+    while node is not None:
+        chain.append(node)
+        node = node.parent
+    chain.reverse()
+    return chain
+
+
+def IsCut(node):
+    '''True if node was made by a Cut(), i.e. it added a filter rather than a column.'''
+    if node.parent is None:
+        return False
+    return not IsDefine(node)
+
+
+def IsDefine(node):
+    '''True if node was made by a Define(), i.e. it added a column named after the node.'''
+    if node.parent is None:
+        return False
+    return str(node.name) in [str(c) for c in node.DataFrame.GetDefinedColumnNames()] and \
+           str(node.name) not in [str(c) for c in node.parent.DataFrame.GetDefinedColumnNames()]
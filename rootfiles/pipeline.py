@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# One command for the QCD HT-binned campaign: genJet.py -> rescale.py -> draw_HT.py.
+#
+# Every sample in samples.QCDSamples becomes a small chain of tasks (genjet -> rescale) and
+# all of them feed one draw task. Tasks run in a process pool as soon as the tasks they depend
+# on are done, so the genJet event loops of all samples run concurrently.
+#
+# Each task remembers a key made from the checksums of its input files, the code it runs (with
+# every local module it imports, see Code()) and its arguments. If the key has not changed since the last run and its outputs still exist,
+# the task is skipped - so after adding or replacing the input of one sample, only that sample
+# is reprocessed (plus the final plot).
+#
+# Inputs are looked up as INPUT_DIR/<process>.txt or INPUT_DIR/<process>.root, where <process>
+# is e.g. QCD_HT50to100 (the PROCESS_NAME genJet.py would be run with).
+#
+# Usage: python3 pipeline.py INPUT_DIR [--workdir DIR] [-n WORKERS] [-j THREADS] [--force]
+
+import os
+import re
+import ast
+import json
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from caching import FileChecksum, HashStrings, InputFiles, WriteJSON
+from samples import QCDSamples, ProcessName
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def Code(*names):
+    '''The files names (relative to this directory), plus every local module they import and every
+    header a C++ file includes, recursively - so an edit to any of them invalidates the task.'''
+    files = []
+    todo = [os.path.join(here, n) for n in names]
+    while todo:
+        path = todo.pop(0)
+        if path in files or not os.path.exists(path):
+            continue
+        files.append(path)
+        with open(path) as f:
+            source = f.read()
+        if path.endswith('.py'):
+            # also the imports inside functions
+            for node in ast.walk(ast.parse(source)):
+                if isinstance(node, ast.Import):
+                    modules = [a.name for a in node.names]
+                elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                    modules = [node.module]
+                else:
+                    continue
+                todo += [os.path.join(here, m.split('.')[0] + '.py') for m in modules]
+        else:
+            todo += [os.path.join(os.path.dirname(path), h) for h in re.findall(r'#include\s+"([^"]+)"', source)]
+    return files
+
+
+class Task(object):
+    '''One step of the pipeline: func(*args), reading inputs and writing outputs.
+
+    Args:
+        name (str): Unique task name.
+        func: Module-level function (it is sent to a worker process).
+        args (tuple): Arguments to func.
+        inputs (list): Files read by func. Their content is part of the cache key.
+        outputs (list): Files written by func.
+        code (list): Source files func depends on. Their content is part of the cache key.
+        deps (list): Names of the tasks that have to finish first.
+    '''
+    def __init__(self, name, func, args, inputs, outputs, code, deps=()):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+        self.code = code
+        self.deps = list(deps)
+
+    def Key(self):
+        parts = [self.name, self.func.__module__, self.func.__name__, repr(self.args)]
+        parts += [f'{f}:{FileChecksum(f)}' for f in self.inputs + self.code]
+        return HashStrings(*parts)
+
+    def _stamp(self, workdir):
+        return os.path.join(workdir, '.pipeline', self.name + '.json')
+
+    def UpToDate(self, workdir):
+        stamp = self._stamp(workdir)
+        if not os.path.exists(stamp) or not all(os.path.exists(o) for o in self.outputs):
+            return False
+        with open(stamp) as f:
+            return json.load(f)['key'] == self.Key()
+
+    def Record(self, workdir):
+        os.makedirs(os.path.dirname(self._stamp(workdir)), exist_ok=True)
+        WriteJSON(self._stamp(workdir), {'key': self.Key(), 'outputs': self.outputs})
+
+
+def RunTasks(tasks, workdir, workers, force=False):
+    '''Run tasks (dict name -> Task) respecting deps, skipping those that are up to date.'''
+    pending = OrderedDict(tasks)
+    done, running = set(), {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        while pending or running:
+            ready = [t for t in pending.values() if all(d in done for d in t.deps)]
+            for t in ready:
+                del pending[t.name]
+                if not force and t.UpToDate(workdir):
+                    print(f'[pipeline] {t.name}: up to date')
+                    done.add(t.name)
+                else:
+                    print(f'[pipeline] {t.name}: running')
+                    running[pool.submit(t.func, *t.args)] = t
+            if ready and not running:
+                continue    # skipped tasks may have unblocked others
+            if not running:
+                raise Exception(f'RunTasks -- unresolvable dependencies for {list(pending)}')
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                t = running.pop(future)
+                future.result()    # re-raises if the task failed
+                t.Record(workdir)
+                done.add(t.name)
+                print(f'[pipeline] {t.name}: done')
+
+
+def RunGenJet(inputPath, prc, outDir, nThreads):
+    from genJet import GenJet
+    os.makedirs(outDir, exist_ok=True)
+    return GenJet(inputPath, prc, outDir=outDir, nThreads=nThreads)
+
+
+def RunRescale(src, dst):
+    from rescale import Rescale
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if Rescale(src, dst) is None:
+        raise Exception(f'RunRescale -- could not determine the scale factor for {src}')
+
+
+def RunDraw(fileNames, output):
+    from draw_HT import DrawHT
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    DrawHT(fileNames, output)
+
+
+def CampaignTasks(inputDir, workdir, nThreads=1):
+    tasks = OrderedDict()
+    plotsDir = os.path.join(workdir, 'plots')
+    rescaleDir = os.path.join(workdir, 'plots_fullSample_rescale')
+    rescaled = []
+    for sample in QCDSamples:
+        prc = ProcessName(sample)
+        inputPath = next((os.path.join(inputDir, prc + ext) for ext in ('.txt', '.root')
+                          if os.path.exists(os.path.join(inputDir, prc + ext))), None)
+        if inputPath is None:
+            print(f'[pipeline] no input for {prc} in {inputDir}, skipping')
+            continue
+        inputs = [inputPath] + [f for f in InputFiles(inputPath) if f != inputPath]
+        genjetOut = os.path.join(plotsDir, sample)
+        tasks[f'genjet_{prc}'] = Task(f'genjet_{prc}', RunGenJet, (inputPath, prc, plotsDir, nThreads),
+                                      inputs, [genjetOut], Code('genJet.py', 'Modules.cc'))
+        rescaleOut = os.path.join(rescaleDir, sample)
+        tasks[f'rescale_{prc}'] = Task(f'rescale_{prc}', RunRescale, (genjetOut, rescaleOut),
+                                       [genjetOut], [rescaleOut], Code('rescale.py'), deps=[f'genjet_{prc}'])
+        rescaled.append(rescaleOut)
+    output = os.path.join(plotsDir, 'QCD_HT_fullSample_rescale100ifb.png')
+    tasks['draw_HT'] = Task('draw_HT', RunDraw, (rescaled, output), rescaled, [output],
+                            Code('draw_HT.py'), deps=[n for n in tasks if n.startswith('rescale_')])
+    return tasks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run genJet.py, rescale.py and draw_HT.py for all QCD HT samples.')
+    parser.add_argument('inputDir', help='directory with one <process>.txt or <process>.root per sample')
+    parser.add_argument('--workdir', default='.', help='where plots/ and plots_fullSample_rescale/ are written')
+    parser.add_argument('-n', '--workers', type=int, default=os.cpu_count(), help='number of parallel tasks')
+    parser.add_argument('-j', '--threads', type=int, default=1, help='threads per genJet task')
+    parser.add_argument('--force', action='store_true', help='rerun every task')
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir)
+    RunTasks(CampaignTasks(os.path.abspath(args.inputDir), workdir, args.threads), workdir, args.workers, args.force)
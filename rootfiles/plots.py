@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+# Batch rendering of many plots from declarative specs, in parallel processes.
+#
+# A spec is a dict describing one output file: which histograms to overlay (from ROOT files or
+# from a histogram store, see histstore.py) and how to draw them. RenderPlots() renders a list
+# of specs in a process pool, every worker in batch mode with the shared style (style.py).
+# A plot is skipped when its spec, its inputs and the plotting code are unchanged since it was
+# last rendered and the output still exists - so after rerunning genJet.py for one sample, only
+# the plots that sample is in are redrawn. An input is a whole ROOT file, but only the histograms
+# a spec reads from a store (HistStore.Checksum()), so putting other samples into the store, or
+# compacting it, does not redraw the plot.
+#
+# Spec keys (only output and hists are required):
+#     output:  file to write, any format TCanvas::Print() knows from the extension (.png, .pdf, ...)
+#     hists:   list of {'file': path, 'name': histogram} or {'store': path, 'sample': s, 'name': histogram},
+#              each with an optional 'label' (legend entry) and 'scale' (factor applied before drawing)
+#     option:  draw option (default 'hist'), stack: draw as a THStack instead of overlaid
+#     logx, logy, title, xtitle, ytitle, yrange: [lo, hi], legend: [x1, y1, x2, y2] or None
+#
+# Usage:
+#     python3 plots.py specs.json [-n WORKERS] [--force]                 # a JSON list of specs
+#     python3 plots.py --overlay plots/GenJet_*.root --outdir overlays    # every histogram, all files overlaid
+#     python3 plots.py --store campaign_rescale --outdir overlays         # the same from a histogram store
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from caching import CacheDir, FileChecksum, HashStrings, WriteJSON
+
+here = os.path.dirname(os.path.abspath(__file__))
+CODE = [os.path.join(here, f) for f in ('plots.py', 'style.py', 'histstore.py')]
+
+DEFAULTS = {
+    'option': 'hist',
+    'stack': False,
+    'logx': False,
+    'logy': False,
+    'title': None,
+    'xtitle': None,
+    'ytitle': None,
+    'yrange': None,
+    'legend': [0.5, 0.6, 0.85, 0.9],
+}
+
+
+def SpecInputs(spec):
+    '''What a spec reads: the path of each ROOT file and (store, sample, name) of each store histogram.'''
+    inputs = []
+    for h in spec['hists']:
+        i = h['file'] if 'file' in h else (h['store'], h['sample'], h['name'])
+        if i not in inputs:
+            inputs.append(i)
+    return inputs
+
+
+def _Available(i, stores):
+    if isinstance(i, str):
+        return os.path.exists(i)
+    return _Store(i[0], stores).Has(i[1], i[2])
+
+
+def _Checksum(i, stores):
+    if isinstance(i, str):
+        return f'{i}:{FileChecksum(i)}'
+    return f'{i[0]}:{i[1]}:{i[2]}:{_Store(i[0], stores).Checksum(i[1], i[2])}'
+
+
+def _Store(path, stores):
+    if path not in stores:
+        from histstore import HistStore
+        stores[path] = HistStore(path)
+    return stores[path]
+
+
+def SpecKey(spec, stores=None):
+    '''Hash of the spec, the content of its inputs and the plotting code.'''
+    stores = {} if stores is None else stores
+    return HashStrings(json.dumps(spec, sort_keys=True), *[_Checksum(i, stores) for i in SpecInputs(spec)],
+                       *[f'{f}:{FileChecksum(f)}' for f in CODE])
+
+
+def _Stamp(spec):
+    return os.path.join(CacheDir('plots'), HashStrings(os.path.realpath(spec['output'])) + '.json')
+
+
+def UpToDate(spec, stores=None):
+    '''True if spec['output'] exists and was rendered from the same spec, inputs and code.'''
+    if not os.path.exists(spec['output']) or not os.path.exists(_Stamp(spec)):
+        return False
+    stores = {} if stores is None else stores
+    if not all(_Available(i, stores) for i in SpecInputs(spec)):
+        return False
+    with open(_Stamp(spec)) as f:
+        return json.load(f)['key'] == SpecKey(spec, stores)
+
+
+def Render(spec):
+    '''Draw one spec to its output file. Runs in a worker process.'''
+    import ROOT
+    from style import ApplyStyle, Color
+    ApplyStyle()
+    ROOT.gStyle.SetOptStat(0)
+    spec = dict(DEFAULTS, **spec)
+    hists, keep = [], []
+    for i, entry in enumerate(spec['hists']):
+        if 'file' in entry:
+            f = ROOT.TFile.Open(entry['file'], 'READ')
+            h = f.Get(entry['name']) if f else None
+            if not h:
+                raise Exception(f"Render -- no {entry['name']} in {entry['file']}")
+            h = h.Clone(f"h{i}")
+            h.SetDirectory(0)
+            f.Close()
+        else:
+            from histstore import HistStore
+            h = HistStore(entry['store']).Get(entry['sample'], entry['name']).ToROOT(f'h{i}')
+        if entry.get('scale', 1.) != 1.:
+            h.Scale(entry['scale'])
+        h.SetLineColor(Color(i))
+        h.SetLineWidth(2)
+        hists.append((entry.get('label', entry.get('sample', entry.get('file', ''))), h))
+
+    can = ROOT.TCanvas('can', '', 800, 600)
+    can.SetLogx(spec['logx'])
+    can.SetLogy(spec['logy'])
+    if spec['stack']:
+        stack = ROOT.THStack('stack', spec['title'] or '')
+        for i, (label, h) in enumerate(hists):
+            h.SetFillColor(Color(i))
+            stack.Add(h)
+        stack.Draw(spec['option'])
+        frame = stack
+        keep.append(stack)
+    else:
+        for i, (label, h) in enumerate(hists):
+            h.Draw(spec['option'] + (' same' if i else ''))
+        frame = hists[0][1]
+    if spec['title'] is not None:
+        frame.SetTitle(spec['title'])
+    if spec['xtitle'] is not None:
+        frame.GetXaxis().SetTitle(spec['xtitle'])
+    if spec['ytitle'] is not None:
+        frame.GetYaxis().SetTitle(spec['ytitle'])
+    if spec['yrange'] is not None:
+        if spec['stack']:
+            frame.SetMinimum(spec['yrange'][0])
+            frame.SetMaximum(spec['yrange'][1])
+        else:
+            frame.GetYaxis().SetRangeUser(*spec['yrange'])
+    if spec['legend'] is not None:
+        leg = ROOT.TLegend(*spec['legend'])
+        for label, h in hists:
+            leg.AddEntry(h, label)
+        leg.Draw('same')
+        keep.append(leg)
+    can.Modified()
+    # through a temporary file with the same extension, so an interrupted render leaves no broken plot
+    base, ext = os.path.splitext(spec['output'])
+    tmp = f'{base}.{os.getpid()}.tmp{ext}'
+    can.Print(tmp)
+    os.replace(tmp, spec['output'])
+    return spec['output']
+
+
+def _RenderJob(spec):
+    # errors are returned rather than raised, so one broken plot does not stop the others
+    try:
+        Render(spec)
+        return spec, None
+    except Exception as e:
+        return spec, f'{type(e).__name__}: {e}'
+
+
+def RenderPlots(specs, workers=None, force=False):
+    '''Render every spec that is not up to date, in a pool of workers. Returns (rendered, skipped, failed),
+    where failed is a list of (output, error).'''
+    for spec in specs:
+        if 'output' not in spec or not spec.get('hists'):
+            raise ValueError(f'RenderPlots -- a spec needs an output and at least one histogram: {spec}')
+    # the stores are opened once for all specs; a store changed while rendering only makes the next run redraw
+    stores = {}
+    todo = [s for s in specs if force or not UpToDate(s, stores)]
+    skipped = len(specs) - len(todo)
+    rendered, failed = 0, []
+    if todo:
+        for d in set(os.path.dirname(os.path.abspath(s['output'])) for s in todo):
+            os.makedirs(d, exist_ok=True)
+        workers = max(1, min(workers or os.cpu_count(), len(todo)))
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            for spec, error in pool.imap_unordered(_RenderJob, todo):
+                if error is None:
+                    WriteJSON(_Stamp(spec), {'key': SpecKey(spec, stores), 'output': spec['output']})
+                    rendered += 1
+                else:
+                    failed.append((spec['output'], error))
+    return rendered, skipped, failed
+
+
+def OverlaySpecs(fileNames, outDir, names=None, ext='png', **options):
+    '''One spec per 1D histogram of the first file (or per name in names), overlaying it from every file.'''
+    import ROOT
+    if names is None:
+        f = ROOT.TFile.Open(fileNames[0], 'READ')
+        names = []
+        for key in f.GetListOfKeys():
+            if key.GetName() not in names and ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom('TH1') \
+                    and not ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom('TH2'):
+                names.append(key.GetName())
+        f.Close()
+    labels = [os.path.basename(f).split('.root')[0] for f in fileNames]
+    return [dict(options, output=os.path.join(outDir, f'{name}.{ext}'),
+                 hists=[{'file': f, 'name': name, 'label': l} for f, l in zip(fileNames, labels)])
+            for name in names]
+
+
+def StoreOverlaySpecs(storePath, outDir, samples=None, names=None, ext='png', **options):
+    '''One spec per 1D histogram of a histogram store, overlaying it from every sample (or those in samples).'''
+    from histstore import HistStore
+    store = HistStore(storePath)
+    samples = store.Samples() if samples is None else [s for s in samples if store.Has(s)]
+    if names is None:
+        names = [n for n in store.Names(samples[0]) if len(store.Get(samples[0], n).edges) == 1]
+    return [dict(options, output=os.path.join(outDir, f"{name.replace('/', '_')}.{ext}"),
+                 hists=[{'store': storePath, 'sample': s, 'name': name, 'label': s.split('.root')[0]}
+                        for s in samples if store.Has(s, name)])
+            for name in names]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render plots from declarative specs in parallel.')
+    parser.add_argument('specs', nargs='?', help='JSON file with a list of specs')
+    parser.add_argument('--overlay', nargs='+', metavar='FILE', help='overlay every 1D histogram of these ROOT files')
+    parser.add_argument('--store', help='overlay every 1D histogram of this histogram store')
+    parser.add_argument('--outdir', default='overlays', help='output directory for --overlay/--store')
+    parser.add_argument('--ext', default='png', help='output format for --overlay/--store')
+    parser.add_argument('--logy', action='store_true', help='log scale on y for --overlay/--store')
+    parser.add_argument('-n', '--workers', type=int, default=os.cpu_count(), help='number of parallel renderers')
+    parser.add_argument('--force', action='store_true', help='render every plot, even if it is up to date')
+    args = parser.parse_args()
+
+    specs = []
+    if args.specs:
+        with open(args.specs) as f:
+            specs += json.load(f)
+    if args.overlay:
+        specs += OverlaySpecs(args.overlay, args.outdir, ext=args.ext, logy=args.logy)
+    if args.store:
+        specs += StoreOverlaySpecs(args.store, args.outdir, ext=args.ext, logy=args.logy)
+    if not specs:
+        parser.error('nothing to render: give a spec file, --overlay or --store')
+    rendered, skipped, failed = RenderPlots(specs, args.workers, args.force)
+    print(f'{rendered} plots rendered, {skipped} up to date, {len(failed)} failed')
+    for output, error in failed:
+        print(f'  {output}: {error}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,311 @@
+# Per-node timing of the event loop of a TIMBER analyzer.
+#
+# RDataFrame runs the whole graph of Cuts and Defines in one loop, so the total time of the loop
+# says nothing about which node it went to. With profile=True the analyzer below wraps the
+# expression of every Cut() and Define() (including the columns made by ObjectFromCollection())
+# in a small timer. It then counts, per node, how often the expression was evaluated (events in),
+# how often a Cut passed (events out) and how long the expression itself took. Defines are
+# evaluated lazily, only for events where something downstream needs them, so for a Define
+# "events in" is the number of evaluations.
+#
+# The loop is timed as a whole from Python. Two more numbers come from ROOT, separately:
+#   - JIT: the time RDataFrame spends compiling the string expressions before the loop starts.
+#     ROOT >= 6.24 reports it in RDataFrame's own log, which is taken from a log handler for that
+#     channel only; other ROOT messages and stderr go through as usual. Older ROOT (this image has 6.22) has no
+#     such log, so there the JIT is taken as the time from the start of the loop to the first
+#     timed expression - an upper bound that also includes opening the input files and reading
+#     the first baskets. The report says which of the two it is ('jit_source').
+#   - I/O: time spent reading and decompressing baskets, from a TTreePerfStats attached to the
+#     input chain. This only works single-threaded: with IMT every thread reads through its own
+#     copy of the chain, and I/O is reported as unknown.
+# Whatever remains of the loop time (RDataFrame bookkeeping, filling histograms, ...) is
+# reported as "other".
+#
+# With IMT the node times are summed over the threads, so they add up to as much as the number
+# of threads times the loop time. Shares (and "other") are relative to that thread time.
+#
+# The timers add roughly 50 ns per evaluated expression, so profile a run rather than leaving it
+# on. Wrapped expressions are different strings, so a profiled run does not share skims or
+# cached histograms with an unprofiled one (see skimcache.py, histcache.py).
+#
+# Usage:
+#     from profiling import analyzer
+#     ana = analyzer('file.root', profile=True)
+#     ...Cuts, Defines, histograms...
+#     with ana.Profile():         # around whatever triggers the event loop
+#         h.GetValue()
+#     ana.SaveProfile('profile')  # profile.json, profile.folded and a printed summary
+#
+# profile.folded is in the "folded stacks" format of flamegraph.pl/speedscope
+# (one line per node: "loop;cut1;cut2;define 1234" with the time in microseconds), with every
+# node stacked on the Cuts that come before it.
+import re
+import time
+import itertools
+from contextlib import contextmanager
+import ROOT
+from caching import WriteJSON
+from nodetools import NodeChain
+from threads import analyzer as _analyzer
+
+_timers = '''
+#include <atomic>
+#include <chrono>
+#include <mutex>
+#include <vector>
+namespace timber_profile {
+    using clock = std::chrono::steady_clock;
+    // start of the loop (Start()) and the first timed expression after it, for the JIT time on ROOT < 6.24
+    clock::time_point start;
+    std::atomic<long long> first{0};
+    inline void Start() { first = 0; start = clock::now(); }
+    inline double ToFirst() {
+        long long f = first.load();
+        return f ? std::chrono::duration<double>(clock::time_point(clock::duration(f)) - start).count() : -1.;
+    }
+    struct Stat { double self = 0., total = 0.; unsigned long long calls = 0, pass = 0; };
+    // one set of counters per thread, so the timers need no locking in the loop
+    struct Counters { std::vector<Stat> stats; std::vector<double> children; };
+    std::mutex lock;
+    std::vector<Counters*> all;
+    inline Counters& Mine() {
+        thread_local Counters* mine = nullptr;
+        if (!mine) { mine = new Counters(); std::lock_guard<std::mutex> guard(lock); all.push_back(mine); }
+        return *mine;
+    }
+    inline clock::time_point Begin() {
+        Mine().children.push_back(0.);
+        clock::time_point now = clock::now();
+        if (!first.load(std::memory_order_relaxed)) {
+            long long none = 0;
+            first.compare_exchange_strong(none, now.time_since_epoch().count());
+        }
+        return now;
+    }
+    inline void End(int node, clock::time_point t0, bool pass = true) {
+        double dt = std::chrono::duration<double>(clock::now() - t0).count();
+        Counters& c = Mine();
+        double children = c.children.back();
+        c.children.pop_back();
+        if (!c.children.empty()) c.children.back() += dt;
+        if ((int)c.stats.size() <= node) c.stats.resize(node + 1);
+        Stat& s = c.stats[node];
+        s.self += dt - children; s.total += dt; s.calls++; if (pass) s.pass++;
+    }
+    // {self, total, calls, pass} of node summed over threads
+    std::vector<double> Collect(int node) {
+        std::vector<double> out(4, 0.);
+        std::lock_guard<std::mutex> guard(lock);
+        for (auto c : all) {
+            if ((int)c->stats.size() <= node) continue;
+            const Stat& s = c->stats[node];
+            out[0] += s.self; out[1] += s.total; out[2] += s.calls; out[3] += s.pass;
+        }
+        return out;
+    }
+}
+'''
+
+# ROOT >= 6.24: a log handler in front of ROOT's own that keeps the messages of RDataFrame's channel
+# and passes every other channel on, so nothing else the loop prints is touched
+_logCapture = '''
+#include <memory>
+#include <mutex>
+#include <string>
+#include <ROOT/RLogger.hxx>
+#include <ROOT/RDF/Utils.hxx>
+namespace timber_profile_log {
+    class Capture : public ROOT::Experimental::RLogHandler {
+    public:
+        std::string text;
+        std::mutex lock;
+        bool Emit(const ROOT::Experimental::RLogEntry& entry) override {
+            if (entry.fChannel != &ROOT::Detail::RDF::RDFLogChannel()) return true;
+            std::lock_guard<std::mutex> guard(lock);
+            text += entry.fMessage + "\\n";
+            return false;
+        }
+    };
+    Capture* Start() {
+        auto c = std::make_unique<Capture>();
+        Capture* p = c.get();
+        ROOT::Experimental::RLogManager::Get().PushFront(std::move(c));
+        return p;
+    }
+    // the captured text; removes (and deletes) the handler
+    std::string Stop(Capture* c) {
+        std::string text = c->text;
+        ROOT::Experimental::RLogManager::Get().Remove(c);
+        return text;
+    }
+}
+'''
+
+# timer slots are global to the process, several analyzers (e.g. one on a skim) must not share them
+_slots = itertools.count()
+_jitLine = re.compile(r'Just-in-time compilation phase completed(?: in ([0-9.eE+-]+) seconds)?')
+
+
+class analyzer(_analyzer):
+    '''TIMBER analyzer (with nThreads, see threads.py) that can time every Cut and Define.
+
+    Args:
+        fileName: As for TIMBER's analyzer.
+        nThreads (int): As for threads.analyzer.
+        profile (bool): Wrap Cuts and Defines in timers. Without it this is threads.analyzer.
+    '''
+    def __init__(self, fileName, nThreads=None, profile=False, **kwargs):
+        self.profile = profile
+        self._profiled = []
+        self._loops = []
+        if profile and not hasattr(ROOT, 'timber_profile'):
+            ROOT.gInterpreter.Declare(_timers)
+        super(analyzer, self).__init__(fileName, nThreads=nThreads, **kwargs)
+
+    def Define(self, name, var, *args, **kwargs):
+        if not self._Wrappable(var):
+            return super(analyzer, self).Define(name, var, *args, **kwargs)
+        k = next(_slots)
+        wrapped = f'[&]{{ auto _t0 = timber_profile::Begin(); auto _r = ({var}); timber_profile::End({k}, _t0); return _r; }}()'
+        node = super(analyzer, self).Define(name, wrapped, *args, **kwargs)
+        self._profiled.append((k, name, 'Define', var, self.GetActiveNode()))
+        return node
+
+    def Cut(self, name, cuts, *args, **kwargs):
+        if not self._Wrappable(cuts):
+            return super(analyzer, self).Cut(name, cuts, *args, **kwargs)
+        k = next(_slots)
+        wrapped = f'[&]{{ auto _t0 = timber_profile::Begin(); bool _r = ({cuts}); timber_profile::End({k}, _t0, _r); return _r; }}()'
+        node = super(analyzer, self).Cut(name, wrapped, *args, **kwargs)
+        self._profiled.append((k, name, 'Cut', cuts, self.GetActiveNode()))
+        return node
+
+    def _Wrappable(self, expression):
+        # CutGroups/VarGroups are applied through Cut()/Define() one by one; expressions with
+        # their own return statements are function bodies and cannot be wrapped in parentheses
+        return self.profile and isinstance(expression, str) and 'return' not in expression
+
+    @contextmanager
+    def Profile(self):
+        '''Time the event loop(s) triggered in the body of the with-statement.'''
+        if not self.profile:
+            yield
+            return
+        perf = None
+        chain = getattr(self, '_eventsChain', None)
+        if chain and ROOT.GetImplicitMTPoolSize() <= 1:
+            perf = ROOT.TTreePerfStats('timber_profile_io', chain)
+        with _RDataFrameLog() as log:
+            ROOT.timber_profile.Start()
+            start = time.perf_counter()
+            yield
+            wall = time.perf_counter() - start
+        if _jitLine.search(log.text):
+            jit, source = sum(float(m.group(1) or 0.) for m in _jitLine.finditer(log.text)), 'log'
+        else:
+            # ROOT < 6.24: up to the first timed expression (see above)
+            jit, source = ROOT.timber_profile.ToFirst(), 'first event'
+            if jit < 0:
+                jit, source = None, None
+        io = None
+        if perf:
+            perf.Finish()
+            io = perf.GetDiskTime() + perf.GetUnzipTime()
+        self._loops.append({'wall': wall, 'jit': jit, 'jit_source': source, 'io': io})
+
+    def ProfileReport(self):
+        '''The profile as a dict: loop totals plus one entry per timed node, in the order they were made.'''
+        if not self.profile:
+            raise Exception('ProfileReport -- the analyzer was not made with profile=True')
+        wall = sum(l['wall'] for l in self._loops)
+        jit = None if any(l['jit'] is None for l in self._loops) else sum(l['jit'] for l in self._loops)
+        io = None if any(l['io'] is None for l in self._loops) else sum(l['io'] for l in self._loops)
+        loop = wall - (jit or 0.)
+        threads = getattr(self, 'nThreads', 1)
+        # the node times are summed over the threads
+        threadTime = threads * loop
+        sources = set(l['jit_source'] for l in self._loops)
+        cuts = set(name for _, name, kind, _, _ in self._profiled if kind == 'Cut')
+        nodes = []
+        for k, name, kind, expression, node in self._profiled:
+            selfTime, total, calls, passed = ROOT.timber_profile.Collect(k)
+            nodes.append({
+                'name': name, 'type': kind, 'expression': expression,
+                'time': selfTime, 'time_incl': total,
+                'share': selfTime / threadTime if threadTime > 0 else 0.,
+                'events_in': int(calls), 'events_out': int(passed),
+                # the Cuts this node sits behind, for the flame graph
+                'path': [str(n.name) for n in NodeChain(node)[:-1] if str(n.name) in cuts],
+            })
+        nodeTime = sum(n['time'] for n in nodes)
+        other = threadTime - nodeTime - (io or 0.)
+        return {
+            'input': self.fileName if isinstance(self.fileName, str) else list(self.fileName),
+            'threads': threads,
+            'loops': len(self._loops),
+            'wall': wall, 'jit': jit, 'jit_source': sources.pop() if len(sources) == 1 else None,
+            'io': io, 'loop': loop, 'thread_time': threadTime,
+            'nodes_total': nodeTime, 'other': other,
+            'nodes': nodes,
+        }
+
+    def SaveProfile(self, prefix, top=None):
+        '''Write prefix.json and prefix.folded and print a summary. Returns the report.'''
+        report = self.ProfileReport()
+        WriteJSON(prefix + '.json', report)
+        with open(prefix + '.folded', 'w') as f:
+            for n in report['nodes']:
+                f.write(';'.join(['loop'] + n['path'] + [f"{n['type']}:{n['name']}"]) + f" {int(round(n['time']*1e6))}\n")
+            for label in ('io', 'other'):
+                if report[label] is not None and report[label] > 0:
+                    f.write(f"loop;{label} {int(round(report[label]*1e6))}\n")
+            if report['jit']:
+                f.write(f"jit {int(round(report['jit']*1e6))}\n")
+        PrintProfile(report, top)
+        return report
+
+
+def PrintProfile(report, top=None):
+    '''Print a profile report (see analyzer.ProfileReport()) as a flame-style text summary.'''
+    # thread time plus the JIT, which is single threaded
+    total = report['thread_time'] + (report['jit'] or 0.)
+    def bar(t):
+        return '#' * int(round(40 * t / total)) if total > 0 else ''
+    def fmt(t):
+        return f'{t:10.4f}s' if t is not None else '       n/a '
+    print(f"profile of {report['loops']} event loop(s) on {report['threads']} thread(s): {report['wall']:.4f}s wall")
+    jit = 'JIT' if report['jit_source'] != 'first event' else 'JIT (+ startup, ROOT < 6.24)'
+    print(f"  {jit:<40} {fmt(report['jit'])}  {bar(report['jit'] or 0.)}")
+    print(f"  {'I/O (read + unzip)':<40} {fmt(report['io'])}  {bar(report['io'] or 0.)}")
+    print(f"  {'other (RDataFrame, actions)':<40} {fmt(report['other'])}  {bar(max(report['other'], 0.))}")
+    nodes = report['nodes']
+    if top is not None:
+        nodes = sorted(nodes, key=lambda n: -n['time'])[:top]
+    if report['threads'] > 1:
+        print(f"  node times are summed over the threads, shares are of {report['threads']} x the loop time")
+    print(f"  {'node':<40} {'time':>11} {'share':>7} {'in':>10} {'out':>10}")
+    for n in nodes:
+        label = '  ' * len(n['path']) + f"{n['type'][0]} {n['name']}"
+        print(f"  {label:<40} {fmt(n['time'])} {n['share']:>6.1%} {n['events_in']:>10d} {n['events_out']:>10d}  {bar(n['time'])}")
+
+
+@contextmanager
+def _RDataFrameLog():
+    '''Turn on RDataFrame's info log and capture its messages; every other log channel and stderr are left alone.'''
+    class Log(object):
+        text = ''
+    log = Log()
+    try:
+        verbosity = ROOT.Experimental.RLogScopedVerbosity(ROOT.Detail.RDF.RDFLogChannel(), ROOT.Experimental.ELogLevel.kInfo)
+    except AttributeError:
+        # ROOT < 6.24, no RDataFrame log: the JIT is estimated from the timers instead
+        yield log
+        return
+    if not hasattr(ROOT, 'timber_profile_log'):
+        ROOT.gInterpreter.Declare(_logCapture)
+    capture = ROOT.timber_profile_log.Start()
+    try:
+        yield log
+    finally:
+        log.text = str(ROOT.timber_profile_log.Stop(capture))
+        del verbosity
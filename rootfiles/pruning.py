@@ -0,0 +1,177 @@
+# Only the ObjectFromCollection() columns that are used, and a report of the bytes read.
+#
+# ana.ObjectFromCollection('Top', 'FatJet', 'DijetIdxs[0]') defines Top_<x> = FatJet_<x>[DijetIdxs[0]]
+# for every FatJet_<x> column - dozens of them in NanoAOD - while timber.py only uses four. Each of
+# them is a Define that RDataFrame has to just-in-time compile before the loop starts (and that
+# profiling.py wraps in a timer), whether anything reads it or not.
+#
+# With prune=True the analyzer below does not define the object's columns right away. It keeps
+# the object aside, with the node ObjectFromCollection() was called on, and defines each of its
+# columns the first time something uses it on a branch of the graph below that node:
+#   - a Define() or Cut() expression that mentions it (e.g. Top_pt in the mtphi Define),
+#   - a booking through a histcache.HistCache, variations.Variations or export.Export,
+#   - an explicit ana.Require('Top_pt', ...), which is needed before booking on ana.DataFrame directly.
+# ana.DataFrame stays the RDataFrame of the active node: a booking on it cannot be seen from here,
+# so a column only used there has to be Require()d first (a missing one fails as an unknown column).
+# The columns are still made by TIMBER's ObjectFromCollection(), with every unused column in its
+# skip list, so they are exactly what TIMBER would have defined. They are defined on the active
+# node, so a column defined later in the chain than ObjectFromCollection() was called has the same
+# value in every event, since it only depends on the collection and the index column. The
+# bookkeeping is per branch: after SetActiveNode() to another branch below the object's node, a
+# column is defined again there when it is used. On a node that is not below the object's node
+# the columns do not exist, just as without pruning.
+#
+# What this saves is the Defines themselves: each one is an expression RDataFrame has to compile
+# before the loop (and, with profiling, a timer). It does not save reading: RDataFrame already
+# reads only the input branches that a booked result needs, unused Defines or not, so there is no
+# I/O left to prune. IOReport() shows this: the compressed bytes actually read from the input files
+# against the compressed size of the whole events tree, plus the object columns that were defined
+# and skipped.
+#
+# Usage:
+#     from pruning import analyzer
+#     ana = analyzer('file.root', prune=True)
+#     ...Cuts, Defines, ObjectFromCollection(), histograms...
+#     ana.Require('Top_pt')       # only for columns that are booked on ana.DataFrame and not used in any Define/Cut
+#     h.GetValue()
+#     ana.PrintIO()
+import re
+import fnmatch
+import ROOT
+from caching import InputFiles
+from nodetools import NodeChain
+from profiling import analyzer as _analyzer
+
+_identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+class analyzer(_analyzer):
+    '''TIMBER analyzer (with nThreads and profile, see profiling.py) that defines only the used ObjectFromCollection() columns.
+
+    Args:
+        fileName: As for TIMBER's analyzer.
+        nThreads (int): As for threads.analyzer.
+        profile (bool): As for profiling.analyzer.
+        prune (bool): Define ObjectFromCollection() columns when they are first used. Without it this is profiling.analyzer.
+
+    With prune=True, ana.DataFrame is still the RDataFrame of the active node, but an object column that is
+    only booked on it (not used in a Define or Cut) has to be defined first with ana.Require().
+    '''
+    def __init__(self, fileName, nThreads=None, profile=False, prune=False, **kwargs):
+        self.prune = prune
+        # object name -> [collection, index, columns of the collection, node ObjectFromCollection() was called on]
+        self._pending = {}
+        # object name -> {column: [nodes it was defined on, one per branch]}
+        self._defined = {}
+        super(analyzer, self).__init__(fileName, nThreads=nThreads, profile=profile, **kwargs)
+        self._bytesRead0 = ROOT.TFile.GetFileBytesRead()
+        # compressed size of the events tree, read once by IOReport()
+        self._bytesAvailable = None
+
+    def ObjectFromCollection(self, name, collection, index, skip=[]):
+        if not self.prune:
+            return super(analyzer, self).ObjectFromCollection(name, collection, index, skip)
+        columns = [str(c) for c in self.GetActiveNode().DataFrame.GetColumnNames()]
+        variables = [c[len(collection)+1:] for c in columns
+                     if c.startswith(collection + '_') and c not in skip and c[len(collection)+1:] not in skip]
+        self._pending[name] = [collection, index, variables, self.GetActiveNode()]
+        self._defined[name] = {}
+        return self.GetActiveNode()
+
+    def Define(self, name, var, *args, **kwargs):
+        self._RequireIn(var)
+        return super(analyzer, self).Define(name, var, *args, **kwargs)
+
+    def Cut(self, name, cuts, *args, **kwargs):
+        self._RequireIn(cuts)
+        return super(analyzer, self).Cut(name, cuts, *args, **kwargs)
+
+    def Require(self, *columns):
+        '''Define the pending ObjectFromCollection() columns among columns (or mentioned in them, for
+        expressions, or matching them, for shell-style wildcards like Top_*). Anything that is not a
+        string, or a list/tuple of them, is ignored.'''
+        for c in columns:
+            self._RequireIn(c)
+
+    def _RequireIn(self, expression):
+        if isinstance(expression, (list, tuple)):
+            for e in expression:
+                self._RequireIn(e)
+            return
+        if not self._pending or not isinstance(expression, str):
+            return
+        needed = {}
+        if any(c in expression for c in '*?['):
+            for name, (collection, index, variables, origin) in self._pending.items():
+                needed[name] = [v for v in variables if fnmatch.fnmatchcase(f'{name}_{v}', expression)]
+        for token in set(_identifier.findall(expression)):
+            for name, (collection, index, variables, origin) in self._pending.items():
+                if token.startswith(name + '_') and token[len(name)+1:] in variables:
+                    if token[len(name)+1:] not in needed.setdefault(name, []):
+                        needed[name].append(token[len(name)+1:])
+        chain = NodeChain(self.GetActiveNode())
+        for name, use in needed.items():
+            collection, index, variables, origin = self._pending[name]
+            # only below the node of the ObjectFromCollection() call, and only what this branch does not have yet
+            if not _Below(origin, chain):
+                continue
+            defined = self._defined[name]
+            # None: being defined right now
+            use = [v for v in use if not any(n is None or _Below(n, chain) for n in defined.get(v, []))]
+            if not use:
+                continue
+            # mark them first: TIMBER's ObjectFromCollection() goes through Define(), which comes back here
+            for v in use:
+                defined.setdefault(v, []).append(None)
+            skip = [f'{collection}_{v}' for v in variables if v not in use]
+            super(analyzer, self).ObjectFromCollection(name, collection, index, skip=skip + [v[len(collection)+1:] for v in skip])
+            node = self.GetActiveNode()
+            # every column is available on the branch from this node down
+            for v in use:
+                defined[v][-1] = node
+
+    def IOReport(self):
+        '''Bytes read from the input files since the analyzer was made, the size of the events tree, and the
+        ObjectFromCollection() columns defined and skipped.'''
+        if self._bytesAvailable is None:
+            # one pass over the file headers, the first time only; the bytes it reads are not counted as read
+            before = ROOT.TFile.GetFileBytesRead()
+            self._bytesAvailable = _ZipBytes(self.fileName, self._eventsChain.GetName())
+            self._bytesRead0 += ROOT.TFile.GetFileBytesRead() - before
+        read = ROOT.TFile.GetFileBytesRead() - self._bytesRead0
+        available = self._bytesAvailable
+        return {
+            'bytes_read': read,
+            'bytes_available': available,
+            'fraction': read / available if available else None,
+            'objects': {name: {'defined': sorted(self._defined[name]),
+                               'skipped': sorted(v for v in self._pending[name][2] if v not in self._defined[name])}
+                        for name in self._defined},
+        }
+
+    def PrintIO(self):
+        report = self.IOReport()
+        fraction = f" ({report['fraction']:.1%})" if report['fraction'] is not None else ''
+        print(f"read {report['bytes_read']/1024**2:.1f} MB of {report['bytes_available']/1024**2:.1f} MB{fraction}")
+        for name, columns in report['objects'].items():
+            print(f"  {name}: {len(columns['defined'])} columns defined ({', '.join(columns['defined'])}), "
+                  f"{len(columns['skipped'])} skipped")
+        return report
+
+
+def _ZipBytes(fileName, treeName):
+    '''Compressed size of the tree treeName summed over the input files.'''
+    available = 0
+    for path in InputFiles(fileName):
+        f = ROOT.TFile.Open(path)
+        tree = f.Get(treeName) if f else None
+        if tree:
+            available += tree.GetZipBytes()
+        if f:
+            f.Close()
+    return available
+
+
+def _Below(node, chain):
+    '''True if node is one of the nodes of chain (see nodetools.NodeChain()).'''
+    return any(n is node for n in chain)
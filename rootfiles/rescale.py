@@ -1,72 +1,174 @@
 #!/usr/bin/python3
+# Scale the genJet.py outputs to an integrated luminosity.
+#
+# Each input file is streamed key by key into a scaled copy - one object in memory at a time,
+# and the inputs are never modified, so rerunning is safe and the unscaled files stay usable.
+# The normalization comes from the genEventCount/genEventSumw parameters that genJet.py writes
+# in the same event loop as the histograms. Files written before that existed fall back to
+# the integral of GenJet_HT.
+#
+# Alternatively, ScaleFactor() gives the factor for a file without writing anything, so plots
+# can be scaled at read time (see draw_HT.py --lazy).
+#
+# A subdirectory with its own genEventSumw - a weight variation written by genJet.py, see
+# variations.py - is normalized to that sum of weights instead, so every variation is scaled to
+# the same cross section times luminosity.
+#
+# With --store, the histograms are read from a histogram store (histstore.py) instead, and the
+# scaled copies of all samples go to a second store, one vectorized Scale() per histogram.
+#
+# Usage: python3 rescale.py [--input plots] [--output plots_fullSample_rescale] [-n WORKERS]
+#        python3 rescale.py --store campaign [--output campaign_rescale]
 
 import ROOT
 import sys
 import os
+import argparse
+import multiprocessing
+from samples import QCDSamples, crossSectionArray
 
-QCDSamples = [
-    "GenJet_QCD_HT50to100.root",
-    "GenJet_QCD_HT100to200.root",
-    "GenJet_QCD_HT200to300.root",
-    "GenJet_QCD_HT300to500.root",
-    "GenJet_QCD_HT500to700.root",
-    "GenJet_QCD_HT700to1000.root",
-    "GenJet_QCD_HT1000to1500.root",
-    "GenJet_QCD_HT1500to2000.root",
-    "GenJet_QCD_HT2000toInf.root"
-]
-
-# unit fb-1
-crossSectionArray = {
-    "GenJet_QCD_HT50to100.root" : 187700000.0,  # +-1639000
-    "GenJet_QCD_HT100to200.root" : 23500000.0,  # +-207400
-    "GenJet_QCD_HT200to300.root" : 1552000.0,  # +-14450.0
-    "GenJet_QCD_HT300to500.root" : 321100.0,  # +-2968.0
-    "GenJet_QCD_HT500to700.root" : 30250.0,  # +-284.0
-    "GenJet_QCD_HT700to1000.root" : 6398.0,  # +-59.32
-    "GenJet_QCD_HT1000to1500.root" : 1122.0,  # +- 10.41
-    "GenJet_QCD_HT1500to2000.root" : 109.4,  # +-1.006
-    "GenJet_QCD_HT2000toInf.root" : 21.74, # +-0.2019
-}
+intLumi = 100000.0 #100/fb
 
-if __name__ == '__main__':
-    
-    intLumi = 100000.0 #100/fb
-    
-    fileInArray = []
-    for sample in QCDSamples:
-        sample = "plots_fullSample_rescale/" + sample
-        if not os.path.exists(sample): continue
-        fileInArray.append(ROOT.TFile.Open(sample,"UPDATE"))
-    
-    for fileIn in fileInArray:
-        if not (fileIn.Get("GenJet_HT")):
-            print("GenJet_HT not found, exit for "+str(fileIn))
-            continue
-        nEvetsPreTrig = fileIn.Get("GenJet_HT").Integral()
-        if (nEvetsPreTrig == 0):
-            print("nEvetsPreTrig is zero, exiting")
-            continue
-        # str(TFile) = 'Name: plots/GenJet_QCD_HT50to100.root Title: '
-        nameFromTFile = str(fileIn)[str(fileIn).find("Name")+6:str(fileIn).find("Title")-1]
-        basename = nameFromTFile.split("/")[-1]
-        if not (crossSectionArray.get(basename)):
-            print("No crossSectionArray for "+str(nameFromTFile))
+
+def Normalization(fileIn):
+    '''Number of events the histograms in fileIn were filled from.'''
+    # genJet.py fills its histograms unweighted, so they are normalized to the event count.
+    # genEventSumw is stored alongside for weighted histograms.
+    count = fileIn.Get("genEventCount")
+    if count:
+        return count.GetVal()
+    if not (fileIn.Get("GenJet_HT")):
+        return 0.
+    print(f"No genEventCount in {fileIn.GetName()}, normalizing to the GenJet_HT integral")
+    return fileIn.Get("GenJet_HT").Integral()
+
+
+def StoreNormalization(store, sample):
+    '''Normalization() of a sample of a histstore.HistStore.'''
+    params = store.Params(sample)
+    if 'genEventCount' in params:
+        return params['genEventCount']
+    if not store.Has(sample, "GenJet_HT"):
+        return 0.
+    print(f"No genEventCount for {sample} in {store.path}, normalizing to the GenJet_HT integral")
+    return store.Get(sample, "GenJet_HT").Integral()
+
+
+def ScaleFactor(fileName, intLumi=intLumi, store=None):
+    '''Factor that scales the histograms of fileName to intLumi, or None if it cannot be determined.
+    With a histstore.HistStore, fileName is the name of a sample in the store.'''
+    basename = os.path.basename(fileName)
+    if not (crossSectionArray.get(basename)):
+        print("No crossSectionArray for "+fileName)
+        return None
+    if store is not None:
+        nEvents = StoreNormalization(store, basename)
+    else:
+        fileIn = ROOT.TFile.Open(fileName,"READ")
+        nEvents = Normalization(fileIn)
+        fileIn.Close()
+    if (nEvents == 0):
+        print("Number of events is zero for "+fileName)
+        return None
+    return intLumi * crossSectionArray.get(basename) / nEvents
+
+
+def _VariationWeight(weight, norm, sumw):
+    '''Scale factor of a weight variation with sum of weights sumw, where norm is cross section times luminosity.'''
+    if norm is None or sumw is None or sumw == 0:
+        return weight
+    return norm / sumw
+
+
+def _CopyScaled(dirIn, dirOut, weight, norm=None):
+    seen = set()
+    for key in dirIn.GetListOfKeys():
+        # only the latest cycle of each object
+        if key.GetName() in seen: continue
+        seen.add(key.GetName())
+        obj = key.ReadObj()
+        if obj.InheritsFrom("TDirectory"):
+            sumw = obj.Get("genEventSumw")
+            _CopyScaled(obj, dirOut.mkdir(key.GetName()), _VariationWeight(weight, norm, sumw.GetVal() if sumw else None), norm)
             continue
-        
-        # rescale weight
-        weight = intLumi * crossSectionArray.get(basename) / nEvetsPreTrig
-        print(nameFromTFile+" is reweighted with " + str(weight))
-        if (abs(1-weight) < 0.0001) : continue
-        
-        for i in range(0, fileIn.GetListOfKeys().GetEntries()):
-            name = fileIn.GetListOfKeys().At(i).GetName()
-            obj = fileIn.Get(name)
-            if not (obj) : continue
-            if (obj.GetEntries() == 0 ) : continue
-            if obj.InheritsFrom("TObject"):
+        if obj.InheritsFrom("TH1"):
+            obj.SetDirectory(0)
+            if obj.GetEntries() != 0:
                 obj.Scale(weight)
+        dirOut.WriteTObject(obj, key.GetName())
+        # free every object as soon as it is written, so only one is in memory at a time
+        ROOT.SetOwnership(obj, True)
+        del obj
 
-        fileIn.Write("",ROOT.TObject.kOverwrite)
-        fileIn.Close()
-    
\ No newline at end of file
+
+def Rescale(fileName, outName, intLumi=intLumi):
+    '''Write a copy of fileName to outName with every histogram scaled to intLumi.
+    Returns the scale factor, or None (and writes nothing) if it cannot be determined.'''
+    weight = ScaleFactor(fileName, intLumi)
+    if weight is None:
+        return None
+    print(fileName+" is reweighted with " + str(weight))
+    fileIn = ROOT.TFile.Open(fileName,"READ")
+    tmpName = f"{outName}.{os.getpid()}.tmp"
+    fileOut = ROOT.TFile.Open(tmpName,"RECREATE")
+    _CopyScaled(fileIn, fileOut, weight, intLumi * crossSectionArray.get(os.path.basename(fileName)))
+    fileOut.Close()
+    fileIn.Close()
+    os.replace(tmpName, outName)
+    return weight
+
+
+def RescaleStore(storeIn, storeOut, intLumi=intLumi):
+    '''Put a copy of every sample of histstore.HistStore storeIn into storeOut, with every histogram scaled to intLumi.
+    Samples whose scale factor cannot be determined are skipped. Returns {sample: scale factor}.'''
+    weights = {}
+    for sample in storeIn.Samples():
+        weight = ScaleFactor(sample, intLumi, store=storeIn)
+        if weight is None:
+            continue
+        print(sample+" is reweighted with " + str(weight))
+        norm = intLumi * crossSectionArray.get(os.path.basename(sample))
+        params = storeIn.Params(sample)
+        hists = {}
+        for name in storeIn.Names(sample):
+            h = storeIn.Get(sample, name)
+            # 'variation/name', normalized to 'variation/genEventSumw' if there is one
+            w = _VariationWeight(weight, norm, params.get(name.rsplit('/', 1)[0] + '/genEventSumw')) if '/' in name else weight
+            hists[name] = h.Scale(w) if h.entries != 0 else h
+        storeOut.Put(sample, hists, params)
+        weights[sample] = weight
+    return weights
+
+
+def _RescaleJob(job):
+    return Rescale(*job)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write copies of the genJet.py outputs scaled to the integrated luminosity.')
+    parser.add_argument('--input', default='plots', help='directory with the genJet.py outputs')
+    parser.add_argument('--output', default=None, help='directory for the scaled copies (default: plots_fullSample_rescale), or store with --store (default: STORE_rescale)')
+    parser.add_argument('--store', default=None, help='read the genJet.py outputs from this histogram store (see histstore.py)')
+    parser.add_argument('--lumi', type=float, default=intLumi, help='integrated luminosity, in the inverse unit of the cross sections in samples.py (default: 100/fb)')
+    parser.add_argument('-n', '--workers', type=int, default=os.cpu_count(), help='number of files processed in parallel')
+    args = parser.parse_args()
+
+    if args.store:
+        from histstore import HistStore
+        output = args.output or args.store + '_rescale'
+        if os.path.realpath(output) == os.path.realpath(args.store):
+            print("Input and output stores must differ, rescale.py does not modify its inputs")
+            sys.exit(1)
+        RescaleStore(HistStore(args.store), HistStore(output), args.lumi)
+        sys.exit(0)
+    args.output = args.output or 'plots_fullSample_rescale'
+    if os.path.realpath(args.input) == os.path.realpath(args.output):
+        print("Input and output directories must differ, rescale.py does not modify its inputs")
+        sys.exit(1)
+    os.makedirs(args.output, exist_ok=True)
+    jobs = []
+    for sample in QCDSamples:
+        if not os.path.exists(os.path.join(args.input, sample)): continue
+        jobs.append((os.path.join(args.input, sample), os.path.join(args.output, sample), args.lumi))
+    with multiprocessing.get_context('spawn').Pool(max(1, min(args.workers, len(jobs)))) as pool:
+        pool.map(_RescaleJob, jobs)
@@ -0,0 +1,31 @@
+# The QCD HT-binned samples used by genJet.py, rescale.py, draw_HT.py and pipeline.py.
+
+QCDSamples = [
+    "GenJet_QCD_HT50to100.root",
+    "GenJet_QCD_HT100to200.root",
+    "GenJet_QCD_HT200to300.root",
+    "GenJet_QCD_HT300to500.root",
+    "GenJet_QCD_HT500to700.root",
+    "GenJet_QCD_HT700to1000.root",
+    "GenJet_QCD_HT1000to1500.root",
+    "GenJet_QCD_HT1500to2000.root",
+    "GenJet_QCD_HT2000toInf.root"
+]
+
+# unit fb-1
+crossSectionArray = {
+    "GenJet_QCD_HT50to100.root" : 187700000.0,  # +-1639000
+    "GenJet_QCD_HT100to200.root" : 23500000.0,  # +-207400
+    "GenJet_QCD_HT200to300.root" : 1552000.0,  # +-14450.0
+    "GenJet_QCD_HT300to500.root" : 321100.0,  # +-2968.0
+    "GenJet_QCD_HT500to700.root" : 30250.0,  # +-284.0
+    "GenJet_QCD_HT700to1000.root" : 6398.0,  # +-59.32
+    "GenJet_QCD_HT1000to1500.root" : 1122.0,  # +- 10.41
+    "GenJet_QCD_HT1500to2000.root" : 109.4,  # +-1.006
+    "GenJet_QCD_HT2000toInf.root" : 21.74, # +-0.2019
+}
+
+
+def ProcessName(sample):
+    '''"GenJet_QCD_HT50to100.root" -> "QCD_HT50to100", the PROCESS_NAME genJet.py was run with.'''
+    return sample[len('GenJet_'):-len('.root')]
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# Run an analysis (by default muonInvMass.py's) on one large input split into entry ranges, one process per chunk.
+#
+# Threads (see threads.py) share one python interpreter and one ROOT JIT, so they stop scaling at
+# some point, and their weighted sums change from run to run. Here every chunk of the Events tree
+# gets its own single-threaded process, each running the exact same analysis on its entry range.
+# The per-chunk histograms and cutflows are written to temporary files and then merged in chunk
+# order - this is the deterministic parallel mode: the chunks depend only on the number of entries
+# and --chunks, not on the scheduling.
+#
+# The analysis is a module-level function given as module:function (--analysis), that applies the
+# cuts to an analyzer and returns its booked histograms by name, e.g. muonInvMass:Analysis. The
+# cutflow of the chain it leaves active is booked in the same event loop.
+#
+# The merge does not depend on the order the chunks finish in: every bin content, sumw2 and
+# statistic, and every cutflow sum, is the correctly rounded sum (math.fsum) of the per-chunk
+# values. Counts, cutflow event numbers and unweighted histograms (contents and sumw2) are sums
+# of integers, so they are bit-identical to a sequential run. A weighted sum (sum(genWeight) in
+# the cutflow, weighted histograms) is exact over the chunk sums, but each chunk sum is rounded
+# along the way like the sequential sum is, at different places - so it is reproducible for a
+# given --chunks, and agrees with the sequential value to rounding, not bit for bit.
+# --check runs the sequential analysis as well and compares all of it: cutflow counts and sumw,
+# bin contents and sumw2.
+#
+# Usage: python3 shard.py INPUT OUTPUT.root [-n WORKERS] [--chunks N] [--analysis MODULE:FUNCTION] [--check]
+
+import os
+import sys
+import json
+import math
+import importlib
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+import ROOT
+from caching import InputFiles, WriteJSON
+from cutflow import Cutflow, MergeTables, PrintTable, TableHist
+
+ANALYSIS = 'muonInvMass:Analysis'
+
+
+def CountEntries(fileName, treeName='Events'):
+    '''Number of entries of treeName in fileName (.root or .txt list), read from the file headers.'''
+    chain = ROOT.TChain(treeName)
+    for f in InputFiles(fileName):
+        chain.Add(f)
+    return chain.GetEntries()
+
+
+def Chunks(nEntries, nChunks):
+    '''Split [0, nEntries) into nChunks contiguous (begin, end) ranges of (almost) equal size.'''
+    edges = [nEntries*i//nChunks for i in range(nChunks+1)]
+    return [(edges[i], edges[i+1]) for i in range(nChunks) if edges[i+1] > edges[i]]
+
+
+def Analysis(name):
+    '''The function named module:function.'''
+    module, function = name.split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def RunAnalysis(fileName, entryRange=None, analysis=ANALYSIS):
+    '''Run analysis (module:function) on fileName, optionally only on entries [begin, end).
+    Returns the histograms (detached from any file) and the cutflow table.'''
+    from threads import analyzer
+    # Range() is single threaded only, parallelism comes from the processes
+    ana = analyzer(fileName, nThreads=1, entryRange=entryRange)
+    booked = Analysis(analysis)(ana)
+    cutflow = Cutflow(ana)
+    hists = OrderedDict()
+    for name, h in booked.items():
+        hists[name] = h.GetValue().Clone(name)
+        hists[name].SetDirectory(0)
+    return hists, cutflow.Table()
+
+
+def RunShard(job):
+    fileName, entryRange, outDir, index, analysis = job
+    hists, table = RunAnalysis(fileName, entryRange, analysis)
+    path = os.path.join(outDir, f'shard{index}.root')
+    f = ROOT.TFile.Open(path, 'RECREATE')
+    for h in hists.values():
+        h.Write()
+    f.Close()
+    WriteJSON(os.path.join(outDir, f'shard{index}.json'), {'range': entryRange, 'hists': list(hists), 'cutflow': table})
+    return index
+
+
+def _NBins(h):
+    return (h.GetNbinsX()+2)*(h.GetNbinsY()+2)*(h.GetNbinsZ()+2)
+
+
+def MergeHists(hists, name):
+    '''Sum of histograms with the same binning, as a new histogram called name. Every bin content, sumw2
+    and statistic is the math.fsum of the inputs, so the result does not depend on their order.'''
+    out = hists[0].Clone(name)
+    out.SetDirectory(0)
+    weighted = any(h.GetSumw2N() for h in hists)
+    if weighted and not out.GetSumw2N():
+        out.Sumw2()
+    for b in range(_NBins(out)):
+        out.SetBinContent(b, math.fsum(h.GetBinContent(b) for h in hists))
+        if weighted:
+            out.GetSumw2()[b] = math.fsum(h.GetBinError(b)**2 if not h.GetSumw2N() else h.GetSumw2()[b] for h in hists)
+    # sumw, sumw2, sumwx, sumwx2, ... for the mean and RMS
+    stats = []
+    for h in hists:
+        s = ROOT.std.vector('double')(13)
+        h.GetStats(s.data())
+        stats.append(list(s))
+    merged = ROOT.std.vector('double')([math.fsum(column) for column in zip(*stats)])
+    out.PutStats(merged.data())
+    out.SetEntries(math.fsum(h.GetEntries() for h in hists))
+    return out
+
+
+def Merge(outDir, indices):
+    '''Add up the shard outputs (see MergeHists() and cutflow.MergeTables()).'''
+    parts, tables, files = OrderedDict(), [], []
+    for i in sorted(indices):
+        with open(os.path.join(outDir, f'shard{i}.json')) as f:
+            meta = json.load(f)
+        tables.append(meta['cutflow'])
+        files.append(ROOT.TFile.Open(os.path.join(outDir, f'shard{i}.root')))
+        for name in meta['hists']:
+            parts.setdefault(name, []).append(files[-1].Get(name))
+    hists = OrderedDict((name, MergeHists(hs, name)) for name, hs in parts.items())
+    for f in files:
+        f.Close()
+    return hists, MergeTables(tables)
+
+
+def Compare(hists, reference):
+    '''Largest absolute difference of any bin content or sumw2 between two sets of histograms.'''
+    worst = 0.
+    for name, h in hists.items():
+        ref = reference[name]
+        for b in range(_NBins(h)):
+            worst = max(worst, abs(h.GetBinContent(b) - ref.GetBinContent(b)),
+                        abs(h.GetBinError(b)**2 - ref.GetBinError(b)**2))
+    return worst
+
+
+def CompareTables(table, reference):
+    '''Whether the cutflow counts are identical, and the largest relative difference of the sums of weights.'''
+    countsMatch = [r['count'] for r in table['rows']] == [r['count'] for r in reference['rows']]
+    worst = 0.
+    for r, ref in zip(table['rows'], reference['rows']):
+        if r['sumw'] is not None and r['sumw'] != ref['sumw']:
+            worst = max(worst, abs(r['sumw'] - ref['sumw']) / abs(ref['sumw']) if ref['sumw'] else float('inf'))
+    return countsMatch, worst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an analysis on entry ranges of INPUT in parallel processes and merge the results.')
+    parser.add_argument('input', help='ROOT file or .txt list of ROOT files')
+    parser.add_argument('output', help='ROOT file for the merged histograms and cutflow')
+    parser.add_argument('-n', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--chunks', type=int, default=None, help='number of entry ranges (default: one per worker)')
+    parser.add_argument('--analysis', default=ANALYSIS, help=f'module:function applying the cuts and returning the booked histograms (default: {ANALYSIS})')
+    parser.add_argument('--check', action='store_true', help='also run sequentially and compare')
+    parser.add_argument('--tolerance', type=float, default=1e-12, help='largest relative difference of a sum of weights accepted by --check')
+    args = parser.parse_args()
+
+    nEntries = CountEntries(args.input)
+    chunks = Chunks(nEntries, args.chunks or args.workers)
+    print(f'{nEntries} entries in {len(chunks)} chunks on {args.workers} workers')
+
+    outDir = tempfile.mkdtemp(prefix='shards.', dir=os.path.dirname(os.path.abspath(args.output)))
+    try:
+        jobs = [(args.input, chunk, outDir, i, args.analysis) for i, chunk in enumerate(chunks)]
+        # fresh interpreters rather than forks of this one, which already has ROOT loaded
+        with multiprocessing.get_context('spawn').Pool(args.workers) as pool:
+            done = pool.map(RunShard, jobs, chunksize=1)
+        hists, table = Merge(outDir, done)
+    finally:
+        shutil.rmtree(outDir, ignore_errors=True)
+
+    out = ROOT.TFile.Open(args.output, 'RECREATE')
+    for h in hists.values():
+        h.Write()
+    TableHist(table, 'cutflow').Write()
+    if table['weight']:
+        TableHist(table, 'cutflow_weighted', weighted=True).Write()
+    out.Close()
+    WriteJSON(os.path.splitext(args.output)[0] + '_cutflow.json', table)
+    PrintTable(table)
+
+    if args.check:
+        refHists, refTable = RunAnalysis(args.input, analysis=args.analysis)
+        countsMatch, worstSumw = CompareTables(table, refTable)
+        worst = Compare(hists, refHists)
+        print(f'sequential check: cutflow counts {"identical" if countsMatch else "DIFFER"}, '
+              f'largest relative cutflow sumw difference {worstSumw}, largest bin content or sumw2 difference {worst}')
+        # the histograms of the analysis are unweighted, so they have to be identical
+        if not countsMatch or worst != 0. or worstSumw > args.tolerance:
+            sys.exit(1)
@@ -0,0 +1,113 @@
+# Cache of preselected ("skimmed") events, keyed on the input files and the Cut/Define chain.
+#
+# Most runs of an analysis start by re-reading the full input only to apply the same
+# preselection again. SkimCache() applies the preselection once, snapshots the surviving
+# events (only the columns you ask for) into a file in the cache directory, and returns an
+# analyzer on that file. Later runs with the same inputs and the same preselection find the
+# skim and start from it directly, reading a small fraction of the data.
+#
+# The key is made of the checksums of the input files, the name and action of every node of
+# the preselection chain, the column list and the tree name. Changing any cut string, or
+# replacing an input file, makes a new skim.
+#
+# The cutflow of the preselection is saved next to the skim, so it is still available on a
+# cache hit (as ana.skimCutflow, see cutflow.ChainTables to combine it with later cuts).
+#
+# With IMT (nThreads > 1, see threads.py) the Snapshot is written by several threads, so the
+# events in the skim are not in the order of the input, and the order changes from one skim to
+# the next. Anything that depends on the entry order (Range(), the first N events) differs
+# between a skimmed and an unskimmed run, and weighted sums over the skim are added in a
+# different order.
+#
+# Usage:
+#     ana = analyzer('big.root')
+#     ana = SkimCache(ana, Preselection, ['nMuon', 'Muon_*', 'genWeight'])
+#     ...continue with ana as usual...
+import os
+import json
+import fnmatch
+import tempfile
+import ROOT
+from caching import CacheDir, FileLock, FileChecksum, HashStrings, InputFiles, WriteJSON
+from cutflow import Cutflow
+from nodetools import NodeChain
+
+
+def ChainKey(node):
+    '''Hash of the names and actions of every node from the base node to node.'''
+    return HashStrings(*[f'{n.name}:{getattr(n, "action", "")}' for n in NodeChain(node)])
+
+
+def ExpandColumns(node, patterns):
+    '''Column names of node matching any of patterns (shell-style wildcards, e.g. Muon_*).'''
+    available = [str(c) for c in node.DataFrame.GetColumnNames()]
+    columns = []
+    for pattern in patterns:
+        for c in fnmatch.filter(available, pattern):
+            if c not in columns:
+                columns.append(c)
+    return columns
+
+
+def SkimCache(ana, preselection, columns, treeName='Events'):
+    '''Return an analyzer on the events of ana passing preselection(ana), reusing a cached skim if possible.
+
+    Args:
+        ana: TIMBER analyzer on the full input (nothing applied yet).
+        preselection: Function applying the preselection Cuts/Defines to an analyzer.
+        columns (list): Columns to keep; shell-style wildcards are allowed. Missing names are ignored.
+        treeName (str): Name of the tree in the skim file.
+
+    Returns:
+        A new analyzer (with the same number of threads, and profiling if ana profiles) on the skim, with the preselection
+        cutflow table in its skimCutflow attribute.
+    '''
+    preselection(ana)
+    node = ana.GetActiveNode()
+    columns = ExpandColumns(node, columns)
+    key = HashStrings(*[f'{f}:{FileChecksum(f)}' for f in InputFiles(ana.fileName)],
+                      ChainKey(node), *columns, treeName)
+    skims = CacheDir('skims')
+    skimFile = os.path.join(skims, key + '.root')
+    metaFile = os.path.join(skims, key + '.json')
+
+    with FileLock(os.path.join(skims, key + '.lock')):
+        if os.path.exists(skimFile) and os.path.exists(metaFile):
+            print(f'SkimCache -- starting from cached skim {skimFile}')
+        else:
+            print(f'SkimCache -- writing skim {skimFile}')
+            _WriteSkim(ana, node, columns, treeName, skimFile, metaFile)
+
+    with open(metaFile) as f:
+        table = json.load(f)['cutflow']
+    skimmed = type(ana)(skimFile, **_AnalyzerArgs(ana, treeName))
+    skimmed.skimCutflow = table
+    return skimmed
+
+
+def _AnalyzerArgs(ana, treeName):
+    args = {'eventsTreeName': treeName}
+    if hasattr(ana, 'nThreads'):
+        args['nThreads'] = ana.nThreads
+    if getattr(ana, 'profile', False):
+        args['profile'] = True
+    if getattr(ana, 'prune', False):
+        args['prune'] = True
+    return args
+
+
+def _WriteSkim(ana, node, columns, treeName, skimFile, metaFile):
+    cutflow = Cutflow(ana, node=node)
+    fd, tmp = tempfile.mkstemp(suffix='.root', dir=os.path.dirname(skimFile))
+    os.close(fd)
+    # the cutflow is filled in the same event loop as the snapshot. Under IMT the entries are written in thread order (see above)
+    node.DataFrame.Snapshot(treeName, tmp, ROOT.std.vector('string')(columns))
+    # keep the Runs tree, TIMBER reads the generator information from it
+    runs = getattr(ana, 'RunChain', None)
+    if runs is not None and runs.GetNtrees() > 0:
+        f = ROOT.TFile.Open(tmp, 'UPDATE')
+        f.cd()
+        runs.CloneTree(-1, 'fast').Write()
+        f.Close()
+    os.replace(tmp, skimFile)
+    WriteJSON(metaFile, {'inputs': InputFiles(ana.fileName), 'columns': columns, 'cutflow': cutflow.Table()})
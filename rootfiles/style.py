@@ -0,0 +1,47 @@
+# Plot style shared by draw_HT.py and plots.py: the line colors for overlaid samples and the
+# gStyle settings. ApplyStyle() also puts ROOT in batch mode, so nothing tries to open a window.
+import ROOT
+
+# colors
+color_comp1=634    # kRed+2
+color_comp2=862    # kAzure+2
+color_comp3=797    # kOrange-3
+color_comp4=882    # kViolet+2
+color_comp5=419    # kGreen+3
+color_comp6=603    # kBlue+3
+color_comp7=802    # kOrange+2
+color_comp8=616    # kMagenta
+color_comp9=600    # kBlue
+color_comp10=434   # kCyan+2
+color_comp11=800   # kOrange
+color_comp12=417   # kGreen+1
+color_comp13=632   # kRed
+
+colors = {}
+colors['color_comp1'] = color_comp1
+colors['color_comp2'] = color_comp2
+colors['color_comp3'] = color_comp3
+colors['color_comp4'] = color_comp4
+colors['color_comp5'] = color_comp5
+colors['color_comp6'] = color_comp6
+colors['color_comp7'] = color_comp7
+colors['color_comp8'] = color_comp8
+colors['color_comp9'] = color_comp9
+colors['color_comp10'] = color_comp10
+colors['color_comp11'] = color_comp11
+colors['color_comp12'] = color_comp12
+colors['color_comp13'] = color_comp13
+
+
+def Color(i):
+    '''Color of the i-th (from 0) overlaid histogram. Starts over after the last one.'''
+    return colors['color_comp{}'.format(i % len(colors) + 1)]
+
+
+def ApplyStyle():
+    '''Batch mode and the shared gStyle settings.'''
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gStyle.SetPadRightMargin(.15)
+    ROOT.gStyle.SetPadTopMargin(0.1)
+    ROOT.gStyle.SetPadBottomMargin(0.14)
+    ROOT.gStyle.SetPadLeftMargin(0.15)
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# Synthetic NanoAOD-like files for benchmarks and offline tests.
+#
+# The example scripts read real samples under /home/physicist/rootfiles/ that are not always at
+# hand. Generate() writes an Events tree with the branches they use, with the NanoAOD types:
+#   nFatJet, FatJet_pt/eta/phi/mass/msoftdrop           (timber.py)
+#   nMuon, Muon_pt/eta/phi/mass/charge/highPurity/isGlobal/miniIsoId   (muonInvMass.py)
+#   nGenJet, GenJet_pt/eta/phi/mass                      (genJet.py)
+#   genWeight
+# plus a Runs tree with genEventCount/genEventSumw/genEventSumw2.
+#
+# Multiplicities are Poisson distributed with configurable means, momenta fall exponentially,
+# fat jet soft drop masses are a mixture of a top peak, a 125 GeV peak and a falling
+# background, and a fraction of the events get a Z -> mu mu pair (Breit-Wigner mass, isotropic
+# decay) so muonInvMass.py has a peak to fit. The physics is only roughly realistic; what
+# matters is that the scripts find events in every category and that the output is
+# reproducible: every event is generated from its own random stream seeded with (seed, entry),
+# so a file depends only on the options (with -j 1 also the entry order is fixed).
+#
+# Usage: python3 synth.py OUTPUT.root [-n EVENTS] [--fatjets MEAN] [--muons MEAN] [--genjets MEAN]
+#                         [--zfraction F] [--seed S] [-j THREADS]
+import os
+import argparse
+from array import array
+import ROOT
+
+_generator = '''
+#include <cmath>
+#include <cstdint>
+#include "ROOT/RVec.hxx"
+#include "TLorentzVector.h"
+namespace synth {
+    using ROOT::VecOps::RVec;
+    // splitmix64: small, fast and good enough, and cheap to seed for every event
+    struct Random {
+        uint64_t state;
+        Random(uint64_t seed, uint64_t entry) : state(seed * 0x9E3779B97F4A7C15ULL + entry) { Next(); }
+        uint64_t Next() {
+            uint64_t z = (state += 0x9E3779B97F4A7C15ULL);
+            z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+            z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+            return z ^ (z >> 31);
+        }
+        double Uniform(double lo = 0., double hi = 1.) { return lo + (hi - lo) * ((Next() >> 11) * 0x1.0p-53); }
+        double Exp(double mean) { return -mean * std::log(1. - Uniform()); }
+        double Gaus(double mu, double sigma) {
+            double u1 = 1. - Uniform(), u2 = Uniform();
+            return mu + sigma * std::sqrt(-2. * std::log(u1)) * std::cos(2. * M_PI * u2);
+        }
+        int Poisson(double mean) {
+            double limit = std::exp(-mean), p = Uniform();
+            int n = 0;
+            while (p > limit) { p *= Uniform(); n++; }
+            return n;
+        }
+    };
+
+    struct Event {
+        RVec<float> FatJet_pt, FatJet_eta, FatJet_phi, FatJet_mass, FatJet_msoftdrop;
+        RVec<float> Muon_pt, Muon_eta, Muon_phi, Muon_mass;
+        RVec<int> Muon_charge;
+        RVec<bool> Muon_highPurity, Muon_isGlobal;
+        RVec<unsigned char> Muon_miniIsoId;
+        RVec<float> GenJet_pt, GenJet_eta, GenJet_phi, GenJet_mass;
+        float genWeight;
+    };
+
+    // order the objects of a collection by decreasing pt, like NanoAOD
+    template <typename T> RVec<T> Sorted(const RVec<T>& v, const RVec<std::size_t>& order) { return ROOT::VecOps::Take(v, order); }
+
+    Event Generate(uint64_t entry, uint64_t seed, double nFatJet, double nMuon, double nGenJet, double zFraction) {
+        Random r(seed, entry);
+        Event e;
+        for (int i = 0, n = r.Poisson(nFatJet); i < n; i++) {
+            float pt = 200. + r.Exp(250.);
+            double u = r.Uniform();
+            float msd = u < 0.3 ? r.Gaus(172.5, 15.) : u < 0.6 ? r.Gaus(125., 12.) : r.Exp(60.);
+            msd = std::max(msd, 0.f);
+            e.FatJet_pt.push_back(pt);
+            e.FatJet_eta.push_back(r.Gaus(0., 1.5));
+            e.FatJet_phi.push_back(r.Uniform(-M_PI, M_PI));
+            e.FatJet_msoftdrop.push_back(msd);
+            e.FatJet_mass.push_back(msd * r.Uniform(1., 1.2));
+        }
+        auto order = ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(e.FatJet_pt));
+        e.FatJet_pt = Sorted(e.FatJet_pt, order); e.FatJet_eta = Sorted(e.FatJet_eta, order);
+        e.FatJet_phi = Sorted(e.FatJet_phi, order); e.FatJet_mass = Sorted(e.FatJet_mass, order);
+        e.FatJet_msoftdrop = Sorted(e.FatJet_msoftdrop, order);
+
+        auto addMuon = [&](float pt, float eta, float phi, int charge) {
+            e.Muon_pt.push_back(pt); e.Muon_eta.push_back(eta); e.Muon_phi.push_back(phi);
+            e.Muon_mass.push_back(0.10566); e.Muon_charge.push_back(charge);
+            e.Muon_highPurity.push_back(r.Uniform() < 0.95); e.Muon_isGlobal.push_back(r.Uniform() < 0.9);
+            e.Muon_miniIsoId.push_back(1 + (unsigned char)(r.Uniform() * 4));
+        };
+        if (r.Uniform() < zFraction) {
+            // Z -> mu mu: Breit-Wigner mass, decayed isotropically in the Z rest frame
+            double m = 91.1876 + 0.5 * 2.4952 * std::tan(M_PI * (r.Uniform() - 0.5));
+            m = std::min(std::max(m, 40.), 200.);
+            TLorentzVector z;
+            z.SetPtEtaPhiM(r.Exp(15.), r.Uniform(-2.5, 2.5), r.Uniform(-M_PI, M_PI), m);
+            double cosTheta = r.Uniform(-1., 1.), phi = r.Uniform(-M_PI, M_PI), p = m / 2.;
+            TLorentzVector mu1(p * std::sqrt(1. - cosTheta * cosTheta) * std::cos(phi),
+                               p * std::sqrt(1. - cosTheta * cosTheta) * std::sin(phi), p * cosTheta, p);
+            TLorentzVector mu2(-mu1.Px(), -mu1.Py(), -mu1.Pz(), p);
+            mu1.Boost(z.BoostVector()); mu2.Boost(z.BoostVector());
+            int charge = r.Uniform() < 0.5 ? 1 : -1;
+            addMuon(mu1.Pt(), mu1.Eta(), mu1.Phi(), charge);
+            addMuon(mu2.Pt(), mu2.Eta(), mu2.Phi(), -charge);
+        }
+        for (int i = 0, n = r.Poisson(nMuon); i < n; i++) {
+            addMuon(3. + r.Exp(12.), r.Uniform(-2.4, 2.4), r.Uniform(-M_PI, M_PI), r.Uniform() < 0.5 ? 1 : -1);
+        }
+        order = ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(e.Muon_pt));
+        e.Muon_pt = Sorted(e.Muon_pt, order); e.Muon_eta = Sorted(e.Muon_eta, order);
+        e.Muon_phi = Sorted(e.Muon_phi, order); e.Muon_mass = Sorted(e.Muon_mass, order);
+        e.Muon_charge = Sorted(e.Muon_charge, order); e.Muon_highPurity = Sorted(e.Muon_highPurity, order);
+        e.Muon_isGlobal = Sorted(e.Muon_isGlobal, order); e.Muon_miniIsoId = Sorted(e.Muon_miniIsoId, order);
+
+        for (int i = 0, n = r.Poisson(nGenJet); i < n; i++) {
+            float pt = 15. + r.Exp(40.);
+            e.GenJet_pt.push_back(pt);
+            e.GenJet_eta.push_back(r.Uniform(-5., 5.));
+            e.GenJet_phi.push_back(r.Uniform(-M_PI, M_PI));
+            e.GenJet_mass.push_back(pt * r.Uniform(0.02, 0.2));
+        }
+        order = ROOT::VecOps::Reverse(ROOT::VecOps::Argsort(e.GenJet_pt));
+        e.GenJet_pt = Sorted(e.GenJet_pt, order); e.GenJet_eta = Sorted(e.GenJet_eta, order);
+        e.GenJet_phi = Sorted(e.GenJet_phi, order); e.GenJet_mass = Sorted(e.GenJet_mass, order);
+
+        // mostly positive weights of similar size, a few negative ones like NLO samples
+        e.genWeight = (r.Uniform() < 0.05 ? -1.f : 1.f) * r.Uniform(0.9, 1.1);
+        return e;
+    }
+}
+'''
+
+# branches of every collection, besides its n<collection> counter
+BRANCHES = {
+    'FatJet': ['pt', 'eta', 'phi', 'mass', 'msoftdrop'],
+    'Muon': ['pt', 'eta', 'phi', 'mass', 'charge', 'highPurity', 'isGlobal', 'miniIsoId'],
+    'GenJet': ['pt', 'eta', 'phi', 'mass'],
+}
+
+
+def Generate(output, nEvents, nFatJet=3., nMuon=1., nGenJet=8., zFraction=0.3, seed=1, nThreads=1):
+    '''Write nEvents synthetic events to output (Events and Runs trees). Returns output.
+
+    Args:
+        output (str): ROOT file to write.
+        nEvents (int): Number of events.
+        nFatJet, nMuon, nGenJet (float): Mean multiplicities. Z -> mu mu muons come on top of nMuon.
+        zFraction (float): Fraction of the events with a Z -> mu mu pair.
+        seed (int): Seed of the random streams.
+        nThreads (int): Threads for the generation (see threads.EnableThreads). With more than
+            one the events are the same, but the order of the entries in the file is not.
+    '''
+    from threads import EnableThreads
+    EnableThreads(nThreads)
+    if not hasattr(ROOT, 'synth'):
+        ROOT.gInterpreter.Declare(_generator)
+    df = ROOT.RDataFrame(nEvents).Define('_event', f'synth::Generate(rdfentry_, {int(seed)}, {float(nFatJet)}, {float(nMuon)}, {float(nGenJet)}, {float(zFraction)})')
+    columns = []
+    for coll, branches in BRANCHES.items():
+        df = df.Define(f'n{coll}', f'(unsigned int)_event.{coll}_pt.size()')
+        columns.append(f'n{coll}')
+        for b in branches:
+            df = df.Define(f'{coll}_{b}', f'_event.{coll}_{b}')
+            columns.append(f'{coll}_{b}')
+    df = df.Define('genWeight', '_event.genWeight')
+    columns.append('genWeight')
+
+    # the weight sums for the Runs tree are filled in the same loop as the snapshot
+    options = ROOT.RDF.RSnapshotOptions()
+    options.fLazy = True
+    tmp = f'{output}.{os.getpid()}.tmp'
+    snapshot = df.Snapshot('Events', tmp, ROOT.std.vector('string')(columns), options)
+    sumw = df.Sum('genWeight')
+    sumw2 = df.Define('_w2', 'double(genWeight)*genWeight').Sum('_w2')
+    snapshot.GetValue()
+
+    f = ROOT.TFile.Open(tmp, 'UPDATE')
+    runs = ROOT.TTree('Runs', 'Runs')
+    run, count = array('I', [1]), array('q', [nEvents])
+    sums = array('d', [sumw.GetValue()]), array('d', [sumw2.GetValue()])
+    runs.Branch('run', run, 'run/i')
+    runs.Branch('genEventCount', count, 'genEventCount/L')
+    runs.Branch('genEventSumw', sums[0], 'genEventSumw/D')
+    runs.Branch('genEventSumw2', sums[1], 'genEventSumw2/D')
+    runs.Fill()
+    runs.Write()
+    f.Close()
+    os.replace(tmp, output)
+    return output
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic NanoAOD-like file for timber.py, muonInvMass.py and genJet.py.')
+    parser.add_argument('output', help='ROOT file to write')
+    parser.add_argument('-n', '--events', type=int, default=100000, help='number of events')
+    parser.add_argument('--fatjets', type=float, default=3., help='mean number of fat jets per event')
+    parser.add_argument('--muons', type=float, default=1., help='mean number of (non-Z) muons per event')
+    parser.add_argument('--genjets', type=float, default=8., help='mean number of generator jets per event')
+    parser.add_argument('--zfraction', type=float, default=0.3, help='fraction of events with a Z -> mu mu pair')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('-j', '--threads', type=int, default=1, help='threads (the entry order is only reproducible with 1)')
+    args = parser.parse_args()
+
+    Generate(args.output, args.events, args.fatjets, args.muons, args.genjets, args.zfraction, args.seed, args.threads)
+    print(f'{args.events} events written to {args.output}')
@@ -0,0 +1,66 @@
+# Multithreaded event loops for the TIMBER analyzer.
+#
+# RDataFrame can process the input in parallel ("implicit multithreading", IMT), but only if
+# ROOT.EnableImplicitMT() is called *before* the RDataFrame is created - i.e. before the
+# analyzer is constructed. The analyzer below is TIMBER's analyzer with an extra nThreads
+# argument that takes care of that, so a script only has to change its import:
+#     from threads import analyzer
+#     ana = analyzer('file.root', nThreads=8)
+#
+# The thread count can also come from the command line (-j N / --threads N, see ParseThreads)
+# or from the TIMBER_NTHREADS environment variable. 0 means "all cores", 1 is the usual
+# sequential mode and the default.
+#
+# Reproducibility: with IMT each thread slot fills its own copy of every histogram/sum, and the
+# copies are added up at the end of the loop. Which entries end up in which slot depends on the
+# scheduling, so it changes from run to run:
+#   - counts, and the contents and sumw2 of unweighted histograms, are sums of small integers,
+#     exact in any order, so they are the same as in a sequential run;
+#   - weighted sums (e.g. genWeight) are NOT reproducible: they add the same numbers in a
+#     different order every run. With weights of both signs the sum can cancel, and then the
+#     relative difference has no useful bound.
+# For reproducible results on many cores use the deterministic mode of shard.py instead: fixed
+# entry ranges, one single-threaded process each, merged in range order.
+# Note that Range() is not available with IMT.
+import os
+import ROOT
+from TIMBER.Analyzer import analyzer as _analyzer, Node
+
+
+def ParseThreads(argv):
+    '''Remove -j N / --threads N from argv (in place) and return N, or None if not given.'''
+    for flag in ('-j', '--threads'):
+        if flag in argv:
+            i = argv.index(flag)
+            n = int(argv[i+1])
+            del argv[i:i+2]
+            return n
+    return None
+
+
+def EnableThreads(nThreads=None):
+    '''Turn IMT on with nThreads threads (0 = all cores) or off for nThreads = 1.
+    None reads TIMBER_NTHREADS (default 1). Returns the number of threads in use.
+    With more than one thread, weighted sums are not reproducible (see above).'''
+    if nThreads is None:
+        nThreads = int(os.environ.get('TIMBER_NTHREADS', 1))
+    if nThreads == 1:
+        ROOT.DisableImplicitMT()
+        return 1
+    ROOT.EnableImplicitMT(nThreads)
+    return ROOT.GetImplicitMTPoolSize()
+
+
+class analyzer(_analyzer):
+    '''TIMBER analyzer that runs its event loops on nThreads threads (see EnableThreads).
+    With entryRange=(begin, end) only those entries are processed, which needs nThreads=1.'''
+    def __init__(self, fileName, nThreads=None, entryRange=None, **kwargs):
+        self.nThreads = EnableThreads(nThreads)
+        super(analyzer, self).__init__(fileName, **kwargs)
+        if entryRange is not None:
+            if self.nThreads != 1:
+                raise ValueError('analyzer -- entryRange needs nThreads=1, Range() is not available with IMT')
+            # a new base node on a fresh RDataFrame of the events chain, before anything is built on the old one
+            self.BaseNode = Node('base', ROOT.RDataFrame(self._eventsChain).Range(*entryRange))
+            self.AllNodes = [self.BaseNode]
+            self.ActiveNode = self.BaseNode
@@ -1,32 +1,53 @@
-# Start by importing the main TIMBER class, the analyzer
-from TIMBER.Analyzer import analyzer
-# next, import some of TIMBER's useful tools
+# Start by importing some of TIMBER's useful tools
 from TIMBER.Tools.Common import *
+# next, the main TIMBER class, the analyzer. pruning.analyzer is TIMBER's analyzer
+# plus an nThreads argument to run the event loop on several cores (see threads.py),
+# a profile argument to time every Cut and Define (see profiling.py)
+# and a prune argument to define only the ObjectFromCollection() columns that are used (see pruning.py)
+from threads import ParseThreads
+from pruning import analyzer
 # and pyROOT
 import ROOT
+import os
+import sys
+from collections import OrderedDict
+# CompileCpp() with an on-disk cache of the compiled library, see modcache.py
+from modcache import CompileCppCached
+# single-pass cutflow, see cutflow.py
+from cutflow import Cutflow, ChainTables, PrintTable
+# cache of preselected events, see skimcache.py
+from skimcache import SkimCache
+# results of identical earlier runs, see histcache.py
+from histcache import HistCache
+# cuts applied cheapest first, see cutorder.py
+from cutorder import ApplyCuts
+from TIMBER.Analyzer import CutGroup
+# selected events in chunks, for NumPy/Parquet/Feather, see export.py
+from export import Export
 
-if __name__ == '__main__':
-    # instantiate the analyzer module. This class takes in either a ROOT file or a .txt list of ROOT files, all with the same trees (ideally)
-    ana = analyzer('/home/physicist/rootfiles/TprimeB-1800-125.root')
-#    ana = analyzer('/home/physicist/rootfiles/nanoaod.root')
-    
-    if "genWeight" in ana.DataFrame.GetColumnNames() :
-      print("This is MC")
-    print('genWeight',ana.DataFrame.Sum("genWeight").GetValue())
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Modules.cc')
+# columns written with --export, e.g. as training input
+EXPORT_COLUMNS = ['Top_pt', 'Top_eta', 'Top_phi', 'Top_msoftdrop', 'Phi_pt', 'Phi_eta', 'Phi_phi', 'Phi_msoftdrop', 'mtphi']
 
-    # We are looking at a Monte Carlo signal sample of a T' decaying to a top quark and a new scalar phi. 
-    # Let's use TIMBER to define the top and phi, then use their invariant mass to reconstruct the T'
-    ana.Cut('nJets', 'nFatJet > 2')     # keep all events with at least 2 jets
-    ana.Cut('pT_cut', 'FatJet_pt[0] > 400 && FatJet_pt[1] > 400')   # T' is heavy, so decay products will have high transverse momentum
-    ana.Cut('eta_cut', 'abs(FatJet_eta[0]) < 2.4 && abs(FatJet_eta[1]) < 2.4') # drop jets in high pseudorapidity region (poor reconstruction)
-    ana.Cut('msd_cut', 'FatJet_msoftdrop[0] > 50 && FatJet_msoftdrop[1] > 50')  # drop jets with masses lower than 50 GeV
 
-    print('kinCuts: ',ana.DataFrame.Sum("genWeight").GetValue())
+def KinematicCuts(ana, optimize=False, declaredCounts=False):
+    '''Basic kinematic preselection of the two leading fat jets. With optimize=True the cuts after nJets are
+    applied cheapest first, with declaredCounts also counted in the written order (see cutorder.py).
+    Returns their cutorder.CutOrder.'''
+    ana.Cut('nJets', 'nFatJet > 2')     # keep all events with at least 2 jets. The cuts below read FatJet_*[1], so this one comes first
+    kinematics = CutGroup('jetKinematics')
+    kinematics.Add('pT_cut', 'FatJet_pt[0] > 400 && FatJet_pt[1] > 400')   # T' is heavy, so decay products will have high transverse momentum
+    kinematics.Add('eta_cut', 'abs(FatJet_eta[0]) < 2.4 && abs(FatJet_eta[1]) < 2.4') # drop jets in high pseudorapidity region (poor reconstruction)
+    kinematics.Add('msd_cut', 'FatJet_msoftdrop[0] > 50 && FatJet_msoftdrop[1] > 50')  # drop jets with masses lower than 50 GeV
+    return ApplyCuts(ana, kinematics, optimize, declaredCounts=declaredCounts)
+
 
+def TopPhiCandidates(ana):
+    '''Pick two back-to-back jets, call them the top and the phi and define their invariant mass, mtphi.'''
     # Now that we've made some basic kinematic cuts, let's be a bit more specific. 
     # We'll call some custom C++ code to pick out the dijets.
-    # We can compile it using TIMBER via CompileCpp, imported from TIMBER.Tools.Common above
-    CompileCpp('/home/physicist/rootfiles/Modules.cc')
+    # We can compile it via CompileCppCached, a version of TIMBER's CompileCpp that keeps the compiled library between runs (modcache.py)
+    CompileCppCached(MODULES)
     # Now we define a vector of integers for each of the events describing which (if any) of the jets in that event
     # are separated by at least 90 degrees. See the Modules.cc code for more detail. The important thing to understand
     # is that this custom function gets run on EVERY row (event), and the input to the function is that row's (event's)
@@ -35,17 +56,77 @@ if __name__ == '__main__':
     # Having defined this new variable, we make a cut on it, removing all rows (events) not meeting the criteria
     # PickDijets() returns {-1, -1} if there are no back-to-back jets in the event
     ana.Cut('dijetsExist', 'DijetIdxs[0] > -1 && DijetIdxs[1] > -1')
-
     # Naively, let's assume that the top is the 0th index and the phi the 1st. The vectors are ordered by pt, so this is a 
     # possible, albeit inefficient, proxy for the top and phi identification
     # The ObjectFromCollection function takes a vector of vectors (FatJet_*) and makes a single vector based on the indices we defined prior (DijetIdxs)
+    # With prune=True (see pruning.py) only the Top_*/Phi_* columns used below (pt, eta, phi, msoftdrop) are actually defined
     ana.ObjectFromCollection('Top','FatJet','DijetIdxs[0]')
     ana.ObjectFromCollection('Phi','FatJet','DijetIdxs[1]')
-    # At this point, we'll have a column corresponding to the Top and the Phi (defined naively based on pT). We can create TLorentz vectors from their pT, eta, phi and sotdrop masses
-    ana.Define('Top_vect','hardware::TLvector(Top_pt, Top_eta, Top_phi, Top_msoftdrop)')
-    ana.Define('Phi_vect','hardware::TLvector(Phi_pt, Phi_eta, Phi_phi, Phi_msoftdrop)')
-    # Finally, we can reconstruct the resonance by getting the invariant mass of the top and phi vectors we just defined
-    ana.Define('mtphi','hardware::InvariantMass({Top_vect, Phi_vect})')
+    # At this point, we'll have a column corresponding to the Top and the Phi (defined naively based on pT).
+    # Finally, we can reconstruct the resonance by getting the invariant mass of the top and phi from their pT, eta, phi and softdrop masses.
+    # We could build four-vectors first (hardware::TLvector) and hand them to hardware::InvariantMass(), but kinematics::InvMass
+    # (Kinematics.h, included by Modules.cc) computes the same mass directly from the numbers, without making any objects
+    ana.Define('mtphi','kinematics::InvMass(Top_pt, Top_eta, Top_phi, Top_msoftdrop, Phi_pt, Phi_eta, Phi_phi, Phi_msoftdrop)')
+
+
+def BookHistos(ana, cache=None):
+    '''Book the histograms of the analysis on the active node, return them by name.
+    With a HistCache they are taken from an identical earlier run if possible.'''
+    # The RDataFrame::Histo2D() constructor takes in the following arguments in pyROOT:
+    # tuple: ("hist name", "hist title;x axis title;y axis title", nBinsX, xMin, xMax, nBinsY, yMin, yMax)
+    # string: Column (variable) to plot on x-axis
+    # string: Column (variable) to plot on y-axis
+    # Note that ROOT can use LaTeX formatting in its strings, but the ROOT latex command invocation is the pound symbol (#) not the backslash (\)
+    # with prune=True an object column booked on ana.DataFrame has to be defined first (see pruning.py);
+    # Phi_msoftdrop already is, for mtphi, but the histogram should not depend on that
+    if cache is None and hasattr(ana, 'Require'):
+        ana.Require('Phi_msoftdrop')
+    booker = ana.DataFrame if cache is None else cache
+    hists = OrderedDict()
+    hists['h1'] = booker.Histo2D(('h1','#phi mass vs resonance mass - naive method;m_{#phi} [GeV];m_{res} [GeV]',40,60,260,22,800,3000),'Phi_msoftdrop','mtphi')
+    return hists
+
+
+if __name__ == '__main__':
+    # number of threads from -j N / --threads N (or $TIMBER_NTHREADS, default 1)
+    nThreads = ParseThreads(sys.argv)
+    useSkim = '--skim' in sys.argv
+    useProfile = '--profile' in sys.argv
+    useCache = '--cache' in sys.argv
+    optimizeCuts = '--optimize-cuts' in sys.argv
+    declaredCutflow = '--declared-cutflow' in sys.argv
+    # --export events.parquet (or .feather) writes EXPORT_COLUMNS of the selected events
+    exportPath = sys.argv[sys.argv.index('--export') + 1] if '--export' in sys.argv else None
+    # instantiate the analyzer module. This class takes in either a ROOT file or a .txt list of ROOT files, all with the same trees (ideally)
+    ana = analyzer('/home/physicist/rootfiles/TprimeB-1800-125.root', nThreads=nThreads, profile=useProfile, prune=True)
+#    ana = analyzer('/home/physicist/rootfiles/nanoaod.root', nThreads=nThreads)
+    
+    if "genWeight" in ana.DataFrame.GetColumnNames() :
+      print("This is MC")
+
+    # We are looking at a Monte Carlo signal sample of a T' decaying to a top quark and a new scalar phi. 
+    # Let's use TIMBER to define the top and phi, then use their invariant mass to reconstruct the T'
+    # With --skim the events passing these cuts are cached on disk (see skimcache.py), and later runs with the
+    # same input and cuts start from the cached events instead of re-reading the full file
+    # With --optimize-cuts the kinematic cuts are measured on a sample of events and applied cheapest first (see cutorder.py).
+    # --declared-cutflow also counts them in the written order, for the cutflow, at the price of evaluating them twice
+    kinematicCuts = {}
+    def Preselection(ana):
+        kinematicCuts['order'] = KinematicCuts(ana, optimizeCuts, declaredCutflow)
+    if useSkim:
+        ana = SkimCache(ana, Preselection, ['nFatJet', 'FatJet_*', 'genWeight'])
+    else:
+        Preselection(ana)
+
+    # Now that we've made some basic kinematic cuts, let's be a bit more specific: TopPhiCandidates() above picks
+    # the dijets with some custom C++ code and reconstructs the T' from them.
+    TopPhiCandidates(ana)
+    # With --cache, the histograms and yields below are read back from an earlier run with the same input, cuts,
+    # definitions and Modules.cc if there is one, and the event loop does not run at all (see histcache.py).
+    # This makes it cheap to rerun the script just to change how the plots look.
+    cache = HistCache(ana, code=[MODULES]) if useCache else None
+    # Book the raw and genWeight-weighted yields after every cut. They are filled in the same event loop as h1 below.
+    cutflow = Cutflow(ana, cache=cache)
 
     # Now, let's plot the results of our naive top/phi identification (based solely on pT of the jets)
     # Create a TCanvas on which to draw our histograms
@@ -63,12 +144,16 @@ if __name__ == '__main__':
     # Note that the first time we access the results of our TIMBER definitions/cuts, we will execute all of the actions booked on the DataFrame. Up until that point,
     # the actions have not been executed. So, once we call Histo2D() below, all of our Define() and Cut() calls will be implemented.
 
-    # The RDataFrame::Histo2D() constructor takes in the following arguments in pyROOT:
-    # tuple: ("hist name", "hist title;x axis title;y axis title", nBinsX, xMin, xMax, nBinsY, yMin, yMax)
-    # string: Column (variable) to plot on x-axis
-    # string: Column (variable) to plot on y-axis
-    # Note that ROOT can use LaTeX formatting in its strings, but the ROOT latex command invocation is the pound symbol (#) not the backslash (\)
-    h1 = ana.DataFrame.Histo2D(('h1','#phi mass vs resonance mass - naive method;m_{#phi} [GeV];m_{res} [GeV]',40,60,260,22,800,3000),'Phi_msoftdrop','mtphi')
+    # See BookHistos() above for the arguments of the RDataFrame::Histo2D() constructor
+    hists = BookHistos(ana, cache)
+    # With --export the selected events are written out in the same event loop as h1 (lazy=True), and then
+    # converted chunk by chunk, so memory use does not grow with the number of events (see export.py).
+    # If --cache finds every histogram, no loop runs for them and the export runs one of its own.
+    export = Export(ana, EXPORT_COLUMNS, lazy=True) if exportPath else None
+    h1 = hists['h1']
+    # Run the event loop. With --profile it is timed per Cut/Define node (see profiling.py)
+    with ana.Profile():
+        h1.GetValue()
     # This is one way of drawing the data
     h1.Draw("COLZ")
     c.Print('/home/physicist/rootfiles/output_timber.pdf')
@@ -79,6 +164,29 @@ if __name__ == '__main__':
     c.Clear()
     # we're done with our multi-hist canvas, so close it out with ']'
     c.Print('/home/physicist/rootfiles/output_timber.pdf]')
+    table = cutflow.Table()
+    if useSkim:
+        # the kinematic cuts were applied when the skim was made, their yields are stored with it
+        table = ChainTables(ana.skimCutflow, table)
+    if optimizeCuts:
+        # the measured order; with --declared-cutflow the cutflow rows in the order they are written in KinematicCuts()
+        kinematicCuts['order'].Print()
+        if declaredCutflow and kinematicCuts['order'].Ready():
+            table = kinematicCuts['order'].DeclaredOrder(table)
+        elif declaredCutflow:
+            print('the cut group went into a cached skim, its cutflow rows are in the executed order')
+    PrintTable(table)
+    if useCache:
+        print(cache.Report())
+    # bytes read from the input against the size of the events tree, and the Top_*/Phi_* columns defined
+    ana.PrintIO()
+    if export:
+        export.Write(exportPath)
+        print(f'{export.Entries()} events written to {exportPath}')
+        export.Close()
+    if useProfile:
+        # per-node times, events in/out and the JIT and I/O times: profile_timber.json, plus profile_timber.folded for flamegraph.pl
+        ana.SaveProfile('/home/physicist/rootfiles/profile_timber')
 
     # The resulting plot should show a very clear peak in the 2D space centered around (125, 1800) - this is the signal from an 1800 GeV T' decaying to the top quark and 125 GeV scalar!!
     # If you look carefully, you'll note the existence of a second, smaller peak located around 170 GeV on the phi mass (x) axis.
@@ -0,0 +1,200 @@
+# Every histogram under many weight (or column) variations, in one event loop.
+#
+# Systematic variations of the event weight - scale, PDF, parton-shower, pileup weights next to
+# genWeight - change what goes into each histogram but not which events are selected. Rerunning
+# the script once per variation repeats the whole event loop for each of them. Variations is a
+# booker like histcache.HistCache: declare the variations once, then book as on the RDataFrame.
+# Every Histo1D/Histo2D/Sum is booked once per variation on the same graph, so all of them are
+# filled in the same event loop:
+#   - weights: {variation: weight expression}. It multiplies the weight given to the booking, if
+#     any; None means no extra weight (e.g. for an unweighted nominal). The first is the nominal.
+#   - columns: {variation: {column: replacement}}, e.g. {'jesUp': {'mtphi': 'mtphi_jesUp'}} for
+#     variations that change a column rather than the weight.
+#
+# A booking returns a Varied result: it behaves like the nominal result (GetValue(), Draw(), ...),
+# and Variation(name) gives the result of any variation. Count() is not varied. CategorySplit
+# (categories.py) takes a Variations as its cache, and its Results(variation) are then available
+# for every variation.
+#
+# Write() puts the histograms of every variation into a TDirectory of that name, together with
+# the sum of that variation's weights as genEventSumw, so rescale.py normalizes every variation to
+# its own sum of weights in the same pass over the file.
+#
+# Usage:
+#     variations = Variations(ana, {'nominal': 'genWeight', 'muRUp': 'genWeight*LHEScaleWeight[7]'})
+#     sumw = variations.SumWeights()           # on the base node, before any Cut
+#     h = variations.Histo1D(('ht', ';HT', 100, 0., 3000.), 'GenJet_HT')
+#     h.Draw()                                 # the nominal; one event loop fills all of them
+#     variations.Write(outFile, [h], sumw=sumw)
+from collections import OrderedDict
+import ROOT
+
+# number of column arguments of the actions whose results are varied; the weight comes after them
+_columnArgs = {'Histo1D': 1, 'Histo2D': 2, 'Histo3D': 3, 'Sum': 1}
+
+
+class Variations(object):
+    '''Books every Histo1D/Histo2D/Sum once per variation, on the nodes of ana.
+
+    Args:
+        ana: TIMBER analyzer.
+        weights (dict): Variation name -> weight expression (or None). The first one is the nominal.
+        columns (dict): Variation name -> {column: replacement column}.
+        cache: Optional histcache.HistCache to book through.
+    '''
+    def __init__(self, ana, weights, columns=None, cache=None):
+        self._ana = ana
+        self.weights = OrderedDict(weights)
+        self.columns = columns or {}
+        self.nominal = next(iter(self.weights))
+        self._cache = cache
+        # id(df) -> [df, df with the weight columns, {expression: column}, defines]
+        self._frames = {}
+
+    def Histo1D(self, model, column, weight=None, node=None):
+        return self.Book('Histo1D', (model, column) + ((weight,) if weight else ()), node)
+
+    def Histo2D(self, model, x, y, weight=None, node=None):
+        return self.Book('Histo2D', (model, x, y) + ((weight,) if weight else ()), node)
+
+    def Count(self, node=None):
+        return self.Book('Count', (), node)
+
+    def Sum(self, column, node=None):
+        return self.Book('Sum', (column,), node)
+
+    def SumWeights(self, node=None):
+        '''Sum of the weight of every variation (the number of events for None), by default on the base node.'''
+        if node is None:
+            node = self._ana.BaseNode
+        df = node.DataFrame
+        results = OrderedDict()
+        for variation, weight in self.weights.items():
+            if weight is None:
+                results[variation] = self._BookOn('Count', (), node, df, ())
+            else:
+                column = self._Column(df, weight)
+                frame = self._Frame(df)
+                results[variation] = self._BookOn('Sum', (column,), node, frame[1], list(frame[3]))
+        return Varied(results, self.nominal)
+
+    def Book(self, action, args, node=None, df=None, extra=()):
+        '''Book df.<action>(*args) for every variation (see histcache.HistCache.Book for node, df and extra).
+        Returns a Varied result, or the plain result for actions that are not varied.'''
+        if node is None:
+            # a pruning analyzer defines the ObjectFromCollection() columns when they are first used (see pruning.py)
+            if hasattr(self._ana, 'Require'):
+                self._ana.Require(*args)
+                for replace in self.columns.values():
+                    self._ana.Require(*[replace.get(a, a) for a in args if isinstance(a, str)])
+            node = self._ana.GetActiveNode()
+        if df is None:
+            df = node.DataFrame
+        if action not in _columnArgs:
+            return self._BookOn(action, args, node, df, extra)
+        n = _columnArgs[action]
+        model, args = (args[:1], args[1:]) if action != 'Sum' else ((), args)
+        columns, weight = list(args[:n]), (args[n] if len(args) > n else None)
+        results = OrderedDict()
+        for variation, varWeight in self.weights.items():
+            replace = self.columns.get(variation, {})
+            varColumns = [replace.get(c, c) for c in columns]
+            w = _Product(replace.get(weight, weight), varWeight)
+            if action == 'Sum':
+                # a weighted sum is the sum of column * weight
+                if w is not None:
+                    varColumns = [self._Column(df, f'({varColumns[0]})*({w})')]
+                varArgs = tuple(varColumns)
+            else:
+                varArgs = model + tuple(varColumns) + ((self._Column(df, w),) if w is not None else ())
+            frame = self._Frame(df)
+            results[variation] = self._BookOn(action, varArgs, node, frame[1], list(extra) + frame[3])
+        return Varied(results, self.nominal)
+
+    def _BookOn(self, action, args, node, df, extra):
+        if self._cache is None:
+            return getattr(df, action)(*args)
+        return self._cache.Book(action, args, node=node, df=df, extra=extra)
+
+    def _Frame(self, df):
+        if id(df) not in self._frames:
+            self._frames[id(df)] = [df, df, {}, []]
+        return self._frames[id(df)]
+
+    def _Column(self, df, expression):
+        '''Name of a column of df (plus the weight columns defined here) holding expression.'''
+        frame = self._Frame(df)
+        if expression in [str(c) for c in df.GetColumnNames()]:
+            return expression
+        if expression not in frame[2]:
+            name = f'variationWeight_{len(frame[2])}'
+            frame[1] = frame[1].Define(name, expression)
+            frame[2][expression] = name
+            # the Defines made here are not TIMBER nodes, so they go into a HistCache key explicitly
+            frame[3].append(f'{name}={expression}')
+        return frame[2][expression]
+
+    def Outputs(self, hists=(), splits=(), sumw=None, nominal=False):
+        '''{variation: {name: object}} of everything to write per variation: the Varied results in hists
+        (a list, written under their own names), the Results(variation) of the CategorySplits in splits,
+        and genEventSumw (the sum of the variation's weights) if sumw (from SumWeights()) is given.
+        The nominal is included only if nominal=True.'''
+        outputs = OrderedDict()
+        for variation in self.weights:
+            if variation == self.nominal and not nominal:
+                continue
+            objects = outputs[variation] = OrderedDict()
+            for h in hists:
+                value = h.Variation(variation).GetValue()
+                objects[value.GetName()] = value
+            for split in splits:
+                for h in split.Results(variation).values():
+                    objects[h.GetName()] = h
+            if sumw is not None:
+                objects['genEventSumw'] = ROOT.TParameter('double')('genEventSumw', float(sumw.Variation(variation).GetValue()))
+        return outputs
+
+    def Write(self, directory, hists=(), splits=(), sumw=None, nominal=False):
+        '''Write Outputs() into one subdirectory of directory per variation.'''
+        for variation, objects in self.Outputs(hists, splits, sumw, nominal).items():
+            d = directory.mkdir(variation)
+            for name, obj in objects.items():
+                d.WriteTObject(obj, name)
+
+
+class Varied(object):
+    '''Results of one booking for every variation. Behaves like the nominal result.'''
+    def __init__(self, results, nominal):
+        self.variations = results
+        self.nominal = nominal
+
+    def Variation(self, name):
+        return self.variations[name]
+
+    def GetValue(self):
+        return self.variations[self.nominal].GetValue()
+
+    def __getattr__(self, name):
+        return getattr(self.variations[self.nominal], name)
+
+
+def NanoAODWeights(columns, nominal='genWeight', nScale=9, nPS=4, nPdf=0):
+    '''Standard weight variations for the NanoAOD weight columns among columns: LHEScaleWeight_<i>,
+    PSWeight_<i> and LHEPdfWeight_<i>, each times nominal (None for the bare factors). Missing entries
+    of an event count as 1.'''
+    columns = [str(c) for c in columns]
+    weights = OrderedDict()
+    for branch, n in (('LHEScaleWeight', nScale), ('PSWeight', nPS), ('LHEPdfWeight', nPdf)):
+        if branch not in columns:
+            continue
+        for i in range(n):
+            weights[f'{branch}_{i}'] = _Product(nominal, f'{branch}.size() > {i} ? {branch}[{i}] : 1.f')
+    return weights
+
+
+def _Product(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return f'({a})*({b})'